@@ -10,9 +10,13 @@ class DocumentConfig(AppConfig):
     def ready(self):
         import froide.document.signals  # noqa
 
+        from taggit.models import Tag
+
         from froide.helper.search import search_registry
+        from froide.helper.search.cache import connect_facet_model
 
         search_registry.register(add_search)
+        connect_facet_model(Tag)
 
 
 def add_search(request):
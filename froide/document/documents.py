@@ -1,23 +1,46 @@
-from django_elasticsearch_dsl import Document, fields
+import hashlib
+import json
+
+from elasticsearch_dsl import Keyword
+
+from django_elasticsearch_dsl import fields
 from django_elasticsearch_dsl.registries import registry
 
 from froide.helper.search import (
-    get_index, get_text_analyzer, get_search_analyzer,
+    SearchDocument, get_index, get_text_analyzer, get_search_analyzer,
     get_search_quote_analyzer
 )
 
 from filingcabinet.models import Page
 
 
+BULK_CHUNK_SIZE = 200
+
 index = get_index('documentpage')
 analyzer = get_text_analyzer()
 search_analyzer = get_search_analyzer()
 search_quote_analyzer = get_search_quote_analyzer()
 
 
+def get_source_hash(data):
+    source = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 @registry.register_document
 @index.document
-class PageDocument(Document):
+class PageDocument(SearchDocument):
     document = fields.IntegerField(attr='document_id')
 
     title = fields.TextField()
@@ -26,15 +49,15 @@ class PageDocument(Document):
     tags = fields.ListField(fields.KeywordField())
     created_at = fields.DateField()
 
-    publicbody = fields.IntegerField(attr='document.publicbody_id')
-    jurisdiction = fields.IntegerField(attr='document.publicbody.jurisdiction_id')
-    foirequest = fields.IntegerField(attr='document.foirequest_id')
-    campaign = fields.IntegerField(attr='document.foirequest.campaign_id')
+    publicbody = fields.IntegerField()
+    jurisdiction = fields.IntegerField()
+    foirequest = fields.IntegerField()
+    campaign = fields.IntegerField()
     collections = fields.IntegerField()
-    portal = fields.IntegerField(attr='document_portal_id')
+    portal = fields.IntegerField()
 
-    user = fields.IntegerField(attr='document.user_id')
-    team = fields.IntegerField(attr='document.team_id')
+    user = fields.IntegerField()
+    team = fields.IntegerField()
 
     public = fields.BooleanField()
 
@@ -45,17 +68,104 @@ class PageDocument(Document):
         search_quote_analyzer=search_quote_analyzer,
         index_options='offsets',
     )
+    # Hash of the other fields to skip reindexing unchanged pages
+    source_hash = Keyword(index=False)
+
+    # Metadata of the last seen document, pages come in document order
+    _document_data = None
 
     class Django:
         model = Page
         queryset_chunk_size = 50
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._document_data = {}
+
     def get_queryset(self):
         """Not mandatory but to improve performance we can select related in one sql request"""
         return super().get_queryset().select_related(
             'document',
+            'document__publicbody',
+            'document__foirequest',
         )
 
+    def get_document_data(self, document):
+        """
+        Resolves metadata shared by all pages of a document once
+        """
+        if document.id in self._document_data:
+            return self._document_data[document.id]
+        collections = document.document_documentcollection.all()
+        data = {
+            'tags': [tag.id for tag in document.tags.all()],
+            'created_at': document.created_at,
+            'public': document.is_public(),
+            'team': document.team_id or None,
+            'collections': list(collections.values_list('id', flat=True)),
+            'portal': document.portal_id or 0,
+            'publicbody': document.publicbody_id,
+            'jurisdiction': (
+                document.publicbody.jurisdiction_id
+                if document.publicbody_id else None
+            ),
+            'foirequest': document.foirequest_id,
+            'campaign': (
+                document.foirequest.campaign_id
+                if document.foirequest_id else None
+            ),
+            'user': document.user_id,
+        }
+        self._document_data = {document.id: data}
+        return data
+
+    def prepare(self, instance):
+        data = super().prepare(instance)
+        data['source_hash'] = get_source_hash(data)
+        return data
+
+    def update_instances(self, instances):
+        # Pages saved after OCR or redaction come through the index queue
+        return self.update_pages(instances)
+
+    def update_document(self, document, only_changed=True):
+        """
+        Streams pages of document into the bulk API
+        """
+        pages = Page.objects.filter(document=document).order_by('number')
+
+        def iter_pages():
+            for page in pages.iterator(chunk_size=BULK_CHUNK_SIZE):
+                page.document = document
+                yield page
+
+        return self.update_pages(iter_pages(), only_changed=only_changed)
+
+    def update_pages(self, pages, only_changed=True):
+        actions = self._get_actions(pages, 'index')
+        if only_changed:
+            actions = self.get_changed_actions(actions)
+        return self.bulk(actions, chunk_size=BULK_CHUNK_SIZE)
+
+    def get_changed_actions(self, actions):
+        """
+        Drops actions of pages whose indexed source hash is unchanged
+        """
+        es = self._get_connection()
+        for chunk in chunked(actions, BULK_CHUNK_SIZE):
+            result = es.mget(
+                index=self._index._name,
+                body={'ids': [action['_id'] for action in chunk]},
+                _source_includes=['source_hash']
+            )
+            indexed = {
+                doc['_id']: doc['_source'].get('source_hash')
+                for doc in result['docs'] if doc.get('found')
+            }
+            for action in chunk:
+                if indexed.get(str(action['_id'])) != action['_source']['source_hash']:
+                    yield action
+
     def prepare_title(self, obj):
         if obj.number == 1:
             if obj.document.title.endswith('.pdf'):
@@ -69,24 +179,34 @@ class PageDocument(Document):
         return ''
 
     def prepare_tags(self, obj):
-        return [tag.id for tag in obj.document.tags.all()]
+        return self.get_document_data(obj.document)['tags']
 
     def prepare_created_at(self, obj):
-        return obj.document.created_at
+        return self.get_document_data(obj.document)['created_at']
 
     def prepare_public(self, obj):
-        return obj.document.is_public()
+        return self.get_document_data(obj.document)['public']
 
     def prepare_team(self, obj):
-        if obj.document.team_id:
-            return obj.document.team_id
-        return None
+        return self.get_document_data(obj.document)['team']
 
     def prepare_collections(self, obj):
-        collections = obj.document.document_documentcollection.all()
-        return list(collections.values_list('id', flat=True))
+        return self.get_document_data(obj.document)['collections']
 
     def prepare_portal(self, obj):
-        if obj.document.portal_id:
-            return obj.document.portal_id
-        return 0
+        return self.get_document_data(obj.document)['portal']
+
+    def prepare_publicbody(self, obj):
+        return self.get_document_data(obj.document)['publicbody']
+
+    def prepare_jurisdiction(self, obj):
+        return self.get_document_data(obj.document)['jurisdiction']
+
+    def prepare_foirequest(self, obj):
+        return self.get_document_data(obj.document)['foirequest']
+
+    def prepare_campaign(self, obj):
+        return self.get_document_data(obj.document)['campaign']
+
+    def prepare_user(self, obj):
+        return self.get_document_data(obj.document)['user']
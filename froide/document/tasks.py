@@ -2,7 +2,7 @@ from django.contrib.auth import get_user_model
 
 from froide.celery import app as celery_app
 
-from .models import DocumentCollection
+from .models import Document, DocumentCollection
 from .services import UploadDocumentStorer
 
 User = get_user_model()
@@ -31,3 +31,17 @@ def store_document_upload(upload_urls, user_id, form_data, collection_id):
 
     for upload_url in upload_urls:
         storer.create_from_upload_url(upload_url)
+
+
+@celery_app.task(name='froide.document.tasks.update_document_index')
+def update_document_index_task(document_id):
+    from froide.helper.search.cache import bump_generation
+
+    from .documents import PageDocument
+
+    try:
+        document = Document.objects.get(id=document_id)
+    except Document.DoesNotExist:
+        return
+    PageDocument().update_document(document)
+    bump_generation('filingcabinet.page')
@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from filingcabinet.models import Page, CollectionDocument
+
+from froide.foirequest.tests import factories
+from froide.helper.tasks import update_instances
+
+from .documents import PageDocument
+from .models import Document, DocumentCollection
+from .tasks import update_document_index_task
+
+
+class PageDocumentTest(TestCase):
+    def setUp(self):
+        self.user = factories.UserFactory.create()
+        # bulk_create skips processing of the missing PDF file
+        self.document = Document.objects.bulk_create([
+            Document(title='Document', user=self.user, public=False)
+        ])[0]
+        Page.objects.bulk_create([
+            Page(document=self.document, number=number,
+                 content='Content of page %s' % number)
+            for number in range(1, 4)
+        ])
+        self.indexed = {}
+        self.actions = []
+
+    def get_pages(self):
+        return list(Page.objects.filter(
+            document=self.document
+        ).order_by('number'))
+
+    def index_pages(self):
+        doc = PageDocument()
+        for page in self.get_pages():
+            self.indexed[str(page.pk)] = doc.prepare(page)['source_hash']
+
+    def mget(self, index=None, body=None, **kwargs):
+        return {'docs': [{
+            '_id': str(pk),
+            'found': str(pk) in self.indexed,
+            '_source': {'source_hash': self.indexed.get(str(pk))}
+        } for pk in body['ids']]}
+
+    def mock_index(self):
+        es = mock.MagicMock()
+        es.mget.side_effect = self.mget
+        connection = mock.patch.object(
+            PageDocument, '_get_connection', return_value=es
+        )
+        bulk = mock.patch.object(
+            PageDocument, 'bulk',
+            side_effect=lambda actions, **kwargs: self.actions.extend(actions)
+        )
+        return connection, bulk
+
+    def test_document_data_shared_by_pages(self):
+        pages = self.get_pages()
+        for page in pages:
+            page.document = self.document
+        doc = PageDocument()
+        # Tags and collections are loaded once for all pages
+        with self.assertNumQueries(2):
+            data = [doc.prepare(page) for page in pages]
+        self.assertEqual([d['number'] for d in data], [1, 2, 3])
+        self.assertEqual(len({d['source_hash'] for d in data}), 3)
+
+    def test_unchanged_pages_are_skipped(self):
+        self.index_pages()
+        changed = self.get_pages()[1]
+        changed.content = 'New text after OCR'
+        changed.save()
+
+        connection, bulk = self.mock_index()
+        with connection, bulk:
+            update_document_index_task(self.document.id)
+        self.assertEqual([a['_id'] for a in self.actions], [changed.pk])
+
+        # Pages saved one by one go through the index queue
+        self.actions = []
+        with connection, bulk:
+            update_instances(Page, [p.pk for p in self.get_pages()])
+        self.assertEqual([a['_id'] for a in self.actions], [changed.pk])
+
+    def test_document_changes_reindex_pages(self):
+        self.index_pages()
+        collection = DocumentCollection.objects.create(
+            title='Collection', slug='collection', user=self.user
+        )
+        CollectionDocument.objects.create(
+            collection=collection, document=self.document
+        )
+        Document.objects.filter(id=self.document.id).update(public=True)
+
+        connection, bulk = self.mock_index()
+        with connection, bulk:
+            update_document_index_task(self.document.id)
+        self.assertEqual(len(self.actions), 3)
+        for action in self.actions:
+            self.assertIs(action['_source']['public'], True)
+            self.assertEqual(
+                action['_source']['collections'], [collection.id]
+            )
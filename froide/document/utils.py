@@ -1,6 +1,14 @@
-from froide.helper.tasks import search_instance_save
+from django.db import transaction
 
 
 def update_document_index(document):
-    for pk in document.pages.all().values_list('id', flat=True):
-        search_instance_save.delay('filingcabinet.page', pk)
+    """
+    Reindexes pages of document in one bulk stream after commit,
+    unchanged pages are skipped
+    """
+    from .tasks import update_document_index_task
+
+    document_id = document.id
+    transaction.on_commit(
+        lambda: update_document_index_task.delay(document_id)
+    )
@@ -35,6 +35,7 @@ from .tasks import convert_attachment_task, ocr_pdf_attachment
 from .widgets import AttachmentFileWidget
 from .services import ActivatePendingRequestService
 from .utils import update_foirequest_index
+from .cache import updating_requests, updating_attachments
 
 
 SUBJECT_REQUEST_ID = re.compile(r' \[#(\d+)\]')
@@ -112,27 +113,30 @@ class FoiRequestAdmin(admin.ModelAdmin):
             obj.get_absolute_url(), _('request page'))
 
     def mark_checked(self, request, queryset):
-        rows_updated = queryset.update(checked=True)
+        with updating_requests(queryset):
+            rows_updated = queryset.update(checked=True)
         update_foirequest_index(queryset)
         self.message_user(request,
             _("%d request(s) successfully marked as checked." % rows_updated))
     mark_checked.short_description = _("Mark selected requests as checked")
 
     def mark_not_foi(self, request, queryset):
-        rows_updated = queryset.update(
-            is_foi=False,
-            public=False,
-            visibility=FoiRequest.VISIBILITY.VISIBLE_TO_REQUESTER
-        )
+        with updating_requests(queryset):
+            rows_updated = queryset.update(
+                is_foi=False,
+                public=False,
+                visibility=FoiRequest.VISIBILITY.VISIBLE_TO_REQUESTER
+            )
         update_foirequest_index(queryset)
         self.message_user(request,
             _("%d request(s) successfully marked as not FoI." % rows_updated))
     mark_not_foi.short_description = _("Mark selected requests as not FoI")
 
     def mark_successfully_resolved(self, request, queryset):
-        rows_updated = queryset.update(
-            status='resolved', resolution='successful'
-        )
+        with updating_requests(queryset):
+            rows_updated = queryset.update(
+                status='resolved', resolution='successful'
+            )
         update_foirequest_index(queryset)
         self.message_user(request,
             _("%d request(s) have been marked as successfully resolved." %
@@ -140,9 +144,10 @@ class FoiRequestAdmin(admin.ModelAdmin):
     mark_successfully_resolved.short_description = _("Mark successfully resolved")
 
     def mark_refused(self, request, queryset):
-        rows_updated = queryset.update(
-            status='resolved', resolution='refused'
-        )
+        with updating_requests(queryset):
+            rows_updated = queryset.update(
+                status='resolved', resolution='refused'
+            )
         update_foirequest_index(queryset)
         self.message_user(request,
             _("%d request(s) have been marked as refused." %
@@ -172,7 +177,8 @@ class FoiRequestAdmin(admin.ModelAdmin):
             f = Form(request.POST)
             if f.is_valid():
                 req = f.cleaned_data['obj']
-                queryset.update(same_as=req)
+                with updating_requests(queryset):
+                    queryset.update(same_as=req)
                 count = FoiRequest.objects.filter(same_as=req).count()
                 FoiRequest.objects.filter(id=req.id).update(
                     same_as_count=count
@@ -213,7 +219,8 @@ class FoiRequestAdmin(admin.ModelAdmin):
     confirm_request.short_description = _("Confirm request if unconfirmed")
 
     def unpublish(self, request, queryset):
-        queryset.update(public=False, visibility=FoiRequest.VISIBILITY.VISIBLE_TO_REQUESTER)
+        with updating_requests(queryset):
+            queryset.update(public=False, visibility=FoiRequest.VISIBILITY.VISIBLE_TO_REQUESTER)
         update_foirequest_index(queryset)
         self.message_user(request, _("Selected requests are now unpublished."))
     unpublish.short_description = _("Unpublish")
@@ -232,7 +239,8 @@ class FoiRequestAdmin(admin.ModelAdmin):
     unblock_request.short_description = _("Unblock requests and send first message")
 
     def close_requests(self, request, queryset):
-        queryset.update(closed=True)
+        with updating_requests(queryset):
+            queryset.update(closed=True)
         update_foirequest_index(queryset)
     close_requests.short_description = _("Close requests")
 
@@ -495,17 +503,20 @@ class FoiAttachmentAdmin(admin.ModelAdmin):
                 args=(obj.belongs_to_id,)), _('See FoiMessage'))
 
     def approve(self, request, queryset):
-        rows_updated = queryset.update(approved=True)
+        with updating_attachments(queryset):
+            rows_updated = queryset.update(approved=True)
         self.message_user(request, _("%d attachment(s) successfully approved." % rows_updated))
     approve.short_description = _("Mark selected as approved")
 
     def disapprove(self, request, queryset):
-        rows_updated = queryset.update(approved=False)
+        with updating_attachments(queryset):
+            rows_updated = queryset.update(approved=False)
         self.message_user(request, _("%d attachment(s) successfully disapproved." % rows_updated))
     disapprove.short_description = _("Mark selected as disapproved")
 
     def cannot_approve(self, request, queryset):
-        rows_updated = queryset.update(can_approve=False, approved=False)
+        with updating_attachments(queryset):
+            rows_updated = queryset.update(can_approve=False, approved=False)
         self.message_user(request, _("%d attachment(s) successfully marked as not approvable/approved." % rows_updated))
     cannot_approve.short_description = _("Mark selected as not approvable/approved")
 
@@ -590,6 +601,8 @@ class DeferredMessageAdmin(admin.ModelAdmin):
         'recipient', 'timestamp', 'spam', 'delivered', 'sender',
         'request_last_message', 'request_status', 'request_page',)
     raw_id_fields = ('request',)
+    # Raw mail file is private and has no URL
+    exclude = ('mail_file',)
     actions = [
         'mark_as_spam', 'deliver_no_spam', 'redeliver', 'redeliver_subject',
         'close_request'
@@ -104,6 +104,10 @@ class FoiAttachmentSerializer(serializers.HyperlinkedModelSerializer):
         source='get_file_url',
         read_only=True
     )
+    redaction_progress = serializers.SerializerMethodField(
+        source='get_redaction_progress',
+        read_only=True
+    )
 
     class Meta:
         model = FoiAttachment
@@ -111,7 +115,7 @@ class FoiAttachmentSerializer(serializers.HyperlinkedModelSerializer):
         fields = (
             'resource_uri', 'id', 'belongs_to', 'name', 'filetype',
             'size', 'site_url', 'anchor_url', 'file_url', 'pending',
-            'is_converted', 'converted',
+            'redaction_progress', 'is_converted', 'converted',
             'approved', 'can_approve',
             'redacted', 'is_redacted', 'can_redact',
             'can_delete',
@@ -122,6 +126,9 @@ class FoiAttachmentSerializer(serializers.HyperlinkedModelSerializer):
     def get_file_url(self, obj):
         return obj.get_absolute_domain_file_url(authorized=True)
 
+    def get_redaction_progress(self, obj):
+        return obj.get_redaction_progress()
+
 
 class FoiAttachmentFilter(filters.FilterSet):
     class Meta:
@@ -13,7 +13,12 @@ class FoiRequestConfig(AppConfig):
         )
         from froide.account.export import registry
         from froide.helper.search import search_registry
+        from django.db.models.signals import post_save, post_delete
+        from django_comments import get_model
         from django_comments.signals import comment_will_be_posted
+        from taggit.models import Tag
+        from froide.helper.search.cache import connect_facet_model
+        from froide.publicbody.models import Jurisdiction, PublicBody
         from froide.foirequest import signals  # noqa
         from .utils import (
             cancel_user, merge_user, export_user_data, make_account_private
@@ -25,6 +30,17 @@ class FoiRequestConfig(AppConfig):
         registry.register(export_user_data)
         search_registry.register(add_search)
         comment_will_be_posted.connect(signals.pre_comment_foimessage)
+        comment_model = get_model()
+        post_save.connect(
+            signals.comment_fragment_update, sender=comment_model,
+            dispatch_uid='comment_fragment_update'
+        )
+        post_delete.connect(
+            signals.comment_fragment_update, sender=comment_model,
+            dispatch_uid='comment_fragment_remove'
+        )
+        for model in (Jurisdiction, PublicBody, Tag):
+            connect_facet_model(model)
 
 
 def add_search(request):
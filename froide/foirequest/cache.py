@@ -0,0 +1,198 @@
+"""
+Cache for rendered messages on the request page
+
+Fragments are keyed by message id, versions of the message, its request
+and the users and public bodies it shows, the viewer class and the
+language. Signal handlers increment the versions when these change,
+bulk updates of querysets have to bump them explicitly.
+Owner and moderator fragments contain CSRF tokens and forms of the
+viewer, their keys also include the CSRF cookie of the session.
+"""
+from contextlib import contextmanager
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+from .auth import (
+    can_write_foirequest, can_moderate_foirequest,
+    can_read_foirequest_anonymous
+)
+
+CACHE_PREFIX = 'foirequest:fragment'
+VERSION_PREFIX = '%s:version' % CACHE_PREFIX
+
+
+def get_message_version_key(message_id):
+    return '%s:message:%s' % (VERSION_PREFIX, message_id)
+
+
+def get_request_version_key(request_id):
+    return '%s:request:%s' % (VERSION_PREFIX, request_id)
+
+
+def get_user_version_key(user_id):
+    return '%s:user:%s' % (VERSION_PREFIX, user_id)
+
+
+def get_publicbody_version_key(publicbody_id):
+    return '%s:publicbody:%s' % (VERSION_PREFIX, publicbody_id)
+
+
+def make_version():
+    # Versions start at the current time so that a version
+    # evicted from the cache does not come back with an old value
+    return int(time.time() * 1000)
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, make_version(), timeout=None)
+
+
+def bump_message_version(message_id):
+    if message_id is None:
+        return
+    bump_version(get_message_version_key(message_id))
+
+
+def bump_request_version(request_id):
+    if request_id is None:
+        return
+    bump_version(get_request_version_key(request_id))
+
+
+def bump_user_version(user_id):
+    bump_version(get_user_version_key(user_id))
+
+
+def bump_publicbody_version(publicbody_id):
+    bump_version(get_publicbody_version_key(publicbody_id))
+
+
+@contextmanager
+def updating_requests(queryset):
+    """
+    Wrap bulk updates of a queryset of requests, ids are collected
+    before the update may change the rows the queryset matches
+    """
+    request_ids = list(queryset.values_list('id', flat=True))
+    yield
+    for request_id in request_ids:
+        bump_request_version(request_id)
+
+
+@contextmanager
+def updating_attachments(queryset):
+    """
+    Wrap bulk updates of a queryset of attachments
+    """
+    message_ids = set(queryset.values_list('belongs_to_id', flat=True))
+    yield
+    for message_id in message_ids:
+        bump_message_version(message_id)
+
+
+def get_message_version_keys(message):
+    keys = [get_message_version_key(message.id)]
+    if message.sender_user_id is not None:
+        keys.append(get_user_version_key(message.sender_user_id))
+    for publicbody_id in (message.sender_public_body_id,
+                          message.recipient_public_body_id):
+        if publicbody_id is not None:
+            keys.append(get_publicbody_version_key(publicbody_id))
+    return keys
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {k: make_version() for k in keys if k not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return versions
+
+
+def get_viewer_class(foirequest, request):
+    if can_write_foirequest(foirequest, request):
+        return 'owner'
+    if can_moderate_foirequest(foirequest, request):
+        return 'moderator'
+    if request.user.is_authenticated:
+        return None
+    if can_read_foirequest_anonymous(foirequest, request):
+        return None
+    return 'anonymous'
+
+
+def get_session_hash(request):
+    get_token(request)
+    csrf_cookie = request.META.get('CSRF_COOKIE', '')
+    return hashlib.sha256(csrf_cookie.encode('utf-8')).hexdigest()[:16]
+
+
+def prepare_message_fragments(foirequest, request):
+    """
+    Sets fragment_key and cached fragment on all messages of the request
+    with two cache round trips. Keys are None if messages of this
+    viewer are not cached.
+    """
+    messages = foirequest.messages
+    viewer = None
+    if settings.FOI_MESSAGE_FRAGMENT_CACHE:
+        viewer = get_viewer_class(foirequest, request)
+    if viewer not in settings.FOI_MESSAGE_FRAGMENT_CACHE_VIEWERS:
+        for message in messages:
+            message.fragment_key = None
+            message.fragment = None
+        return
+
+    request_keys = [get_request_version_key(foirequest.id)]
+    if foirequest.user_id is not None:
+        request_keys.append(get_user_version_key(foirequest.user_id))
+    message_keys = {m.id: get_message_version_keys(m) for m in messages}
+    versions = get_versions(list(
+        set(request_keys).union(*message_keys.values())
+    ))
+    request_version = '.'.join(str(versions.get(k)) for k in request_keys)
+    parts = [viewer, get_language()]
+    if viewer != 'anonymous':
+        parts.append(get_session_hash(request))
+    suffix = ':'.join(str(p) for p in parts)
+
+    for i, message in enumerate(messages):
+        message_version = '.'.join(
+            str(versions.get(k)) for k in message_keys[message.id]
+        )
+        message.fragment_key = '%s:%s:%s:%s:%d:%s' % (
+            CACHE_PREFIX, message.id, message_version,
+            request_version, int(i == 0), suffix
+        )
+    fragments = cache.get_many([m.fragment_key for m in messages])
+    for message in messages:
+        message.fragment = fragments.get(message.fragment_key)
+
+
+def get_message_fragment(message, request):
+    """
+    Returns (key, fragment) for the message,
+    key is None if it must not be cached
+    """
+    if not hasattr(message, 'fragment_key'):
+        prepare_message_fragments(message.request, request)
+    # Message may not be part of its request's message list
+    return getattr(message, 'fragment_key', None), getattr(
+        message, 'fragment', None
+    )
+
+
+def set_message_fragment(key, fragment):
+    cache.set(
+        key, fragment, timeout=settings.FOI_MESSAGE_FRAGMENT_CACHE_TIMEOUT
+    )
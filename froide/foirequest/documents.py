@@ -1,15 +1,42 @@
+from collections import defaultdict
+
 from django.template.loader import render_to_string
 
-from django_elasticsearch_dsl import Document, fields
+from django_elasticsearch_dsl import fields
 from django_elasticsearch_dsl.registries import registry
 
+from froide.account.models import User
+from froide.campaign.models import Campaign
 from froide.helper.search import (
-    get_index, get_text_analyzer, get_search_analyzer,
+    SearchDocument, get_index, get_text_analyzer, get_search_analyzer,
     get_search_quote_analyzer
 )
+from froide.helper.search.source import dump_instance, load_instance
+from froide.publicbody.models import PublicBody, Jurisdiction, FoiLaw
+
+from .models import FoiRequest, FoiAttachment, FoiProject
 
-from .models import FoiRequest
 
+# Fields stored for rendering list views from search hits,
+# must not contain secrets as the source is returned by the index
+REQUEST_LIST_FIELDS = (
+    'id', 'title', 'slug', 'description', 'summary', 'public_body',
+    'status', 'resolution', 'public', 'visibility', 'user', 'team',
+    'first_message', 'last_message', 'resolved_on', 'due_date',
+    'reference', 'same_as', 'same_as_count', 'project', 'law', 'costs',
+    'refusal_reason', 'checked', 'is_foi', 'campaign', 'jurisdiction',
+)
+PUBLICBODY_LIST_FIELDS = (
+    'id', 'name', 'slug', 'other_names', 'description', 'url', 'depth',
+    'classification', 'email', 'contact', 'address', 'request_note',
+    'number_of_requests', 'jurisdiction',
+)
+JURISDICTION_LIST_FIELDS = ('id', 'name', 'slug')
+PROJECT_LIST_FIELDS = ('id', 'title', 'slug', 'request_count', 'team')
+LAW_LIST_FIELDS = ('id', 'name', 'slug')
+CAMPAIGN_LIST_FIELDS = ('id', 'name', 'slug')
+SAME_AS_LIST_FIELDS = ('id', 'slug', 'same_as_count')
+USER_LIST_FIELDS = ('id', 'private')
 
 index = get_index('foirequest')
 analyzer = get_text_analyzer()
@@ -19,7 +46,7 @@ search_quote_analyzer = get_search_quote_analyzer()
 
 @registry.register_document
 @index.document
-class FoiRequestDocument(Document):
+class FoiRequestDocument(SearchDocument):
     content = fields.TextField(
         analyzer=analyzer,
         search_analyzer=search_analyzer,
@@ -50,20 +77,88 @@ class FoiRequestDocument(Document):
 
     public = fields.BooleanField()
 
+    list_data = fields.ObjectField(enabled=False)
+
+    source_field = 'list_data'
+
     class Django:
         model = FoiRequest
         queryset_chunk_size = 50
+        # Changes to these are fanned out in chunks by the index queue
+        related_models = [
+            PublicBody, Jurisdiction, FoiProject, FoiLaw, Campaign, User
+        ]
+        # Only changes to these fields are fanned out, request counts
+        # of public bodies and projects in list_data may lag behind
+        related_fields = {
+            PublicBody: (
+                'name', 'slug', 'other_names', 'description', 'url',
+                'depth', 'classification', 'email', 'contact', 'address',
+                'request_note', 'jurisdiction',
+            ),
+            Jurisdiction: JURISDICTION_LIST_FIELDS[1:],
+            FoiProject: ('title', 'slug', 'team'),
+            FoiLaw: LAW_LIST_FIELDS[1:],
+            Campaign: CAMPAIGN_LIST_FIELDS[1:],
+            User: USER_LIST_FIELDS[1:],
+        }
 
     def get_queryset(self):
         """Not mandatory but to improve performance we can select related in one sql request"""
         return FoiRequest.objects.select_related(
             'jurisdiction',
             'public_body',
+            'public_body__classification',
+            'project',
+            'law',
+            'campaign',
+            'same_as',
+            'user',
+        ).prefetch_related(
+            'tags',
+            'public_body__categories',
         )
 
+    def get_instances_from_related(self, related_instance):
+        if isinstance(related_instance, PublicBody):
+            return FoiRequest.objects.filter(public_body=related_instance)
+        if isinstance(related_instance, Jurisdiction):
+            return FoiRequest.objects.filter(jurisdiction=related_instance)
+        if isinstance(related_instance, FoiProject):
+            return FoiRequest.objects.filter(project=related_instance)
+        if isinstance(related_instance, FoiLaw):
+            return FoiRequest.objects.filter(law=related_instance)
+        if isinstance(related_instance, Campaign):
+            return FoiRequest.objects.filter(campaign=related_instance)
+        if isinstance(related_instance, User):
+            return FoiRequest.objects.filter(user=related_instance)
+        return None
+
+    def get_message_texts(self, obj):
+        """
+        Concatenates the stored redacted subject and text of every
+        visible message with its attachment names
+        """
+        messages = obj.foimessage_set.filter(
+            content_hidden=False
+        ).order_by('timestamp').values_list(
+            'id', 'subject_redacted', 'plaintext_redacted'
+        )
+        attachment_names = defaultdict(list)
+        attachments = FoiAttachment.objects.filter(
+            belongs_to__request=obj, belongs_to__content_hidden=False
+        ).order_by('id').values_list('belongs_to_id', 'name')
+        for message_id, name in attachments:
+            attachment_names[message_id].append(name)
+        return [
+            '\n'.join(t for t in [subject, text] + attachment_names[message_id] if t)
+            for message_id, subject, text in messages
+        ]
+
     def prepare_content(self, obj):
         return render_to_string('foirequest/search/foirequest_text.txt', {
-                'object': obj
+                'object': obj,
+                'message_texts': self.get_message_texts(obj)
         })
 
     def prepare_tags(self, obj):
@@ -81,17 +176,49 @@ class FoiRequestDocument(Document):
         if obj.public_body.classification is None:
             return []
         classification = obj.public_body.classification
-        return [classification.id] + [c.id for c in
-                classification.get_ancestors()]
+        return [classification.id] + classification.ancestor_ids
 
     def prepare_categories(self, obj):
         if obj.public_body:
             cats = obj.public_body.categories.all()
             return [o.id for o in cats] + [
-                    c.id for o in cats for c in o.get_ancestors()]
+                    c for o in cats for c in o.ancestor_ids]
         return []
 
     def prepare_team(self, obj):
         if obj.project and obj.project.team_id:
             return obj.project.team_id
         return None
+
+    def prepare_list_data(self, obj):
+        return {
+            'request': dump_instance(obj, REQUEST_LIST_FIELDS),
+            'public_body': dump_instance(
+                obj.public_body, PUBLICBODY_LIST_FIELDS
+            ),
+            'jurisdiction': dump_instance(
+                obj.jurisdiction, JURISDICTION_LIST_FIELDS
+            ),
+            'project': dump_instance(obj.project, PROJECT_LIST_FIELDS),
+            'law': dump_instance(obj.law, LAW_LIST_FIELDS),
+            'campaign': dump_instance(obj.campaign, CAMPAIGN_LIST_FIELDS),
+            'same_as': dump_instance(obj.same_as, SAME_AS_LIST_FIELDS),
+            'user': dump_instance(obj.user, USER_LIST_FIELDS),
+        }
+
+    @classmethod
+    def get_object_from_source(cls, data):
+        """
+        Builds a request with its list view relations from list_data
+        """
+        obj = load_instance(FoiRequest, data['request'])
+        relations = (
+            ('public_body', PublicBody), ('jurisdiction', Jurisdiction),
+            ('project', FoiProject), ('law', FoiLaw), ('campaign', Campaign),
+            ('same_as', FoiRequest), ('user', User),
+        )
+        for name, model in relations:
+            # Relations missing in older documents are loaded lazily
+            if name in data:
+                setattr(obj, name, load_instance(model, data[name]))
+        return obj
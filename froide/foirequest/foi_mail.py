@@ -4,17 +4,24 @@ import json
 from io import BytesIO
 import zipfile
 from email.utils import parseaddr
+import hashlib
 import random
-from typing import Iterator, Tuple, Optional
+import time
+from typing import Iterator, List, Tuple, Optional
+import uuid
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
 from django.core.mail import get_connection, EmailMessage, mail_managers
+from django.db import models
 from django.urls import reverse
 from django.utils.translation import override, gettext_lazy as _
 
 from froide.helper.email_utils import (
     EmailParser, get_mail_client, get_unread_mails,
-    make_address, unflag_mail
+    get_unread_mail_batches, make_address, unflag_mail
 )
 from froide.helper.name_generator import get_name_from_number
 
@@ -92,22 +99,55 @@ def _process_mail(mail_bytes, mail_uid=None, mail_type=None, manual=False):
             unflag_mail(mailbox, mail_uid)
 
 
+def _process_mail_file(mail_path, mail_uid=None):
+    """
+    Like _process_mail but parses the mail incrementally from a file
+    and spools attachments so large mails are never held in memory.
+    """
+    parser = EmailParser()
+    with open(mail_path, 'rb') as stream:
+        email = parser.parse_stream(stream)
+
+    try:
+        _deliver_mail(email, mail_file=mail_path)
+    finally:
+        for attachment in email.attachments:
+            attachment.close()
+
+    if mail_uid is not None:
+        with get_foi_mail_client() as mailbox:
+            unflag_mail(mailbox, mail_uid)
+
+
 def create_deferred(secret_mail, mail_bytes, spam=False,
                     sender_email=None,
                     subject=unknown_foimail_subject,
-                    body=unknown_foimail_message, request=None):
+                    body=unknown_foimail_message, request=None,
+                    mail_file=None):
     from .models import DeferredMessage
 
-    mail_string = ''
-    if mail_bytes is not None:
-        mail_string = base64.b64encode(mail_bytes).decode("utf-8")
-    DeferredMessage.objects.create(
+    deferred = DeferredMessage(
         recipient=secret_mail,
         sender=sender_email or '',
-        mail=mail_string,
         spam=spam,
         request=request
     )
+    if settings.FOI_EMAIL_DEFERRED_STORE_FILES:
+        filename = '%s.eml' % uuid.uuid4().hex
+        if mail_file is not None:
+            with open(mail_file, 'rb') as f:
+                deferred.mail_file.save(filename, File(f), save=False)
+        else:
+            deferred.mail_file.save(
+                filename, ContentFile(mail_bytes or b''), save=False
+            )
+    else:
+        if mail_file is not None:
+            with open(mail_file, 'rb') as f:
+                mail_bytes = f.read()
+        if mail_bytes is not None:
+            deferred.mail = base64.b64encode(mail_bytes).decode("utf-8")
+    deferred.save()
     if spam:
         # Do not notify on identified spam
         return
@@ -133,59 +173,269 @@ def get_alternative_mail(req):
     return '%s_%s@%s' % (name, req.pk, domains[0])
 
 
-def get_foirequest_from_mail(email):
-    from .models import FoiRequest
+class BloomFilter(object):
+    def __init__(self, capacity, hashes=7, bits_per_item=10):
+        self.size = max(capacity * bits_per_item, 1024)
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, item):
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self.get_positions(item):
+            self.bits[pos // 8] |= 1 << (pos % 8)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[pos // 8] & (1 << (pos % 8))
+            for pos in self.get_positions(item)
+        )
+
 
-    if '_' in email:
+class SpamSenderFilter(object):
+    """
+    Membership test for senders of known spam.
+    Known spammers are answered from an exact set in the cache,
+    a bloom filter built from the database answers all other senders.
+    Only bloom filter false positives hit the database.
+    """
+    CACHE_PREFIX = 'foimail:spamsender'
+    CACHE_TTL = 24 * 60 * 60
+    BLOOM_TTL = 60 * 60
+
+    def __init__(self):
+        self.bloom = None
+        self.bloom_expires = 0
+        self.version = None
+
+    def get_bloom(self):
+        from .models import DeferredMessage
+
+        now = time.monotonic()
+        if self.bloom is None or self.bloom_expires < now:
+            self.version = cache.get(self.get_version_key(), 0)
+            senders = DeferredMessage.objects.filter(
+                spam=True
+            ).values_list('sender', flat=True).distinct()
+            senders = [sender for sender in senders.iterator() if sender]
+            bloom = BloomFilter(len(senders))
+            for sender in senders:
+                bloom.add(sender)
+            self.bloom = bloom
+            self.bloom_expires = now + self.BLOOM_TTL
+        return self.bloom
+
+    def get_version_key(self):
+        return '%s:version' % self.CACHE_PREFIX
+
+    def get_cache_key(self, sender_email):
+        sender_hash = hashlib.md5(sender_email.encode('utf-8')).hexdigest()
+        return '%s:%s:%s' % (self.CACHE_PREFIX, self.version, sender_hash)
+
+    def is_spammer(self, sender_email):
+        from .models import DeferredMessage
+
+        if not sender_email:
+            return False
+        bloom = self.get_bloom()
+        cache_key = self.get_cache_key(sender_email)
+        is_spammer = cache.get(cache_key)
+        if is_spammer is not None:
+            return is_spammer
+        if sender_email not in bloom:
+            return False
+        is_spammer = DeferredMessage.objects.filter(
+            sender=sender_email, spam=True
+        ).exists()
+        cache.set(cache_key, is_spammer, self.CACHE_TTL)
+        return is_spammer
+
+    def update(self, deferred_message, deleted=False):
+        """
+        Keep filter in sync when a deferred message changes
+        """
+        from .models import DeferredMessage
+
+        sender_email = deferred_message.sender
+        if not sender_email:
+            return
+        bloom = self.get_bloom()
+        cache_key = self.get_cache_key(sender_email)
+        if deferred_message.spam and not deleted:
+            bloom.add(sender_email)
+            cache.set(cache_key, True, self.CACHE_TTL)
+            return
+        if sender_email not in bloom:
+            # Sender was never known as spammer
+            return
+        is_spammer = DeferredMessage.objects.filter(
+            sender=sender_email, spam=True
+        ).exists()
+        cache.set(cache_key, is_spammer, self.CACHE_TTL)
+
+    def clear(self):
+        version_key = self.get_version_key()
+        cache.set(version_key, cache.get(version_key, 0) + 1, None)
+        self.bloom = None
+
+
+spam_sender_filter = SpamSenderFilter()
+
+
+class MailRecipientResolver(object):
+    """
+    Resolves recipients of incoming mail to requests.
+    Built once per worker with precompiled domain suffixes, resolves all
+    recipients of a mail with a constant number of queries.
+    """
+
+    def __init__(self, domains):
+        self.domains = tuple(domains)
+        self.domain_suffixes = tuple('@%s' % d.lower() for d in self.domains)
+
+    def get_recipients(self, email):
+        received_list = (email.to + email.cc +
+                         email.resent_to + email.resent_cc)
+        recipients = []
+        already = set()
+        for _name, address in received_list:
+            address = address.lower()
+            if not address.endswith(self.domain_suffixes):
+                continue
+            # normalize to first FOI_EMAIL_DOMAIN
+            address = '@'.join((address.split('@')[0], self.domains[0]))
+            if address in already:
+                continue
+            already.add(address)
+            recipients.append(address)
+        return recipients
+
+    def parse_recipient(self, email):
+        """
+        Returns request id for generated addresses or None
+        if the address needs to be looked up as secret address.
+        Returns False if the address can't belong to a request.
+        """
+        if '_' not in email:
+            return None
         name, domain = email.split('@', 1)
         hero, num = name.rsplit('_', 1)
         try:
             num = int(num)
         except ValueError:
-            return None
-        hero_name = get_name_from_number(num)
-        if hero_name != hero:
-            return None
-        try:
-            return FoiRequest.objects.get(pk=num)
-        except FoiRequest.DoesNotExist:
-            return None
+            return False
+        if get_name_from_number(num) != hero:
+            return False
+        return num
+
+    def get_foirequests(self, recipients):
+        """
+        Returns a mapping of recipient to request (or None)
+        for all recipients in bulk.
+        """
+        from .models import FoiRequest
+
+        request_ids = {}
+        secret_mails = []
+        for recipient in recipients:
+            parsed = self.parse_recipient(recipient)
+            if parsed is None:
+                secret_mails.append(recipient)
+            elif parsed is not False:
+                request_ids[recipient] = parsed
+
+        result = {recipient: None for recipient in recipients}
+        if request_ids or secret_mails:
+            foirequests = FoiRequest.objects.filter(
+                models.Q(pk__in=request_ids.values()) |
+                models.Q(secret_address__in=secret_mails)
+            ).select_related('public_body')
+            by_id = {}
+            by_secret = {}
+            for foirequest in foirequests:
+                by_id[foirequest.id] = foirequest
+                by_secret[foirequest.secret_address] = foirequest
+            for recipient in recipients:
+                if recipient in request_ids:
+                    result[recipient] = by_id.get(request_ids[recipient])
+                else:
+                    result[recipient] = by_secret.get(recipient)
+
+        unresolved = [r for r, req in result.items() if req is None]
+        if unresolved:
+            result.update(self.get_deferred_foirequests(unresolved))
+        return result
+
+    def get_deferred_foirequests(self, recipients):
+        """
+        Find previous non-spam matching of deferred messages
+        """
+        from .models import DeferredMessage, FoiRequest
+
+        deferred = DeferredMessage.objects.filter(
+            recipient__in=recipients, request__isnull=False,
+            spam=False
+        ).values_list('recipient', 'request_id')
+        request_ids = {}
+        for recipient, request_id in deferred:
+            request_ids.setdefault(recipient, set()).add(request_id)
+        # Can't do automatic matching if there is more than one request
+        request_ids = {
+            recipient: list(ids)[0] for recipient, ids in request_ids.items()
+            if len(ids) == 1
+        }
+        if not request_ids:
+            return {}
+        foirequests = FoiRequest.objects.filter(
+            id__in=request_ids.values()
+        ).select_related('public_body').in_bulk()
+        return {
+            recipient: foirequests.get(request_id)
+            for recipient, request_id in request_ids.items()
+        }
 
-    else:
-        try:
-            return FoiRequest.objects.get_by_secret_mail(email)
-        except FoiRequest.DoesNotExist:
-            return None
+    def is_known_spammer(self, sender_email):
+        return spam_sender_filter.is_spammer(sender_email)
 
 
-def _deliver_mail(email, mail_bytes=None, manual=False):
-    received_list = (email.to + email.cc +
-                     email.resent_to + email.resent_cc)
-    received_list = [(r[0], r[1].lower()) for r in received_list]
+_mail_resolver = None
 
-    domains = get_foi_mail_domains()
 
-    def mail_filter(x):
-        return x[1].endswith(tuple(["@%s" % d for d in domains]))
+def get_mail_resolver():
+    global _mail_resolver
 
-    received_list = [r for r in received_list if mail_filter(r)]
+    domains = tuple(get_foi_mail_domains())
+    if _mail_resolver is None or _mail_resolver.domains != domains:
+        _mail_resolver = MailRecipientResolver(domains)
+    return _mail_resolver
 
-    # normalize to first FOI_EMAIL_DOMAIN
-    received_list = [(x[0], '@'.join(
-        (x[1].split('@')[0], domains[0]))) for x in received_list]
+
+def get_foirequest_from_mail(email):
+    resolver = get_mail_resolver()
+    return resolver.get_foirequests([email])[email]
+
+
+def _deliver_mail(email, mail_bytes=None, manual=False, mail_file=None):
+    resolver = get_mail_resolver()
+    recipients = resolver.get_recipients(email)
+    if not recipients:
+        return
 
     sender_email = email.from_[1]
+    foirequests = resolver.get_foirequests(recipients)
+    # Public body of the sender by request id
+    publicbodies = {}
 
-    already = set()
-    for received in received_list:
-        recipient_email = received[1]
-        if recipient_email in already:
-            continue
-        already.add(recipient_email)
+    for recipient_email in recipients:
         foirequest, pb = check_delivery_conditions(
             recipient_email, sender_email,
             parsed_email=email, mail_bytes=mail_bytes,
-            manual=manual
+            manual=manual, foirequest=foirequests[recipient_email],
+            mail_file=mail_file, publicbodies=publicbodies
         )
         if foirequest is not None:
             add_message_from_email(foirequest, email, publicbody=pb)
@@ -204,38 +454,32 @@ def add_message_from_email(foirequest, email, publicbody=None):
 
 def check_delivery_conditions(recipient_mail, sender_email,
                               parsed_email=None,
-                              mail_bytes=b'', manual=False):
-    from .models import DeferredMessage, FoiRequest
-
+                              mail_bytes=b'', manual=False,
+                              foirequest=None, mail_file=None,
+                              publicbodies=None):
+    """
+    foirequest is the request resolved for recipient_mail,
+    None if it could not be resolved. publicbodies caches
+    the public body of the sender by request id.
+    """
     if (not settings.FOI_EMAIL_FIXED_FROM_ADDRESS and
             recipient_mail == settings.FOI_EMAIL_HOST_USER):
         # foi mailbox email, but custom email required, dropping
         return None, None
 
-    previous_spam_sender = DeferredMessage.objects.filter(
-        sender=sender_email, spam=True
-    ).exists()
-    if previous_spam_sender:
+    resolver = get_mail_resolver()
+    if resolver.is_known_spammer(sender_email):
         # Drop previous spammer
         return None, None
 
-    foirequest = get_foirequest_from_mail(recipient_mail)
-    if not foirequest:
-        # Find previous non-spam matching
-        request_ids = DeferredMessage.objects.filter(
-            recipient=recipient_mail, request__isnull=False,
-            spam=False
-        ).values_list('request_id', flat=True)
-        if len(set(request_ids)) != 1:
-            # Can't do automatic matching!
-            create_deferred(
-                recipient_mail, mail_bytes,
-                sender_email=sender_email,
-                spam=None
-            )
-            return None, None
-        else:
-            foirequest = FoiRequest.objects.get(id=list(request_ids)[0])
+    if foirequest is None:
+        # Can't do automatic matching!
+        create_deferred(
+            recipient_mail, mail_bytes,
+            sender_email=sender_email,
+            spam=None, mail_file=mail_file
+        )
+        return None, None
 
     pb = None
     if not manual:
@@ -244,28 +488,27 @@ def check_delivery_conditions(recipient_mail, sender_email,
             return None, None
 
         # Check for spam
-        pb = get_publicbody_for_email(
-            sender_email, foirequest, include_deferred=True
-        )
+        if publicbodies is None:
+            publicbodies = {}
+        if foirequest.id not in publicbodies:
+            publicbodies[foirequest.id] = get_publicbody_for_email(
+                sender_email, foirequest, include_deferred=True
+            )
+        pb = publicbodies[foirequest.id]
 
         if pb is None:
-            is_spammer = None
-            if sender_email is not None:
-                is_spammer = DeferredMessage.objects.filter(
-                    sender=sender_email, spam=True).exists()
-                # If no spam found, treat as unknown
-                is_spammer = is_spammer or None
-
             if parsed_email.bounce_info.is_bounce:
                 return foirequest, None
 
+            # Known spammers have been dropped above, treat as unknown
             create_deferred(
                 recipient_mail, mail_bytes,
-                spam=is_spammer,
+                spam=None,
                 sender_email=sender_email,
                 subject=_('Possible Spam Mail received'),
                 body=spam_message,
-                request=foirequest
+                request=foirequest,
+                mail_file=mail_file
             )
             return None, None
     return foirequest, pb
@@ -287,6 +530,41 @@ def _fetch_mail(flag_in_process=True) -> Iterator[Tuple[Optional[str], bytes]]:
         yield from get_unread_mails(mailbox, flag=flag_in_process)
 
 
+def _fetch_mail_batches(
+        flag_in_process=True) -> Iterator[List[Tuple[Optional[str], bytes]]]:
+    with get_foi_mail_client() as mailbox:
+        yield from get_unread_mail_batches(
+            mailbox, flag=flag_in_process,
+            batch_size=settings.FOI_EMAIL_FETCH_BATCH_SIZE
+        )
+
+
+def get_mail_spool_storage():
+    return FileSystemStorage(location=settings.FOI_EMAIL_SPOOL_ROOT)
+
+
+def spool_mail(mail_bytes):
+    """
+    Writes raw mail to the spool directory and returns the spool name
+    so only the name needs to go through the broker.
+    """
+    storage = get_mail_spool_storage()
+    name = '%s.eml' % uuid.uuid4().hex
+    return storage.save(name, ContentFile(mail_bytes))
+
+
+def get_spooled_mail_path(spool_name):
+    storage = get_mail_spool_storage()
+    if not storage.exists(spool_name):
+        return None
+    return storage.path(spool_name)
+
+
+def remove_spooled_mail(spool_name):
+    storage = get_mail_spool_storage()
+    storage.delete(spool_name)
+
+
 def fetch_and_process():
     count = 0
     for mail_uid, rfc_data in _fetch_mail(flag_in_process=False):
@@ -0,0 +1,87 @@
+import imaplib
+import logging
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import translation
+from django.conf import settings
+
+from froide.helper.email_utils import get_unread_mail_batches, imap_idle
+from froide.foirequest.foi_mail import get_foi_mail_client
+from froide.foirequest.tasks import dispatch_mail_batches
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 100
+
+
+class Command(BaseCommand):
+    help = (
+        "Keeps one IMAP connection open and processes mail "
+        "as soon as the server announces it via IDLE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-timeout', type=int, default=29 * 60,
+            help='Seconds to wait in IDLE before re-checking the inbox'
+        )
+        parser.add_argument(
+            '--max-backoff', type=int, default=5 * 60,
+            help='Maximum seconds to wait between reconnection attempts'
+        )
+
+    def handle(self, *args, **options):
+        translation.activate(settings.LANGUAGE_CODE)
+
+        self.latencies = []
+        backoff = 1
+        while True:
+            try:
+                self.listen(options['idle_timeout'])
+            except KeyboardInterrupt:
+                break
+            except (imaplib.IMAP4.error, OSError) as e:
+                if self.connected:
+                    backoff = 1
+                logger.warning(
+                    'IMAP listener error, reconnecting in %ds: %s', backoff, e
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, options['max_backoff'])
+
+    def listen(self, idle_timeout):
+        self.connected = False
+        with get_foi_mail_client() as mailbox:
+            self.connected = True
+            logger.info('IMAP listener connected')
+            notified = time.monotonic()
+            while True:
+                self.dispatch(mailbox, notified)
+                if imap_idle(mailbox, timeout=idle_timeout):
+                    notified = time.monotonic()
+                else:
+                    notified = None
+
+    def dispatch(self, mailbox, notified):
+        stats = dispatch_mail_batches(get_unread_mail_batches(
+            mailbox, flag=True,
+            batch_size=settings.FOI_EMAIL_FETCH_BATCH_SIZE
+        ))
+        if not stats['messages']:
+            return
+        if notified is not None:
+            self.latencies.append(time.monotonic() - notified)
+            self.latencies = self.latencies[-LATENCY_WINDOW:]
+        self.stdout.write(
+            'Dispatched %(messages)d mails (%(bytes)d bytes) '
+            'in %(duration).2fs' % stats
+        )
+        if self.latencies:
+            logger.info(
+                'Mail intake latency: median %.3fs, max %.3fs '
+                '(last %d dispatches)',
+                statistics.median(self.latencies), max(self.latencies),
+                len(self.latencies)
+            )
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import froide.foirequest.models.deferred
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foirequest', '0047_auto_20200823_1300'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deferredmessage',
+            name='mail_file',
+            field=models.FileField(blank=True, max_length=255, upload_to=froide.foirequest.models.deferred.deferred_mail_upload_to),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foirequest', '0048_deferredmessage_mail_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foiattachment',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='File hash'),
+        ),
+    ]
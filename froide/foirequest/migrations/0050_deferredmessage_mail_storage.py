@@ -0,0 +1,38 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:00
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+import froide.foirequest.models.deferred
+
+
+def move_mail_files(apps, schema_editor):
+    DeferredMessage = apps.get_model('foirequest', 'DeferredMessage')
+    storage = froide.foirequest.models.deferred.DeferredMailStorage()
+    for deferred in DeferredMessage.objects.exclude(mail_file=''):
+        name = deferred.mail_file.name
+        if not default_storage.exists(name):
+            continue
+        with default_storage.open(name, 'rb') as f:
+            new_name = storage.save(name, f)
+        if new_name != name:
+            DeferredMessage.objects.filter(id=deferred.id).update(
+                mail_file=new_name
+            )
+        default_storage.delete(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foirequest', '0049_foiattachment_file_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deferredmessage',
+            name='mail_file',
+            field=models.FileField(blank=True, max_length=255, storage=froide.foirequest.models.deferred.DeferredMailStorage(), upload_to=froide.foirequest.models.deferred.deferred_mail_upload_to),
+        ),
+        migrations.RunPython(move_mail_files, migrations.RunPython.noop),
+    ]
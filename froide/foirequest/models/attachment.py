@@ -2,6 +2,7 @@ from datetime import timedelta
 
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.dispatch import Signal
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -9,13 +10,15 @@ from django.utils import timezone
 
 from filingcabinet.pdf_utils import can_convert_to_pdf
 
-from froide.helper.storage import HashedFilenameStorage
+from froide.helper.conversion_cache import purge_cached_conversions
+from froide.helper.storage import HashedFilenameStorage, sha256
 from froide.document.models import Document
 
 from .message import FoiMessage
 
 
 DELETE_TIMEFRAME = timedelta(hours=36)
+REDACTION_PROGRESS_TIMEOUT = 60 * 10
 
 PDF_FILETYPES = (
     'application/pdf',
@@ -120,6 +123,9 @@ class FoiAttachment(models.Model):
         db_index=True
     )
     size = models.IntegerField(_("Size"), blank=True, null=True)
+    file_hash = models.CharField(
+        _("File hash"), blank=True, max_length=64, db_index=True
+    )
     filetype = models.CharField(_("File type"), blank=True, max_length=100)
     format = models.CharField(_("Format"), blank=True, max_length=100)
     can_approve = models.BooleanField(_("User can approve"), default=True)
@@ -164,6 +170,38 @@ class FoiAttachment(models.Model):
     def get_html_id(self):
         return _("attachment-%(id)d") % {"id": self.id}
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'file' in field_names:
+            instance._hashed_file_name = instance.file.name
+        return instance
+
+    def save(self, *args, **kwargs):
+        hashed_file_name = getattr(self, '_hashed_file_name', None)
+        if self.file_hash and self.file.name != hashed_file_name:
+            # File was replaced, hash is computed again on demand
+            self.file_hash = ''
+        super().save(*args, **kwargs)
+
+    def get_file_hash(self):
+        """
+        SHA256 of file content, computed once and stored
+        until the file is replaced
+        """
+        if not self.file_hash and self.file:
+            self.file.open(mode='rb')
+            try:
+                self.file_hash = sha256(self.file)
+            finally:
+                self.file.close()
+            self._hashed_file_name = self.file.name
+            if self.pk:
+                FoiAttachment.objects.filter(pk=self.pk).update(
+                    file_hash=self.file_hash
+                )
+        return self.file_hash
+
     def get_bytes(self):
         self.file.open(mode='rb')
         try:
@@ -315,6 +353,21 @@ class FoiAttachment(models.Model):
                 self.document.public = should_be_public
                 self.document.save()
 
+    def get_redaction_progress_key(self):
+        return 'foiattachment:redaction_progress:%s' % self.id
+
+    def get_redaction_progress(self):
+        if not self.pending:
+            return None
+        return cache.get(self.get_redaction_progress_key())
+
+    def set_redaction_progress(self, done, total):
+        cache.set(
+            self.get_redaction_progress_key(),
+            {'done': done, 'total': total},
+            REDACTION_PROGRESS_TIMEOUT
+        )
+
     def remove_file_and_delete(self):
         if self.file:
             other_references = FoiAttachment.objects.filter(
@@ -322,6 +375,7 @@ class FoiAttachment(models.Model):
             ).exclude(id=self.id).exists()
             if not other_references:
                 self.file.delete(save=False)
+                purge_cached_conversions(self.file_hash)
         self.delete()
 
     def can_convert_to_pdf(self):
@@ -1,6 +1,10 @@
 import base64
 
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
 from django.utils.translation import gettext_lazy as _
 
 from .request import FoiRequest
@@ -17,6 +21,25 @@ class DeferredMessageManager(models.Manager):
             return deferred.request.public_body
 
 
+def deferred_mail_upload_to(instance, filename):
+    return 'deferred-mail/%s/%s' % (
+        timezone.now().strftime('%Y/%m'), filename
+    )
+
+
+@deconstructible
+class DeferredMailStorage(FileSystemStorage):
+    """
+    Raw mail is private correspondence, it is stored
+    outside of the media root and has no URL
+    """
+    def __init__(self):
+        super().__init__(location=settings.FOI_EMAIL_DEFERRED_ROOT)
+
+    def url(self, name):
+        raise ValueError('Deferred mail is not served')
+
+
 class DeferredMessage(models.Model):
     recipient = models.CharField(max_length=255, blank=True)
     sender = models.CharField(max_length=255, blank=True)
@@ -24,6 +47,10 @@ class DeferredMessage(models.Model):
     request = models.ForeignKey(FoiRequest, null=True, blank=True,
         on_delete=models.CASCADE)
     mail = models.TextField(blank=True)
+    mail_file = models.FileField(
+        upload_to=deferred_mail_upload_to, max_length=255, blank=True,
+        storage=DeferredMailStorage()
+    )
     spam = models.NullBooleanField(null=True, default=False)
     delivered = models.BooleanField(default=False)
 
@@ -42,6 +69,9 @@ class DeferredMessage(models.Model):
         }
 
     def encoded_mail(self):
+        if self.mail_file:
+            with self.mail_file.open('rb') as f:
+                return f.read()
         return base64.b64decode(self.mail)
 
     def decoded_mail(self):
@@ -54,7 +84,7 @@ class DeferredMessage(models.Model):
         self.delivered = True
         self.spam = False
         self.save()
-        mail = base64.b64decode(self.mail)
+        mail = self.encoded_mail()
         mail = mail.replace(self.recipient.encode('utf-8'),
                             self.request.secret_address.encode('utf-8'))
         process_mail.delay(mail, manual=True)
@@ -1,10 +1,19 @@
+from django.conf import settings
 from django.db.models import signals
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
 from froide.helper.email_sending import mail_registry
+from froide.helper.search.index_queue import queue_index_update
 
-from .models import FoiRequest, FoiMessage, FoiAttachment, FoiEvent, FoiProject
+from .cache import (
+    bump_message_version, bump_request_version, bump_user_version,
+    bump_publicbody_version
+)
+from .models import (
+    FoiRequest, FoiMessage, FoiAttachment, FoiEvent, FoiProject,
+    DeferredMessage, DeliveryStatus
+)
 from .utils import send_request_user_email
 
 
@@ -39,12 +48,13 @@ confirm_foi_message_sent_email = mail_registry.register(
 
 
 def trigger_index_update(klass, instance_pk):
-    """ Trigger index update by save """
-    try:
-        obj = klass.objects.get(pk=instance_pk)
-    except klass.DoesNotExist:
+    """
+    Mark instance dirty for the search index,
+    the row itself is not written
+    """
+    if instance_pk is None:
         return
-    obj.save()
+    queue_index_update(klass._meta.label_lower, instance_pk)
 
 
 @receiver(FoiRequest.became_overdue,
@@ -196,7 +206,7 @@ def increment_request_count(sender, **kwargs):
     if not sender.public_body:
         return
     sender.public_body.number_of_requests += 1
-    sender.public_body.save()
+    sender.public_body.save(update_fields=['number_of_requests'])
 
 
 @receiver(signals.pre_delete, sender=FoiRequest,
@@ -207,7 +217,25 @@ def decrement_request_count(sender, instance=None, **kwargs):
     instance.public_body.number_of_requests -= 1
     if instance.public_body.number_of_requests < 0:
         instance.public_body.number_of_requests = 0
-    instance.public_body.save()
+    instance.public_body.save(update_fields=['number_of_requests'])
+
+
+# Mail intake
+
+@receiver(signals.post_save, sender=DeferredMessage,
+        dispatch_uid='deferredmessage_update_spam_filter')
+def deferredmessage_update_spam_filter(instance, **kwargs):
+    from .foi_mail import spam_sender_filter
+
+    spam_sender_filter.update(instance)
+
+
+@receiver(signals.post_delete, sender=DeferredMessage,
+        dispatch_uid='deferredmessage_delete_update_spam_filter')
+def deferredmessage_delete_update_spam_filter(instance, **kwargs):
+    from .foi_mail import spam_sender_filter
+
+    spam_sender_filter.update(instance, deleted=True)
 
 
 # Indexing
@@ -231,6 +259,8 @@ def foimessage_delayed_remove(instance, **kwargs):
 def foiattachment_delayed_update(instance, created=False, **kwargs):
     if created and kwargs.get('raw', False):
         return
+    if instance.belongs_to_id is None:
+        return
     trigger_index_update(FoiRequest, instance.belongs_to.request_id)
 
 
@@ -245,6 +275,66 @@ def foiattachment_delayed_remove(instance, **kwargs):
         pass
 
 
+# Message fragment cache
+
+@receiver(signals.post_save, sender=FoiRequest,
+        dispatch_uid='foirequest_fragment_update')
+def foirequest_fragment_update(instance, **kwargs):
+    bump_request_version(instance.id)
+
+
+@receiver(signals.post_save, sender=FoiMessage,
+        dispatch_uid='foimessage_fragment_update')
+@receiver(signals.post_delete, sender=FoiMessage,
+        dispatch_uid='foimessage_fragment_remove')
+def foimessage_fragment_update(instance, **kwargs):
+    bump_message_version(instance.id)
+
+
+@receiver(signals.post_save, sender=FoiAttachment,
+        dispatch_uid='foiattachment_fragment_update')
+@receiver(signals.post_delete, sender=FoiAttachment,
+        dispatch_uid='foiattachment_fragment_remove')
+@receiver(signals.post_save, sender=DeliveryStatus,
+        dispatch_uid='deliverystatus_fragment_update')
+@receiver(signals.post_save, sender='guide.Guidance',
+        dispatch_uid='guidance_fragment_update')
+@receiver(signals.post_delete, sender='guide.Guidance',
+        dispatch_uid='guidance_fragment_remove')
+@receiver(signals.post_save, sender='problem.ProblemReport',
+        dispatch_uid='problemreport_fragment_update')
+@receiver(signals.post_delete, sender='problem.ProblemReport',
+        dispatch_uid='problemreport_fragment_remove')
+def message_part_fragment_update(instance, **kwargs):
+    if hasattr(instance, 'belongs_to_id'):
+        bump_message_version(instance.belongs_to_id)
+    else:
+        bump_message_version(instance.message_id)
+
+
+@receiver(signals.post_save, sender=settings.AUTH_USER_MODEL,
+        dispatch_uid='user_fragment_update')
+def user_fragment_update(instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_user_version(instance.id)
+
+
+@receiver(signals.post_save, sender='publicbody.PublicBody',
+        dispatch_uid='publicbody_fragment_update')
+def publicbody_fragment_update(instance, **kwargs):
+    bump_publicbody_version(instance.id)
+
+
+def comment_fragment_update(instance, **kwargs):
+    from django.contrib.contenttypes.models import ContentType
+
+    ct = ContentType.objects.get_for_model(FoiMessage)
+    if instance.content_type_id != ct.id:
+        return
+    bump_message_version(instance.object_pk)
+
+
 # Event creation
 
 @receiver(FoiRequest.message_sent, dispatch_uid="create_event_message_sent")
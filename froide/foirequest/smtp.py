@@ -36,9 +36,9 @@ class EmailBackend(DjangoEmailBackend):
         recipients = [sanitize_address(addr, encoding) for addr in email_message.recipients()]
         try:
             message = email_message.message()
-            self.connection.sendmail(from_email, recipients,
-                                     message.as_bytes(linesep='\r\n'),
-                                     rcpt_options=self.rcpt_options)
+            self._sendmail(
+                from_email, recipients, message.as_bytes(linesep='\r\n')
+            )
         except smtplib.SMTPRecipientsRefused as e:
             handle_smtp_error(e)
             logger.exception(e)
@@ -50,3 +50,14 @@ class EmailBackend(DjangoEmailBackend):
             logger.exception(e)
             return False
         return True
+
+    def _sendmail(self, from_email, recipients, data):
+        try:
+            self.connection.sendmail(from_email, recipients, data,
+                                     rcpt_options=self.rcpt_options)
+        except smtplib.SMTPServerDisconnected:
+            # Long lived connections may be dropped by the server
+            self.close()
+            self.open()
+            self.connection.sendmail(from_email, recipients, data,
+                                     rcpt_options=self.rcpt_options)
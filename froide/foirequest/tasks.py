@@ -10,16 +10,25 @@ from django.core.files.base import ContentFile
 from celery.exceptions import SoftTimeLimitExceeded
 
 from filingcabinet.pdf_utils import (
-    convert_to_pdf, convert_images_to_ocred_pdf, run_ocr
+    convert_images_to_ocred_pdf, run_ocr
 )
 
 from froide.celery import app as celery_app
 from froide.publicbody.models import PublicBody
 from froide.upload.models import Upload
-from froide.helper.redaction import redact_file
+from froide.helper.conversion_cache import cached_conversion
+from froide.helper.email_utils import MailFetchStats
+from froide.helper.office_conversion import (
+    convert_office_file, get_task_time_limit
+)
+from froide.helper.redaction import redact_pdf, ocr_pdf_pages
 
 from .models import FoiRequest, FoiMessage, FoiAttachment, FoiProject
-from .foi_mail import _process_mail, _fetch_mail
+from .cache import updating_attachments
+from .foi_mail import (
+    _process_mail, _process_mail_file, _fetch_mail_batches, spool_mail,
+    get_spooled_mail_path, remove_spooled_mail
+)
 from .notifications import send_classification_reminder
 
 logger = logging.getLogger(__name__)
@@ -34,10 +43,39 @@ def process_mail(*args, **kwargs):
         _process_mail(*args, **kwargs)
 
 
+@celery_app.task(name='froide.foirequest.tasks.process_spooled_mail',
+                 acks_late=True, time_limit=60)
+def process_spooled_mail(spool_name, mail_uid=None):
+    mail_path = get_spooled_mail_path(spool_name)
+    if mail_path is None:
+        # Already processed by a previous delivery of this task
+        return
+    translation.activate(settings.LANGUAGE_CODE)
+
+    with transaction.atomic():
+        _process_mail_file(mail_path, mail_uid=mail_uid)
+    remove_spooled_mail(spool_name)
+
+
+def dispatch_mail_batches(batches):
+    stats = MailFetchStats()
+    for batch in batches:
+        stats.add_batch(batch)
+        for mail_uid, rfc_data in batch:
+            spool_name = spool_mail(rfc_data)
+            process_spooled_mail.delay(spool_name, mail_uid=mail_uid)
+    return stats.as_dict()
+
+
 @celery_app.task(name='froide.foirequest.tasks.fetch_mail', expires=60)
 def fetch_mail():
-    for mail_uid, rfc_data in _fetch_mail():
-        process_mail.delay(rfc_data, mail_uid=mail_uid)
+    stats = dispatch_mail_batches(_fetch_mail_batches())
+    logger.info(
+        'Fetched %(messages)d mails (%(bytes)d bytes) in %(batches)d '
+        'batches in %(duration).2fs (%(messages_per_second).1f mails/s)',
+        stats
+    )
+    return stats
 
 
 @celery_app.task
@@ -116,7 +154,8 @@ def create_project_request(project_id, publicbody_id, sequence=0, **kwargs):
 
 
 @celery_app.task(name='froide.foirequest.tasks.convert_attachment_task',
-                 time_limit=60)
+                 time_limit=get_task_time_limit(),
+                 soft_time_limit=get_task_time_limit() - 5)
 def convert_attachment_task(instance_id):
     try:
         att = FoiAttachment.objects.get(pk=instance_id)
@@ -152,15 +191,24 @@ def ocr_pdf_attachment(att):
     )
 
 
+def save_converted_file(att, output_bytes):
+    new_file = ContentFile(output_bytes)
+    att.size = new_file.size
+    # Hashed filename storage only links to identical output
+    att.file.save(att.name, new_file)
+    att.save()
+
+
 def convert_attachment(att):
-    output_bytes = convert_to_pdf(
-        att.file.path,
-        binary_name=settings.FROIDE_CONFIG.get(
-            'doc_conversion_binary'
-        ),
-        construct_call=settings.FROIDE_CONFIG.get(
-            'doc_conversion_call_func'
-        )
+    binary_name = settings.FROIDE_CONFIG.get('doc_conversion_binary')
+    construct_call = settings.FROIDE_CONFIG.get('doc_conversion_call_func')
+    output_bytes = cached_conversion(
+        'office', [att.get_file_hash()],
+        lambda: convert_office_file(att.file.path),
+        params={
+            'binary': binary_name,
+            'call': getattr(construct_call, '__qualname__', None)
+        }
     )
     if output_bytes is None:
         return
@@ -180,10 +228,7 @@ def convert_attachment(att):
             can_approve=att.can_approve
         )
 
-    new_file = ContentFile(output_bytes)
-    new_att.size = new_file.size
-    new_att.file.save(new_att.name, new_file)
-    new_att.save()
+    save_converted_file(new_att, output_bytes)
     att.converted = new_att
     att.can_approve = False
     att.approved = False
@@ -205,21 +250,25 @@ def convert_images_to_pdf_task(att_ids, target_id, instructions, can_approve=Tru
 
     paths = [a.file.path for a in atts]
     try:
-        pdf_bytes = convert_images_to_ocred_pdf(paths, instructions=instructions)
+        pdf_bytes = cached_conversion(
+            'images', [a.get_file_hash() for a in atts],
+            lambda: convert_images_to_ocred_pdf(
+                paths, instructions=instructions
+            ),
+            params={'instructions': instructions}
+        )
     except SoftTimeLimitExceeded:
         pdf_bytes = None
 
     if pdf_bytes is None:
-        att_qs.update(
-            can_approve=can_approve
-        )
+        with updating_attachments(att_qs):
+            att_qs.update(
+                can_approve=can_approve
+            )
         target.delete()
         return
 
-    new_file = ContentFile(pdf_bytes)
-    target.size = new_file.size
-    target.file.save(target.name, new_file)
-    target.save()
+    save_converted_file(target, pdf_bytes)
 
 
 @celery_app.task(name='froide.foirequest.tasks.ocr_pdf_task',
@@ -235,10 +284,14 @@ def ocr_pdf_task(att_id, target_id, can_approve=True):
         return
 
     try:
-        pdf_bytes = run_ocr(
-            attachment.file.path,
-            language=settings.LANGUAGE_CODE,
-            timeout=180
+        pdf_bytes = cached_conversion(
+            'ocr', [attachment.get_file_hash()],
+            lambda: run_ocr(
+                attachment.file.path,
+                language=settings.LANGUAGE_CODE,
+                timeout=180
+            ),
+            params={'language': settings.LANGUAGE_CODE}
         )
     except SoftTimeLimitExceeded:
         pdf_bytes = None
@@ -249,10 +302,7 @@ def ocr_pdf_task(att_id, target_id, can_approve=True):
         target.delete()
         return
 
-    new_file = ContentFile(pdf_bytes)
-    target.size = new_file.size
-    target.file.save(target.name, new_file)
-    target.save()
+    save_converted_file(target, pdf_bytes)
 
 
 @celery_app.task(name='froide.foirequest.tasks.redact_attachment_task',
@@ -274,12 +324,17 @@ def redact_attachment_task(att_id, target_id, instructions):
     logger.info('Trying redaction of %s', attachment.id)
 
     try:
-        pdf_bytes = redact_file(attachment.file, instructions)
+        result = redact_pdf(
+            attachment.file, instructions,
+            workers=settings.FOI_REDACTION_WORKERS,
+            progress=target.set_redaction_progress,
+            backend=settings.FOI_REDACTION_BACKEND
+        )
     except Exception:
         logger.error("PDF redaction error", exc_info=True)
-        pdf_bytes = None
+        result = None
 
-    if pdf_bytes is None:
+    if result is None:
         logger.info('Redaction failed %s', attachment.id)
         # Redaction has failed, remove empty attachment
         if attachment.redacted:
@@ -295,27 +350,31 @@ def redact_attachment_task(att_id, target_id, instructions):
         return
 
     logger.info('Redaction successful %s', attachment.id)
-    pdf_file = ContentFile(pdf_bytes)
-    target.size = pdf_file.size
-    target.file.save(target.name, pdf_file, save=False)
-
-    logger.info('Trying OCR %s', target.id)
+    pdf_bytes = result.pdf_bytes
 
-    try:
-        pdf_bytes = run_ocr(
-            target.file.path, language=settings.LANGUAGE_CODE,
-            timeout=60 * 4
+    if result.ocr_pages:
+        logger.info(
+            'Trying OCR of %d pages %s', len(result.ocr_pages), target.id
         )
-    except SoftTimeLimitExceeded:
-        pdf_bytes = None
-
-    if pdf_bytes is not None:
-        logger.info('OCR successful %s', target.id)
-        pdf_file = ContentFile(pdf_bytes)
-        target.size = pdf_file.size
-        target.file.save(target.name, pdf_file, save=False)
+        try:
+            ocr_bytes = ocr_pdf_pages(
+                pdf_bytes, result.ocr_pages,
+                language=settings.LANGUAGE_CODE, timeout=60 * 4
+            )
+        except SoftTimeLimitExceeded:
+            ocr_bytes = None
+
+        if ocr_bytes is not None:
+            logger.info('OCR successful %s', target.id)
+            pdf_bytes = ocr_bytes
+        else:
+            logger.info('OCR failed %s', target.id)
     else:
-        logger.info('OCR failed %s', target.id)
+        logger.info('Text layer preserved, skipping OCR %s', target.id)
+
+    pdf_file = ContentFile(pdf_bytes)
+    target.size = pdf_file.size
+    target.file.save(target.name, pdf_file, save=False)
 
     target.can_approve = True
     target.pending = False
@@ -19,6 +19,7 @@ from froide.helper.text_diff import mark_differences
 from ..forms import EditMessageForm
 from ..models import FoiRequest, FoiMessage, DeliveryStatus
 from ..foi_mail import get_alternative_mail
+from ..cache import get_message_fragment, set_message_fragment
 from ..auth import (
     can_read_foirequest, can_write_foirequest, can_manage_foirequest,
     can_read_foirequest_anonymous, can_read_foirequest_authenticated,
@@ -271,6 +272,41 @@ def get_delivery_status(message):
     return message._delivery_status
 
 
+@register.tag(name='cache_message')
+def do_cache_message(parser, token):
+    """
+    Caches the rendered contents for the message and viewer:
+    {% cache_message message %}...{% endcache_message %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            "'%s' takes the message as argument" % bits[0]
+        )
+    nodelist = parser.parse(('endcache_message',))
+    parser.delete_first_token()
+    return MessageCacheNode(nodelist, parser.compile_filter(bits[1]))
+
+
+class MessageCacheNode(template.Node):
+    def __init__(self, nodelist, message):
+        self.nodelist = nodelist
+        self.message = message
+
+    def render(self, context):
+        message = self.message.resolve(context)
+        request = context.get('request')
+        if request is None:
+            return self.nodelist.render(context)
+        key, fragment = get_message_fragment(message, request)
+        if fragment is not None:
+            return fragment
+        fragment = self.nodelist.render(context)
+        if key is not None:
+            set_message_fragment(key, fragment)
+        return fragment
+
+
 @register.inclusion_tag('foirequest/snippets/message_edit.html')
 def render_message_edit_button(message):
     return {
@@ -290,6 +290,37 @@ class FoiEventFactory(factory.DjangoModelFactory):
     context = '{}'
 
 
+def make_large_request(message_count=300, attachment_count=1000,
+                       event_count=300, **kwargs):
+    """
+    Creates a request with many messages, attachments and events
+    in bulk for benchmarks of the request page
+    """
+    req = FoiRequestFactory.create(**kwargs)
+    start = timezone.now() - timedelta(days=message_count + 1)
+    messages = FoiMessage.objects.bulk_create([
+        FoiMessageFactory.build(
+            request=req, sender_public_body=req.public_body,
+            timestamp=start + timedelta(days=i)
+        ) for i in range(message_count)
+    ])
+    FoiAttachment.objects.bulk_create([
+        FoiAttachmentFactory.build(
+            belongs_to=messages[i % message_count],
+            approved=bool(i % 3), name='file_%s.pdf' % i
+        ) for i in range(attachment_count)
+    ])
+    FoiEvent.objects.bulk_create([
+        FoiEventFactory.build(
+            request=req,
+            timestamp=start + timedelta(
+                days=i * message_count / event_count, hours=1
+            )
+        ) for i in range(event_count)
+    ])
+    return req
+
+
 def make_world():
     site = Site.objects.get(id=1)
 
@@ -1,10 +1,14 @@
+from contextlib import contextmanager
 from datetime import datetime
-from io import BytesIO
+import imaplib
+from io import BytesIO, StringIO
 import json
 import os
+from unittest import mock
 
 from django.test import TestCase, TransactionTestCase
 from django.core import mail
+from django.core.management import call_command
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -13,11 +17,15 @@ from django.test.utils import override_settings
 
 from froide.helper.email_utils import EmailParser
 
-from froide.foirequest.tasks import process_mail
+from froide.foirequest.tasks import process_mail, process_spooled_mail
 from froide.foirequest.models import (FoiRequest, FoiMessage, DeferredMessage)
 from froide.foirequest.tests import factories
-from froide.foirequest.foi_mail import add_message_from_email
+from froide.foirequest.foi_mail import (
+    add_message_from_email, spool_mail, get_mail_spool_storage,
+    get_alternative_mail, get_mail_resolver, spam_sender_filter
+)
 from froide.foirequest.services import BOUNCE_TAG
+from froide.foirequest.management.commands import listen_foi_mail
 from froide.problem.models import ProblemReport
 
 TEST_DATA_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), 'testdata'))
@@ -83,6 +91,33 @@ class MailTest(MailTestMixin, TestCase):
         self.assertEqual(message.recipient, request.user.display_name())
         self.assertEqual(message.recipient_email, 'sw+yurpykc1hr@fragdenstaat.de')
 
+    def test_spooled_mail(self):
+        with open(p("test_mail_01.txt"), 'rb') as f:
+            spool_name = spool_mail(f.read())
+        storage = get_mail_spool_storage()
+        self.assertTrue(storage.exists(spool_name))
+        process_spooled_mail.delay(spool_name)
+        self.assertFalse(storage.exists(spool_name))
+        request = FoiRequest.objects.get_by_secret_mail(self.secret_address)
+        self.assertEqual(len(request.messages), 2)
+        # Redelivery of the task does not process the mail again
+        process_spooled_mail.delay(spool_name)
+        self.assertEqual(request.foimessage_set.count(), 2)
+
+    def test_stream_parsing(self):
+        parser = EmailParser()
+        with open(p("test_mail_07.txt"), 'rb') as f:
+            email = parser.parse(f)
+        with open(p("test_mail_07.txt"), 'rb') as f:
+            streamed = parser.parse_stream(f)
+        self.assertEqual(email.subject, streamed.subject)
+        self.assertEqual(email.body, streamed.body)
+        self.assertEqual(len(email.attachments), len(streamed.attachments))
+        for att, streamed_att in zip(email.attachments, streamed.attachments):
+            self.assertEqual(att.name, streamed_att.name)
+            self.assertEqual(att.size, streamed_att.size)
+            self.assertEqual(att.getvalue(), streamed_att.read())
+
     def test_wrong_address(self):
         request = FoiRequest.objects.get_by_secret_mail(
                 self.secret_address)
@@ -292,6 +327,29 @@ class DeferredMessageTest(TestCase):
         dm = DeferredMessage.objects.get(id=dm.id)
         self.assertEqual(dm.request, req)
 
+    @override_settings(FOI_EMAIL_DEFERRED_STORE_FILES=True)
+    def test_deferred_file_storage(self):
+        name, domain = self.req.secret_address.split('@')
+        bad_mail = '@'.join((name + 'x', domain))
+        with open(p("test_mail_01.txt"), 'rb') as f:
+            mail = f.read().replace(self.secret_address.encode('ascii'), bad_mail.encode('ascii'))
+        spool_name = spool_mail(mail)
+        process_spooled_mail.delay(spool_name)
+        dm = DeferredMessage.objects.get(recipient=bad_mail)
+        self.assertEqual(dm.mail, '')
+        self.assertEqual(dm.encoded_mail(), mail)
+        self.assertTrue(dm.mail_file.path.startswith(
+            settings.FOI_EMAIL_DEFERRED_ROOT
+        ))
+        with self.assertRaises(ValueError):
+            dm.mail_file.url
+        count_messages = FoiMessage.objects.filter(request=self.req).count()
+        dm.redeliver(self.req)
+        self.assertEqual(
+            count_messages + 1, FoiMessage.objects.filter(request=self.req).count()
+        )
+        dm.mail_file.delete()
+
     def test_double_deferred(self):
         count_messages = len(self.req.get_messages())
         name, domain = self.req.secret_address.split('@')
@@ -317,8 +375,100 @@ class DeferredMessageTest(TestCase):
         self.assertEqual(DeferredMessage.objects.count(), 3)
 
 
+class MailResolverTest(TestCase):
+    def setUp(self):
+        spam_sender_filter.clear()
+        self.site = factories.make_world()
+        self.reqs = [
+            factories.FoiRequestFactory.create(
+                site=self.site, secret_address='sw+secret%d@fragdenstaat.de' % i
+            ) for i in range(5)
+        ]
+
+    def test_bulk_resolution(self):
+        recipients = [r.secret_address for r in self.reqs]
+        recipients += [get_alternative_mail(r) for r in self.reqs]
+        recipients.append('sw+unknown@fragdenstaat.de')
+        resolver = get_mail_resolver()
+        # One request lookup and one deferred message lookup
+        with self.assertNumQueries(2):
+            result = resolver.get_foirequests(recipients)
+        for req in self.reqs:
+            self.assertEqual(result[req.secret_address], req)
+            self.assertEqual(result[get_alternative_mail(req)], req)
+        self.assertIsNone(result['sw+unknown@fragdenstaat.de'])
+
+    def test_deliver_mail_queries(self):
+        from froide.foirequest.foi_mail import _deliver_mail
+
+        parser = EmailParser()
+        with open(p("test_mail_01.txt"), 'rb') as f:
+            email = parser.parse(f)
+        email.to = []
+        email.cc = [
+            ('', address) for address in (
+                self.reqs[0].secret_address,
+                get_alternative_mail(self.reqs[0]),
+                self.reqs[1].secret_address,
+                'sw+unknown1@fragdenstaat.de',
+                'sw+unknown2@fragdenstaat.de',
+            )
+        ]
+        spam_sender_filter.is_spammer(email.from_[1])
+        module = 'froide.foirequest.foi_mail.%s'
+        with mock.patch(module % 'get_publicbody_for_email',
+                        return_value=self.reqs[0].public_body) as get_pb, \
+                mock.patch(module % 'create_deferred') as create_deferred, \
+                mock.patch(module % 'add_message_from_email') as add_message:
+            # One request lookup and one deferred message lookup
+            with self.assertNumQueries(2):
+                _deliver_mail(email)
+        # Once per request, not per recipient
+        self.assertEqual(get_pb.call_count, 2)
+        self.assertEqual(add_message.call_count, 3)
+        self.assertEqual(
+            [c[0][0] for c in create_deferred.call_args_list],
+            ['sw+unknown1@fragdenstaat.de', 'sw+unknown2@fragdenstaat.de']
+        )
+
+    def test_recipient_filtering(self):
+        parser = EmailParser()
+        with open(p("test_mail_01.txt"), 'rb') as f:
+            email = parser.parse(f)
+        email.cc = [('', 'Other@Example.org'), ('', 'SW+Secret0@fragdenstaat.de')]
+        recipients = get_mail_resolver().get_recipients(email)
+        self.assertEqual(recipients, [
+            'sw+yurpykc1hr@fragdenstaat.de', 'sw+secret0@fragdenstaat.de'
+        ])
+
+    def test_spam_sender_cache(self):
+        resolver = get_mail_resolver()
+        sender = 'spam@example.org'
+        self.assertFalse(resolver.is_known_spammer(sender))
+        DeferredMessage.objects.create(sender=sender, spam=True)
+        self.assertTrue(resolver.is_known_spammer(sender))
+        with self.assertNumQueries(0):
+            self.assertTrue(resolver.is_known_spammer(sender))
+
+    def test_spam_sender_filter(self):
+        sender = 'spam@example.org'
+        dm = DeferredMessage.objects.create(sender=sender, spam=None)
+        # Unknown senders are answered without database
+        with self.assertNumQueries(0):
+            self.assertFalse(spam_sender_filter.is_spammer(sender))
+            self.assertFalse(spam_sender_filter.is_spammer('other@example.org'))
+        dm.spam = True
+        dm.save()
+        with self.assertNumQueries(0):
+            self.assertTrue(spam_sender_filter.is_spammer(sender))
+        dm.spam = False
+        dm.save()
+        self.assertFalse(spam_sender_filter.is_spammer(sender))
+
+
 class SpamMailTest(TestCase):
     def setUp(self):
+        spam_sender_filter.clear()
         self.secret_address = 'sw+yurpykc1hr@fragdenstaat.de'
         self.site = factories.make_world()
         self.req = factories.FoiRequestFactory.create(site=self.site,
@@ -522,3 +672,50 @@ class PostMarkMailTest(TestCase):
 
     def test_postmark_bounce(self):
         self.test_postmark_post(url=reverse('foirequest-postmark_bounce'))
+
+
+class ListenMailCommandTest(TestCase):
+    def setUp(self):
+        self.mailbox = mock.Mock()
+        self.connections = 0
+
+    @contextmanager
+    def get_client(self):
+        self.connections += 1
+        yield self.mailbox
+
+    def call_command(self, idle, dispatched):
+        out = StringIO()
+        module = 'froide.foirequest.management.commands.listen_foi_mail.%s'
+        with mock.patch(module % 'get_foi_mail_client', self.get_client), \
+                mock.patch(module % 'imap_idle', side_effect=idle) as idle, \
+                mock.patch(module % 'dispatch_mail_batches',
+                           side_effect=dispatched) as dispatch, \
+                mock.patch.object(listen_foi_mail.time, 'sleep') as sleep:
+            call_command('listen_foi_mail', idle_timeout=60, stdout=out)
+        return out.getvalue(), idle, dispatch, sleep
+
+    def test_dispatch_after_idle(self):
+        stats = {'messages': 2, 'bytes': 100, 'duration': 0.5}
+        empty = {'messages': 0, 'bytes': 0, 'duration': 0.0}
+        out, idle, dispatch, sleep = self.call_command(
+            [True, KeyboardInterrupt], [empty, stats]
+        )
+        self.assertEqual(self.connections, 1)
+        self.assertEqual(dispatch.call_count, 2)
+        idle.assert_called_with(self.mailbox, timeout=60)
+        self.assertEqual(
+            out, 'Dispatched 2 mails (100 bytes) in 0.50s\n'
+        )
+        sleep.assert_not_called()
+
+    def test_reconnect_after_abort(self):
+        empty = {'messages': 0, 'bytes': 0, 'duration': 0.0}
+        out, idle, dispatch, sleep = self.call_command(
+            [imaplib.IMAP4.abort('connection lost'), KeyboardInterrupt],
+            [empty, empty]
+        )
+        self.assertEqual(self.connections, 2)
+        self.assertEqual(dispatch.call_count, 2)
+        sleep.assert_called_once_with(1)
+        self.assertEqual(out, '')
@@ -1,14 +1,18 @@
 from datetime import timedelta
+import tempfile
+from unittest import mock
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.core import mail
+from django.core.files.base import ContentFile
 from django.utils import timezone
 
 from froide.foirequest.tests import factories
 from froide.foirequest.templatetags.foirequest_tags import check_same_request
-from froide.foirequest.models import FoiRequest
+from froide.foirequest.models import FoiRequest, FoiAttachment
 from froide.foirequest.tasks import (detect_asleep, detect_overdue,
-    classification_reminder)
+    classification_reminder, convert_attachment)
 from froide.foirequest.utils import MailAttachmentSizeChecker
 
 
@@ -87,6 +91,48 @@ class TaskTest(TestCase):
                       mail.outbox[0].subject)
 
 
+class AttachmentConversionTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.tmpdir.name,
+            FOI_CONVERSION_CACHE=True,
+            FOI_CONVERSION_CACHE_ROOT=self.tmpdir.name + '/cache'
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def convert(self, att):
+        def convert_office_file(path):
+            with open(path, 'rb') as f:
+                return b'%PDF ' + f.read()
+
+        with mock.patch('froide.foirequest.tasks.convert_office_file',
+                        side_effect=convert_office_file):
+            convert_attachment(att)
+        att = FoiAttachment.objects.get(pk=att.pk)
+        return att.converted.get_bytes()
+
+    def test_replaced_file_is_converted_again(self):
+        att = factories.FoiAttachmentFactory.create(
+            name='letter.docx', file=None, filetype='application/msword'
+        )
+        att.file.save(att.name, ContentFile(b'old'))
+        self.assertEqual(self.convert(att), b'%PDF old')
+
+        # Replaced like uploads of the same name
+        att = FoiAttachment.objects.get(pk=att.pk)
+        old_hash = att.file_hash
+        att.file.save(att.name, ContentFile(b'new'))
+        att = FoiAttachment.objects.get(pk=att.pk)
+        self.assertEqual(att.file_hash, '')
+        self.assertEqual(self.convert(att), b'%PDF new')
+        self.assertNotEqual(att.get_file_hash(), old_hash)
+
+
 class MailAttachmentSizeCheckerTest(TestCase):
     def test_attachment_size_checker(self):
         files = [
@@ -100,3 +146,18 @@ class MailAttachmentSizeCheckerTest(TestCase):
         self.assertEqual(atts, files[:2])
         self.assertEqual(checker.send_files, ['test1.txt', 'test2.txt'])
         self.assertEqual(checker.non_send_files, ['test3.txt'])
+
+
+class IndexUpdateTest(TestCase):
+    def setUp(self):
+        self.site = factories.make_world()
+
+    def test_add_attachment_does_not_save_request(self):
+        req = FoiRequest.objects.all()[0]
+        message = req.messages[0]
+        # Only the attachment insert, request is marked dirty for index
+        with self.assertNumQueries(1):
+            FoiAttachment.objects.create(
+                belongs_to=message, name='new.pdf',
+                filetype='application/pdf'
+            )
@@ -1,3 +1,4 @@
+import re
 import unittest
 
 from mock import patch
@@ -5,11 +6,14 @@ from mock import patch
 from django.test import TestCase
 from django.urls import reverse
 from django.conf import settings
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
 
 from froide.publicbody.models import PublicBody, Category, Jurisdiction
-from froide.foirequest.models import FoiRequest, FoiAttachment
+from froide.foirequest.models import FoiRequest, FoiMessage, FoiAttachment
+from froide.foirequest.cache import updating_attachments
 from froide.foirequest.tests import factories
 from froide.foirequest.filters import FOIREQUEST_FILTER_DICT, FOIREQUEST_FILTERS
 from froide.helper.auth import clear_lru_caches
@@ -509,3 +513,147 @@ class PerformanceTest(TestCase):
         ContentType.objects.clear_cache()
         with self.assertNumQueries(TOTAL_EXPECTED_REQUESTS):
             self.client.get(req.get_absolute_url())
+
+    def test_queries_large_foirequest(self):
+        """
+        Query count of the request page does not grow
+        with messages, attachments and events
+        """
+        req = factories.make_large_request(
+            message_count=100, attachment_count=300, event_count=100,
+            site=self.site
+        )
+        ContentType.objects.clear_cache()
+        with self.assertNumQueries(10):
+            response = self.client.get(req.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+    def test_large_foirequest_assembly(self):
+        from froide.foirequest.views.request import prepare_messages
+
+        req = factories.make_large_request(
+            message_count=30, attachment_count=100, event_count=45,
+            site=self.site
+        )
+        with self.assertNumQueries(3):
+            messages = prepare_messages(req, False)
+
+        events = list(req.foievent_set.order_by('timestamp'))
+        for i, message in enumerate(messages):
+            next_timestamp = (
+                messages[i + 1].timestamp if i + 1 < len(messages) else None
+            )
+            self.assertEqual(message.events, [
+                ev for ev in events if ev.timestamp >= message.timestamp and
+                (next_timestamp is None or ev.timestamp < next_timestamp)
+            ])
+            attachment_ids = set(
+                message.foiattachment_set.values_list('id', flat=True)
+            )
+            self.assertEqual(
+                {a.id for a in message.all_attachments}, attachment_ids
+            )
+            self.assertEqual(
+                len(message.approved_attachments) +
+                len(message.unapproved_attachments) +
+                len(message.hidden_attachments),
+                len(message.listed_attachments)
+            )
+
+    @override_settings(FOI_MESSAGE_FRAGMENT_CACHE=True)
+    def test_message_fragment_cache(self):
+        cache.clear()
+        req = factories.make_large_request(
+            message_count=20, attachment_count=20, event_count=0,
+            site=self.site
+        )
+        self.client.get(req.get_absolute_url())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(req.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        # Message parts are only queried when messages are rendered
+        sql = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('foirequest_deliverystatus', sql)
+        self.assertNotIn('guide_guidance', sql)
+
+        message = FoiMessage.objects.filter(request=req).last()
+        message.plaintext_redacted = 'Changed message content'
+        message.save()
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, 'Changed message content')
+
+    def get_csrf_tokens(self, response):
+        return set(re.findall(
+            r'name="csrfmiddlewaretoken" value="([^"]+)"',
+            response.content.decode('utf-8')
+        ))
+
+    @override_settings(FOI_MESSAGE_FRAGMENT_CACHE=True)
+    def test_message_fragment_cache_owner(self):
+        cache.clear()
+        req = factories.FoiRequestFactory.create(site=self.site)
+        message = factories.FoiMessageFactory.create(
+            request=req, is_postal=True, kind='post',
+            sender_public_body=req.public_body
+        )
+        upload_url = reverse('foirequest-upload_attachments', kwargs={
+            'slug': req.slug, 'message_id': message.id
+        })
+        response = self.client.get(req.get_absolute_url())
+        self.assertNotContains(response, upload_url)
+
+        self.client.login(email=req.user.email, password='froide')
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, upload_url)
+        tokens = self.get_csrf_tokens(response)
+        self.assertTrue(tokens)
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, upload_url)
+
+        # Another session of the owner gets its own forms
+        other_client = self.client_class()
+        other_client.login(email=req.user.email, password='froide')
+        response = other_client.get(req.get_absolute_url())
+        self.assertContains(response, upload_url)
+        self.assertFalse(tokens & self.get_csrf_tokens(response))
+
+        self.client.logout()
+        response = self.client.get(req.get_absolute_url())
+        self.assertNotContains(response, upload_url)
+
+    @override_settings(FOI_MESSAGE_FRAGMENT_CACHE=True)
+    def test_message_fragment_cache_moderator(self):
+        cache.clear()
+        req = factories.FoiRequestFactory.create(site=self.site)
+        message = factories.FoiMessageFactory.create(request=req)
+        admin_url = reverse(
+            'admin:foirequest_foimessage_change', args=(message.id,)
+        )
+        moderator = factories.UserFactory.create(is_staff=True)
+        self.client.login(email=req.user.email, password='froide')
+        response = self.client.get(req.get_absolute_url())
+        self.assertNotContains(response, admin_url)
+
+        self.client.login(email=moderator.email, password='froide')
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, admin_url)
+        self.assertContains(response, message.sender_public_body.name)
+
+        # Changes to the sender and bulk updates invalidate fragments
+        sender = message.sender_public_body
+        sender.name = 'Renamed public body'
+        sender.save()
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, 'Renamed public body')
+
+        attachment = factories.FoiAttachmentFactory.create(
+            belongs_to=message, approved=False, name='bulk_approved.pdf'
+        )
+        self.client.logout()
+        response = self.client.get(req.get_absolute_url())
+        self.assertNotContains(response, 'bulk_approved.pdf')
+        atts = FoiAttachment.objects.filter(id=attachment.id)
+        with updating_attachments(atts):
+            atts.update(approved=True)
+        response = self.client.get(req.get_absolute_url())
+        self.assertContains(response, 'bulk_approved.pdf')
@@ -23,7 +23,7 @@ from froide.helper.text_utils import (
 )
 from froide.helper.date_utils import format_seconds
 from froide.helper.api_utils import get_fake_api_context
-from froide.helper.tasks import search_instance_save
+from froide.helper.search.index_queue import queue_index_update
 
 from froide.publicbody.models import PublicBody
 
@@ -480,6 +480,7 @@ def rerun_message_redaction(foirequests):
 
 def permanently_anonymize_requests(foirequests):
     from .models import FoiAttachment
+    from .cache import updating_requests, updating_attachments
 
     replacements = {
         'name': str(_('<information-removed>')),
@@ -489,9 +490,10 @@ def permanently_anonymize_requests(foirequests):
     original_private = True
     if foirequests:
         original_private = foirequests[0].user.private
-    foirequests.update(
-        closed=True
-    )
+    with updating_requests(foirequests):
+        foirequests.update(
+            closed=True
+        )
     for foirequest in foirequests:
         user = foirequest.user
         user.private = True
@@ -525,11 +527,11 @@ def permanently_anonymize_requests(foirequests):
 
         if not original_private:
             # Set other attachments to non-approved, if user was not private
-            FoiAttachment.objects.filter(
+            atts = FoiAttachment.objects.filter(
                 belongs_to__request=foirequest
-            ).update(
-                approved=False
             )
+            with updating_attachments(atts):
+                atts.update(approved=False)
     update_foirequest_index(foirequests)
 
 
@@ -722,4 +724,4 @@ def export_user_data(user):
 
 def update_foirequest_index(queryset):
     for foirequest_id in queryset.values_list('id', flat=True):
-        search_instance_save.delay('foirequest.foirequest', foirequest_id)
+        queue_index_update('foirequest.foirequest', foirequest_id)
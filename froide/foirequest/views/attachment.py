@@ -20,6 +20,7 @@ from ..auth import (
     AttachmentCrossDomainMediaAuth, has_attachment_access
 )
 from ..tasks import redact_attachment_task
+from ..cache import updating_attachments
 
 from .request_actions import allow_write_foirequest
 
@@ -97,9 +98,9 @@ def delete_attachment(request, foirequest, attachment):
     if not att.can_delete:
         return render_403(request)
     if att.is_redacted:
-        FoiAttachment.objects.filter(redacted=att).update(
-            can_approve=True
-        )
+        originals = FoiAttachment.objects.filter(redacted=att)
+        with updating_attachments(originals):
+            originals.update(can_approve=True)
     att.attachment_deleted.send(
         sender=att, user=request.user,
     )
@@ -26,6 +26,7 @@ from ..forms import (
     TransferUploadForm, EditMessageForm, RedactMessageForm
 )
 from ..utils import check_throttle
+from ..cache import bump_message_version
 from ..tasks import convert_images_to_pdf_task
 from ..pdf_generator import LetterPDFGenerator
 from ..services import ResendBouncedMessageService
@@ -241,6 +242,7 @@ def convert_to_pdf(request, foirequest, message, data):
     FoiAttachment.objects.filter(id__in=att_ids).update(
         converted_id=att.id, can_approve=False, approved=False
     )
+    bump_message_version(message.id)
     instructions = {
         d['id']: d for d in data['images'] if d['id'] in att_ids
     }
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import Http404
 
@@ -55,51 +57,75 @@ def can_see_attachment(att, can_write):
     return True
 
 
-def show_foirequest(request, obj, template_name="foirequest/show.html",
-        context=None, status=200):
+def set_message_attachments(message, attachments, can_write):
+    message.all_attachments = attachments
+    message.listed_attachments = []
+    message.hidden_attachments = []
+    message.approved_attachments = []
+    message.unapproved_attachments = []
+    for att in attachments:
+        att.belongs_to = message
+        if not can_see_attachment(att, can_write):
+            continue
+        message.listed_attachments.append(att)
+        if att.is_irrelevant:
+            message.hidden_attachments.append(att)
+        elif att.approved:
+            message.approved_attachments.append(att)
+        else:
+            message.unapproved_attachments.append(att)
+
+
+def set_message_events(messages, events):
+    """
+    Attaches each event to the last message sent before it,
+    messages and events must be ordered by timestamp
+    """
+    for message in messages:
+        message.events = []
+    index = -1
+    for event in events:
+        while (index + 1 < len(messages) and
+                messages[index + 1].timestamp <= event.timestamp):
+            index += 1
+        if index >= 0:
+            messages[index].events.append(event)
+
+
+def prepare_messages(obj, can_write):
+    """
+    Loads messages with their attachments and events
+    in three queries and assembles them in one pass
+    """
+    messages = obj.get_messages(with_tags=can_write)
+
+    attachments = defaultdict(list)
     all_attachments = (
         FoiAttachment.objects
         .select_related('redacted')
         .filter(belongs_to__request=obj)
     )
-
-    can_write = can_write_foirequest(obj, request)
-
-    messages = obj.get_messages(with_tags=can_write)
+    for att in all_attachments:
+        attachments[att.belongs_to_id].append(att)
 
     for message in messages:
         message.request = obj
-        message.all_attachments = [a for a in all_attachments
-                    if a.belongs_to_id == message.id]
-        message.listed_attachments = [a for a in all_attachments
-            if a.belongs_to_id == message.id and
-            can_see_attachment(a, can_write)]
-        message.hidden_attachments = [
-            a for a in message.listed_attachments
-            if a.is_irrelevant
-        ]
-        message.approved_attachments = [
-            a for a in message.listed_attachments
-            if a.approved and a not in message.hidden_attachments
-        ]
-        message.unapproved_attachments = [
-            a for a in message.listed_attachments
-            if not a.approved and a not in message.hidden_attachments
-        ]
-
-        for att in message.all_attachments:
-            att.belongs_to = message
+        set_message_attachments(
+            message, attachments.get(message.id, []), can_write
+        )
 
     events = FoiEvent.objects.filter(request=obj).select_related(
             "user", "request",
             "public_body").order_by("timestamp")
+    set_message_events(messages, events)
+    return messages
+
+
+def show_foirequest(request, obj, template_name="foirequest/show.html",
+        context=None, status=200):
+    can_write = can_write_foirequest(obj, request)
 
-    event_count = len(events)
-    last_index = event_count
-    for message in reversed(obj.messages):
-        message.events = [ev for ev in events[:last_index]
-                if ev.timestamp >= message.timestamp]
-        last_index = last_index - len(message.events)
+    prepare_messages(obj, can_write)
 
     if context is None:
         context = {}
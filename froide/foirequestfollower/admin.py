@@ -2,7 +2,7 @@ from django.contrib import admin
 
 from froide.helper.admin_utils import ForeignKeyFilter
 
-from .models import FoiRequestFollower
+from .models import FoiRequestFollower, UpdateDigest
 
 
 class FoiRequestFollowerAdmin(admin.ModelAdmin):
@@ -21,4 +21,13 @@ class FoiRequestFollowerAdmin(admin.ModelAdmin):
         return qs.prefetch_related('user', 'request')
 
 
+class UpdateDigestAdmin(admin.ModelAdmin):
+    raw_id_fields = ('user',)
+    date_hierarchy = 'day'
+    list_display = ('day', 'kind', 'recipient', 'created', 'sent')
+    list_filter = ('kind', 'day')
+    search_fields = ('recipient',)
+
+
 admin.site.register(FoiRequestFollower, FoiRequestFollowerAdmin)
+admin.site.register(UpdateDigest, UpdateDigestAdmin)
@@ -0,0 +1,39 @@
+import django.contrib.postgres.fields.jsonb
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('foirequestfollower', '0003_auto_20200319_1702'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdateDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('kind', models.CharField(choices=[('requester', 'Requester'), ('follower', 'Follower')], max_length=20, verbose_name='Kind')),
+                ('recipient', models.CharField(max_length=255)),
+                ('email', models.CharField(blank=True, max_length=255)),
+                ('updates', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Update digest',
+                'verbose_name_plural': 'Update digests',
+                'ordering': ('day', 'id'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='updatedigest',
+            constraint=models.UniqueConstraint(fields=('day', 'kind', 'recipient'), name='unique_update_digest'),
+        ),
+    ]
@@ -123,10 +123,12 @@ class FoiRequestFollowerManager(models.Manager):
             'update_list': update_list
         }
         if count == 1:
-            follower = FoiRequestFollower.objects.get(
-                request=update_list[0]['request'],
-                email=email or '', user=user, confirmed=True
-            )
+            follower = update_list[0].get('follower')
+            if follower is None:
+                follower = FoiRequestFollower.objects.get(
+                    request=update_list[0]['request'],
+                    email=email or '', user=user, confirmed=True
+                )
             context.update(
                 follower.get_context()
             )
@@ -274,3 +276,43 @@ class FoiRequestFollower(models.Model):
             context=context,
             priority=True
         )
+
+
+class UpdateDigest(models.Model):
+    """
+    Outbox entry of a daily update mail to one recipient.
+    Planned once per day, marked as sent when the mail is out.
+    """
+    KIND_REQUESTER = 'requester'
+    KIND_FOLLOWER = 'follower'
+    KIND_CHOICES = (
+        (KIND_REQUESTER, _('Requester')),
+        (KIND_FOLLOWER, _('Follower')),
+    )
+
+    day = models.DateField(_('Day'))
+    kind = models.CharField(_('Kind'), max_length=20, choices=KIND_CHOICES)
+    # user id or email of the recipient
+    recipient = models.CharField(max_length=255)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True,
+        verbose_name=_("User"), on_delete=models.CASCADE)
+    email = models.CharField(max_length=255, blank=True)
+    # list of {request: id, follower: id, events: [text]}
+    updates = JSONField()
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('day', 'id')
+        verbose_name = _('Update digest')
+        verbose_name_plural = _('Update digests')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'kind', 'recipient'],
+                name='unique_update_digest'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.day, self.kind, self.recipient)
@@ -3,13 +3,44 @@ from django.conf import settings
 
 from froide.celery import app as celery_app
 from froide.foirequest.models import FoiRequest
+from froide.helper.email_sending import pooled_mail_connections
 
 from .models import FoiRequestFollower
-from .utils import run_batch_update
+from .utils import run_batch_update, send_update_digests
 
 
-@celery_app.task
+# Followers notified per subtask
+FOLLOWER_CHUNK_SIZE = 100
+
+
+@celery_app.task(name='froide.foirequestfollower.tasks.update_followers')
 def update_followers(request_id, update_message, template=None):
+    """
+    Fans out notifications to confirmed followers
+    of the request in chunks
+    """
+    follower_ids = FoiRequestFollower.objects.filter(
+        request_id=request_id, confirmed=True
+    ).order_by('id').values_list('id', flat=True)
+
+    chunk = []
+    for follower_id in follower_ids.iterator():
+        chunk.append(follower_id)
+        if len(chunk) >= FOLLOWER_CHUNK_SIZE:
+            update_followers_chunk.delay(
+                request_id, chunk, update_message, template=template
+            )
+            chunk = []
+    if chunk:
+        update_followers_chunk.delay(
+            request_id, chunk, update_message, template=template
+        )
+
+
+@celery_app.task(name='froide.foirequestfollower.tasks.update_followers_chunk',
+                 rate_limit='30/m')
+def update_followers_chunk(request_id, follower_ids, update_message,
+                           template=None):
     translation.activate(settings.LANGUAGE_CODE)
     try:
         foirequest = FoiRequest.objects.get(id=request_id)
@@ -17,20 +48,33 @@ def update_followers(request_id, update_message, template=None):
         return
 
     followers = FoiRequestFollower.objects.filter(
-        request=foirequest, confirmed=True
-    )
-    for follower in followers:
-        FoiRequestFollower.objects.send_update(
-            follower.user or follower.email,
-            [{
-                'request': foirequest,
-                'unfollow_link': follower.get_unfollow_link(),
-                'events': [update_message]
-            }],
-            batch=False
-        )
+        id__in=follower_ids, request=foirequest, confirmed=True
+    ).select_related('user')
+    with pooled_mail_connections():
+        for follower in followers:
+            follower.request = foirequest
+            FoiRequestFollower.objects.send_update(
+                follower.user or follower.email,
+                [{
+                    'request': foirequest,
+                    'follower': follower,
+                    'unfollow_link': follower.get_unfollow_link(),
+                    'events': [update_message]
+                }],
+                batch=False
+            )
 
 
 @celery_app.task
 def batch_update():
     return run_batch_update()
+
+
+@celery_app.task(bind=True, acks_late=True, max_retries=5)
+def send_update_digests_task(self, digest_ids):
+    failed = send_update_digests(digest_ids)
+    if failed:
+        # Only digests that failed are sent again
+        raise self.retry(
+            args=(failed,), countdown=60 * 2 ** self.request.retries
+        )
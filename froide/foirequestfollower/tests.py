@@ -13,7 +13,7 @@ from froide.foirequest.models import FoiRequest
 from froide.foirequest.tests import factories
 from froide.foirequest.tests.test_api import OAuthAPIMixin
 
-from .models import FoiRequestFollower
+from .models import FoiRequestFollower, UpdateDigest
 from .utils import run_batch_update
 
 User = get_user_model()
@@ -249,6 +249,122 @@ class FoiRequestFollowerTest(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].to[0], req.user.email)
 
+    def test_updates_many_followers(self):
+        req = FoiRequest.objects.all()[0]
+        followers = FoiRequestFollowerFactory.create_batch(3, request=req)
+        mes = list(req.messages)[-1]
+        comment_user = factories.UserFactory()
+        Comment.objects.create(
+            content_object=mes, user=comment_user, site=self.site,
+            comment='This is my comment', is_public=True
+        )
+        mail.outbox = []
+        with self.assertLogs('froide.foirequestfollower.utils',
+                             level='INFO') as logs:
+            run_batch_update()
+        self.assertTrue(any('follower digests' in o for o in logs.output))
+        recipients = {m.to[0] for m in mail.outbox}
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertIn(req.user.email, recipients)
+        for follower in followers:
+            self.assertIn(follower.user.email, recipients)
+
+    def test_digests_sent_once_per_day(self):
+        req = FoiRequest.objects.all()[0]
+        FoiRequestFollowerFactory.create_batch(2, request=req)
+        mes = list(req.messages)[-1]
+        Comment.objects.create(
+            content_object=mes, user=factories.UserFactory(), site=self.site,
+            comment='This is my comment', is_public=True
+        )
+        mail.outbox = []
+        run_batch_update()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(
+            UpdateDigest.objects.filter(sent__isnull=True).exists()
+        )
+
+        # Retrying the same day does not send again
+        mail.outbox = []
+        run_batch_update()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(UpdateDigest.objects.count(), 3)
+
+    def test_digest_failure_does_not_stop_others(self):
+        from unittest import mock
+        from .utils import send_digest
+
+        req = FoiRequest.objects.all()[0]
+        FoiRequestFollowerFactory.create_batch(2, request=req)
+        mes = list(req.messages)[-1]
+        Comment.objects.create(
+            content_object=mes, user=factories.UserFactory(), site=self.site,
+            comment='This is my comment', is_public=True
+        )
+        calls = []
+
+        def fail_first(digest, requests, followers):
+            calls.append(digest.id)
+            if len(calls) == 1:
+                raise ConnectionError('SMTP down')
+            return send_digest(digest, requests, followers)
+
+        mail.outbox = []
+        with mock.patch('froide.foirequestfollower.utils.send_digest',
+                        side_effect=fail_first):
+            with mock.patch('froide.foirequestfollower.tasks.'
+                            'send_update_digests_task.retry') as retry:
+                retry.side_effect = Exception('retry')
+                with self.assertRaises(Exception):
+                    run_batch_update()
+        self.assertEqual(len(mail.outbox), 2)
+        failed = UpdateDigest.objects.filter(sent__isnull=True)
+        self.assertEqual([d.id for d in failed], calls[:1])
+        self.assertEqual(retry.call_args[1]['args'], (calls[:1],))
+
+    def test_unsent_digests_of_past_days(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .utils import dispatch_update_digests
+
+        user = factories.UserFactory()
+        today = timezone.localdate()
+        for days in (1, 10):
+            UpdateDigest.objects.create(
+                user=user, recipient=str(user.id),
+                kind=UpdateDigest.KIND_REQUESTER,
+                day=today - timedelta(days=days), updates=[]
+            )
+        mail.outbox = []
+        dispatch_update_digests(today)
+        unsent = UpdateDigest.objects.filter(sent__isnull=True)
+        self.assertEqual(
+            [d.day for d in unsent], [today - timedelta(days=10)]
+        )
+
+    def test_instant_update_fan_out(self):
+        from unittest import mock
+        from .tasks import update_followers
+
+        req = FoiRequest.objects.all()[0]
+        followers = FoiRequestFollowerFactory.create_batch(3, request=req)
+        mail.outbox = []
+        with mock.patch('froide.foirequestfollower.tasks.FOLLOWER_CHUNK_SIZE', 2):
+            with mock.patch('froide.foirequestfollower.tasks.'
+                            'update_followers_chunk.delay',
+                            wraps=update_followers_chunk_delay) as chunk:
+                update_followers(req.id, 'Update')
+        self.assertEqual(chunk.call_count, 2)
+        self.assertEqual(
+            {m.to[0] for m in mail.outbox},
+            {f.user.email for f in followers}
+        )
+
+
+def update_followers_chunk_delay(*args, **kwargs):
+    from .tasks import update_followers_chunk
+    return update_followers_chunk(*args, **kwargs)
+
 
 class ApiTest(OAuthAPIMixin, TestCase):
     def setUp(self):
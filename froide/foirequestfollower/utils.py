@@ -1,23 +1,37 @@
 from datetime import timedelta
 from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import time
 
 from django.utils.translation import gettext as _
 from django.utils import translation
 from django.utils import formats
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.utils import timezone
 
 from django_comments import get_model
 
-from froide.foirequest.models import FoiEvent, FoiMessage
+from froide.foirequest.models import FoiEvent, FoiMessage, FoiRequest
 from froide.foirequest.models.event import EVENT_DETAILS
 from froide.foirequest.notifications import send_update
+from froide.helper.email_sending import pooled_mail_connections
 
-from .models import FoiRequestFollower, REFERENCE_PREFIX
+from .models import FoiRequestFollower, UpdateDigest, REFERENCE_PREFIX
 
 Comment = get_model()
 
+logger = logging.getLogger(__name__)
+
+# Digests per outbox write and per sending task
+DIGEST_CHUNK_SIZE = 200
+# Sent digests are deleted after this many days
+DIGEST_KEEP_DAYS = 30
+# Unsent digests of this many past days are dispatched again
+DIGEST_RETRY_DAYS = 3
+
 # Interesting events
 # message sent/received are already in instant updates
 INTERESTING_EVENTS = set(EVENT_DETAILS.keys()) - set([
@@ -31,19 +45,32 @@ COMBINE_EVENTS = set([
 ])
 
 
+@contextmanager
+def log_duration(phase):
+    start = time.perf_counter()
+    yield
+    logger.info('Batch update %s took %.1fs', phase,
+                time.perf_counter() - start)
+
+
 def add_comment_updates(updates, since):
     message_type = ContentType.objects.get_for_model(FoiMessage)
 
-    comments = Comment.objects.filter(
+    comments = list(Comment.objects.filter(
         content_type=message_type,
         submit_date__gte=since
-    )
+    ))
+    message_ids = {
+        int(c.object_pk) for c in comments if c.object_pk.isdigit()
+    }
+    messages = FoiMessage.objects.filter(
+        pk__in=message_ids
+    ).select_related('request')
+    message_map = {str(m.pk): m for m in messages}
 
     for comment in comments:
-        try:
-            message = FoiMessage.objects.select_related(
-                'request').get(pk=comment.object_pk)
-        except FoiMessage.DoesNotExist:
+        message = message_map.get(comment.object_pk)
+        if message is None:
             continue
 
         time = formats.date_format(
@@ -87,72 +114,222 @@ def add_event_updates(updates, since):
         ))
 
 
-def send_requester_update(updates):
+def get_requester_digests(day, updates):
     requester_updates = defaultdict(list)
-    # send out update on comments to request users
     for request, update_list in updates.items():
-        if not update_list:
+        if request.user_id is None:
             continue
         if not any([x for x in update_list if x[2] != request.user_id]):
             continue
-
         sorted_events = sorted(update_list, key=lambda x: x[0])
-
-        requester_updates[request.user].append({
-            'request': request,
+        requester_updates[request.user_id].append({
+            'request': request.id,
             'events': [x[1] for x in sorted_events]
         })
-
-    for user, request_list in requester_updates.items():
-        send_update(request_list, user=user)
+    for user_id, update_list in requester_updates.items():
+        yield UpdateDigest(
+            day=day, kind=UpdateDigest.KIND_REQUESTER,
+            recipient='user:%s' % user_id, user_id=user_id,
+            updates=update_list
+        )
 
 
-def get_follower_updates(updates):
-    follower_updates = defaultdict(list)
-    for request, update_list in updates.items():
-        if not update_list:
-            continue
-        if not request.is_public():
+def get_follower_digests(day, updates):
+    """
+    Streams followers of all updated public requests ordered
+    by recipient and yields one digest per recipient
+    """
+    request_updates = {
+        request.id: sorted(update_list, key=lambda x: x[0])
+        for request, update_list in updates.items()
+        if update_list and request.is_public()
+    }
+    followers = FoiRequestFollower.objects.filter(
+        request_id__in=list(request_updates), confirmed=True
+    ).order_by('user_id', 'email', 'request_id').values_list(
+        'id', 'request_id', 'user_id', 'email'
+    )
+    current, update_list = None, []
+    for follower_id, request_id, user_id, email in followers.iterator():
+        ident = (user_id, email if user_id is None else '')
+        if ident != current:
+            if update_list:
+                yield make_follower_digest(day, current, update_list)
+            current, update_list = ident, []
+        request_update_list = request_updates[request_id]
+        if not any([x for x in request_update_list if x[2] != user_id]):
             continue
-        update_list.sort(key=lambda x: x[0])
-        followers = FoiRequestFollower.objects.filter(
-                request=request, confirmed=True).select_related('user')
-        for follower in followers:
-            if not any([x for x in update_list if x[2] != follower.user_id]):
-                continue
-            ident = follower.user or follower.email
-            follower_updates[ident].append({
-                'request': request,
-                'unfollow_link': follower.get_unfollow_link(),
-                'events': [x[1] for x in update_list]
-            })
-
-    return follower_updates
-
+        update_list.append({
+            'request': request_id,
+            'follower': follower_id,
+            'events': [x[1] for x in request_update_list]
+        })
+    if update_list:
+        yield make_follower_digest(day, current, update_list)
+
+
+def make_follower_digest(day, ident, update_list):
+    user_id, email = ident
+    if user_id is not None:
+        recipient = 'user:%s' % user_id
+    else:
+        recipient = 'email:%s' % email
+    return UpdateDigest(
+        day=day, kind=UpdateDigest.KIND_FOLLOWER,
+        recipient=recipient, user_id=user_id, email=email,
+        updates=update_list
+    )
 
-def run_batch_update(update_requester=True, update_follower=True, since=None):
-    if since is None:
-        since = timezone.now() - timedelta(days=1)
 
+def save_digests(digests):
+    batch = []
+    for digest in digests:
+        batch.append(digest)
+        if len(batch) >= DIGEST_CHUNK_SIZE:
+            # Digests planned before for the same day are kept
+            UpdateDigest.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        UpdateDigest.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def plan_update_digests(day, since, update_requester=True,
+                        update_follower=True):
+    """
+    Writes one digest per recipient to the outbox,
+    planning the same day again does not add duplicates
+    """
     translation.activate(settings.LANGUAGE_CODE)
     updates = defaultdict(list)
 
-    add_comment_updates(updates, since)
+    with log_duration('comments'):
+        add_comment_updates(updates, since)
 
     if update_requester:
-        send_requester_update(updates)
+        with log_duration('requester digests'):
+            save_digests(get_requester_digests(day, updates))
 
     if update_follower:
-        # update followers
-        add_event_updates(updates, since)
+        with log_duration('events'):
+            add_event_updates(updates, since)
 
-        follower_updates = get_follower_updates(updates)
+        with log_duration('follower digests'):
+            save_digests(get_follower_digests(day, updates))
 
-        # Send out update on comments and event to followers
-        for follower_ident, update_list in follower_updates.items():
-            FoiRequestFollower.objects.send_update(
-                follower_ident, update_list, batch=True
-            )
+    UpdateDigest.objects.filter(
+        day__lt=day - timedelta(days=DIGEST_KEEP_DAYS)
+    ).delete()
+
+
+def get_unsent_digest_ids(day):
+    return UpdateDigest.objects.filter(
+        day__gt=day - timedelta(days=DIGEST_RETRY_DAYS),
+        day__lte=day, sent__isnull=True
+    ).order_by('id').values_list('id', flat=True)
+
+
+def dispatch_update_digests(day):
+    """
+    Sends unsent digests of day and the past days in chunks
+    across workers, so digests that failed before are sent again
+    """
+    from .tasks import send_update_digests_task
+
+    chunk = []
+    for digest_id in get_unsent_digest_ids(day).iterator():
+        chunk.append(digest_id)
+        if len(chunk) >= DIGEST_CHUNK_SIZE:
+            send_update_digests_task.delay(chunk)
+            chunk = []
+    if chunk:
+        send_update_digests_task.delay(chunk)
+
+
+def send_update_digests(digest_ids):
+    """
+    Sends digests that are not sent yet,
+    returns ids of digests that failed
+    """
+    translation.activate(settings.LANGUAGE_CODE)
+    digests = UpdateDigest.objects.filter(id__in=digest_ids, sent__isnull=True)
+    request_ids, follower_ids = set(), set()
+    for updates in digests.values_list('updates', flat=True):
+        for update in updates:
+            request_ids.add(update['request'])
+            if 'follower' in update:
+                follower_ids.add(update['follower'])
+    requests = FoiRequest.objects.select_related('user').in_bulk(request_ids)
+    followers = FoiRequestFollower.objects.in_bulk(follower_ids)
+
+    failed = []
+    with pooled_mail_connections():
+        for digest_id in digest_ids:
+            try:
+                send_update_digest(digest_id, requests, followers)
+            except Exception as e:
+                logger.exception(e)
+                failed.append(digest_id)
+    return failed
+
+
+def send_update_digest(digest_id, requests, followers):
+    with transaction.atomic():
+        # The row lock keeps other workers from sending
+        # the same digest, sent marks it done for the day
+        digest = UpdateDigest.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            id=digest_id, sent__isnull=True
+        ).select_related('user').first()
+        if digest is None:
+            return
+        send_digest(digest, requests, followers)
+        digest.sent = timezone.now()
+        digest.save(update_fields=['sent'])
+
+
+def send_digest(digest, requests, followers):
+    if digest.kind == UpdateDigest.KIND_REQUESTER:
+        request_list = [{
+            'request': requests[update['request']],
+            'events': update['events']
+        } for update in digest.updates if update['request'] in requests]
+        if request_list:
+            send_update(request_list, user=digest.user)
+        return
+
+    update_list = []
+    for update in digest.updates:
+        request = requests.get(update['request'])
+        follower = followers.get(update['follower'])
+        if request is None or follower is None:
+            # Unfollowed since planning
+            continue
+        follower.request = request
+        update_list.append({
+            'request': request,
+            'follower': follower,
+            'unfollow_link': follower.get_unfollow_link(),
+            'events': update['events']
+        })
+    if update_list:
+        FoiRequestFollower.objects.send_update(
+            digest.user or digest.email, update_list, batch=True
+        )
+
+
+def run_batch_update(update_requester=True, update_follower=True, since=None):
+    if since is None:
+        since = timezone.now() - timedelta(days=1)
+    day = timezone.localdate()
+
+    plan_update_digests(
+        day, since,
+        update_requester=update_requester,
+        update_follower=update_follower
+    )
+    with log_duration('dispatch'):
+        dispatch_update_digests(day)
 
 
 def handle_bounce(sender, bounce, should_deactivate=False, **kwargs):
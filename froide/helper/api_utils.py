@@ -1,3 +1,4 @@
+import base64
 from datetime import datetime
 import json
 from collections import OrderedDict
@@ -10,10 +11,12 @@ from rest_framework.response import Response
 from rest_framework.serializers import ListSerializer
 from rest_framework.utils.serializer_helpers import ReturnDict
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.reverse import reverse
 from rest_framework.renderers import JSONRenderer
 from rest_framework.request import Request
 from rest_framework.test import APIRequestFactory
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from rest_framework_jsonp.renderers import JSONPRenderer
 
@@ -70,6 +73,65 @@ class ElasticLimitOffsetPagination(CustomLimitOffsetPagination):
         return None
 
 
+def encode_search_cursor(search_after):
+    data = json.dumps({'after': search_after})
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_search_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        search_after = data['after']
+    except (ValueError, TypeError, KeyError):
+        raise NotFound('Invalid cursor')
+    if not isinstance(search_after, list):
+        raise NotFound('Invalid cursor')
+    return search_after
+
+
+class ElasticCursorPagination(LimitOffsetPagination):
+    """
+    Pages through search results with search_after.
+    Start with an empty cursor parameter and follow the next links.
+    """
+    max_limit = 50
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        search_after = None
+        if cursor:
+            search_after = decode_search_cursor(cursor)
+        queryset.set_cursor(search_after=search_after)
+        queryset = queryset[:self.limit]
+        self.count = queryset.count()
+        self.next_cursor = queryset.get_cursor()
+        return None
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            encode_search_cursor(self.next_cursor)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('meta', OrderedDict([
+                ('limit', self.limit),
+                ('next', self.get_next_link()),
+                ('previous', None),
+                ('total_count', self.count),
+            ])),
+            ('objects', data),
+        ]))
+
+
 class SearchFacetListSerializer(ListSerializer):
     @property
     def data(self):
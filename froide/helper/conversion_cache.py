@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate all cached conversions,
+# e.g. after changing the conversion toolchain
+CONVERSION_CACHE_VERSION = 1
+# Directory with the output keys of every source hash
+SOURCES_DIR = 'sources'
+
+
+def get_conversion_storage():
+    return FileSystemStorage(location=settings.FOI_CONVERSION_CACHE_ROOT)
+
+
+def get_conversion_key(kind, source_hashes, params=None):
+    """
+    Conversion output is identified by the digests of its sources
+    and all parameters that influence the output
+    """
+    data = json.dumps({
+        'version': CONVERSION_CACHE_VERSION,
+        'kind': kind,
+        'sources': list(source_hashes),
+        'params': params or {},
+    }, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def get_conversion_name(key):
+    return os.path.join(key[:2], key[2:4], '%s.pdf' % key)
+
+
+def get_source_name(source_hash):
+    return os.path.join(
+        SOURCES_DIR, source_hash[:2], '%s.keys' % source_hash
+    )
+
+
+def get_cached_conversion(key):
+    storage = get_conversion_storage()
+    path = storage.path(get_conversion_name(key))
+    try:
+        with open(path, 'rb') as f:
+            output_bytes = f.read()
+    except FileNotFoundError:
+        return None
+    # Modification time marks last use for pruning
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return output_bytes
+
+
+def set_cached_conversion(key, output_bytes, source_hashes=()):
+    storage = get_conversion_storage()
+    path = storage.path(get_conversion_name(key))
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to temporary file and rename so that concurrent workers
+    # never read a partially written file
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(output_bytes)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    for source_hash in source_hashes:
+        add_source_reference(source_hash, key)
+
+
+def add_source_reference(source_hash, key):
+    """
+    Remembers which outputs were made from a source
+    so they can be removed with it
+    """
+    storage = get_conversion_storage()
+    path = storage.path(get_source_name(source_hash))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Appends of single short lines do not interleave
+    with open(path, 'a') as f:
+        f.write('%s\n' % key)
+
+
+def read_source_references(path):
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_cached_conversions(source_hash):
+    """
+    Removes all cached outputs made from the source,
+    e.g. when the source file is deleted
+    """
+    if not source_hash:
+        return
+    storage = get_conversion_storage()
+    path = storage.path(get_source_name(source_hash))
+    for key in read_source_references(path):
+        remove_file(storage.path(get_conversion_name(key)))
+    remove_file(path)
+
+
+def prune_conversion_cache(max_size=None):
+    """
+    Removes least recently used outputs until the cache
+    is smaller than max_size bytes, returns number of removed outputs
+    """
+    if max_size is None:
+        max_size = settings.FOI_CONVERSION_CACHE_MAX_SIZE
+    storage = get_conversion_storage()
+    root = storage.path('')
+    if not os.path.isdir(root):
+        return 0
+    entries = []
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root and SOURCES_DIR in dirnames:
+            dirnames.remove(SOURCES_DIR)
+        for filename in filenames:
+            if not filename.endswith('.pdf'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    removed = 0
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_size:
+            break
+        remove_file(path)
+        total -= size
+        removed += 1
+    if removed:
+        prune_source_references()
+    logger.info('Conversion cache pruned %d outputs, %d bytes left',
+                removed, total)
+    return removed
+
+
+def prune_source_references():
+    storage = get_conversion_storage()
+    sources_root = storage.path(SOURCES_DIR)
+    for dirpath, dirnames, filenames in os.walk(sources_root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            keys = read_source_references(path)
+            if not any(os.path.exists(
+                    storage.path(get_conversion_name(key))) for key in keys):
+                remove_file(path)
+
+
+def cached_conversion(kind, source_hashes, convert, params=None):
+    """
+    Returns output of convert() for the given sources,
+    only calls convert() if there is no cached output.
+    Failed conversions (None) are not cached.
+    """
+    if not settings.FOI_CONVERSION_CACHE:
+        return convert()
+
+    key = get_conversion_key(kind, source_hashes, params=params)
+    output_bytes = get_cached_conversion(key)
+    if output_bytes is not None:
+        logger.info('Conversion cache hit %s %s', kind, key)
+        return output_bytes
+
+    output_bytes = convert()
+    if output_bytes is not None:
+        set_cached_conversion(
+            key, output_bytes, source_hashes=source_hashes
+        )
+    return output_bytes
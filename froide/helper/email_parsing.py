@@ -1,3 +1,4 @@
+import binascii
 from collections import defaultdict
 from contextlib import closing
 from datetime import datetime, timedelta
@@ -6,6 +7,7 @@ from email.parser import BytesParser as Parser
 from email.utils import parseaddr, parsedate_tz, getaddresses
 from io import BytesIO
 import re
+import tempfile
 import time
 from urllib.parse import unquote
 
@@ -17,6 +19,10 @@ DISPO_SPLIT = re.compile(r'''((?:[^;"']|"[^"]*"|'[^']*')+)''')
 # https://tools.ietf.org/html/rfc2231#7
 DISPO_MULTI_VALUE = re.compile(r'(\w+)\*\d+$')
 
+# Spooled attachments stay in memory up to this size
+ATTACHMENT_SPOOL_MAX_MEMORY = 1024 * 1024
+BASE64_CHUNK_SIZE = 64 * 1024
+
 BOUNCE_HEADERS = (
     'Action',
     'Content-Description',
@@ -48,12 +54,12 @@ def get_email_headers(message_bytes, headers=None):
     }
 
 
-def parse_email_body(msgobj):
+def parse_email_body(msgobj, spool_attachments=False):
     body = []
     html = []
     attachments = []
     for part in msgobj.walk():
-        attachment = parse_attachment(part)
+        attachment = parse_attachment(part, spool=spool_attachments)
         if attachment:
             attachments.append(attachment)
         elif part.get_content_type() == "text/plain":
@@ -126,7 +132,57 @@ def parse_dispositions(dispo):
     return dispo_name, dispo_dict
 
 
-def parse_attachment(message_part):
+class SpooledAttachment(tempfile.SpooledTemporaryFile):
+    # Allow setting attachment name like on BytesIO attachments
+    name = None
+
+
+def decode_base64_to_file(payload, fileobj, chunk_size=BASE64_CHUNK_SIZE):
+    """
+    Decodes base64 payload string chunk-wise into fileobj
+    without holding the decoded data in memory
+    """
+    size = 0
+    rest = ''
+    for start in range(0, len(payload), chunk_size):
+        chunk = rest + ''.join(payload[start:start + chunk_size].split())
+        cut = len(chunk) - len(chunk) % 4
+        chunk, rest = chunk[:cut], chunk[cut:]
+        data = binascii.a2b_base64(chunk)
+        fileobj.write(data)
+        size += len(data)
+    if rest:
+        data = binascii.a2b_base64(rest + '=' * (-len(rest) % 4))
+        fileobj.write(data)
+        size += len(data)
+    return size
+
+
+def spool_attachment_payload(message_part):
+    """
+    Moves a base64 encoded attachment payload to a temporary file
+    and drops it from the message part.
+    Returns None if the payload can't be spooled.
+    """
+    if message_part.get_content_maintype() == 'message':
+        return None
+    cte = message_part.get('Content-Transfer-Encoding', '').strip().lower()
+    payload = message_part.get_payload()
+    if cte != 'base64' or not isinstance(payload, str):
+        return None
+    fileobj = SpooledAttachment(max_size=ATTACHMENT_SPOOL_MAX_MEMORY)
+    try:
+        size = decode_base64_to_file(payload, fileobj)
+    except binascii.Error:
+        fileobj.close()
+        return None
+    fileobj.seek(0)
+    fileobj.size = size
+    message_part.set_payload('')
+    return fileobj
+
+
+def parse_attachment(message_part, spool=False):
     content_disposition = message_part.get("Content-Disposition", None)
     if not content_disposition:
         return None
@@ -136,13 +192,17 @@ def parse_attachment(message_part):
         return None
 
     content_type = message_part.get("Content-Type", None)
-    file_data = message_part.get_payload(decode=True)
-    if file_data is None:
-        payloads = message_part.get_payload()
-        file_data = '\n\n'.join([p.as_string() for p in payloads]).encode('utf-8')
-    attachment = BytesIO(file_data)
+    attachment = None
+    if spool:
+        attachment = spool_attachment_payload(message_part)
+    if attachment is None:
+        file_data = message_part.get_payload(decode=True)
+        if file_data is None:
+            payloads = message_part.get_payload()
+            file_data = '\n\n'.join([p.as_string() for p in payloads]).encode('utf-8')
+        attachment = BytesIO(file_data)
+        attachment.size = len(file_data)
     attachment.content_type = message_part.get_content_type()
-    attachment.size = len(file_data)
     attachment.name = None
     attachment.create_date = None
     attachment.mod_date = None
@@ -1,5 +1,8 @@
 from collections import namedtuple
+from contextlib import contextmanager
 import logging
+import smtplib
+import threading
 
 from django.core.mail import (
     EmailMessage, EmailMultiAlternatives, get_connection
@@ -20,6 +23,8 @@ HANDLE_BOUNCES = settings.FROIDE_CONFIG['bounce_enabled']
 
 logger = logging.getLogger(__name__)
 
+_local = threading.local()
+
 EmailContent = namedtuple('EmailContent', (
     'subject', 'text', 'html'
 ))
@@ -251,10 +256,63 @@ class MailIntent:
 
 
 def get_mail_connection(**kwargs):
-    return get_connection(
-        backend=settings.EMAIL_BACKEND,
-        **kwargs
-    )
+    pool = getattr(_local, 'connection_pool', None)
+    if pool is None:
+        return get_connection(
+            backend=settings.EMAIL_BACKEND,
+            **kwargs
+        )
+    # Envelope sender is set per message, not per connection
+    return_path = kwargs.pop('return_path', None)
+    key = tuple(sorted(kwargs.items()))
+    if key not in pool:
+        connection = get_connection(
+            backend=settings.EMAIL_BACKEND,
+            **kwargs
+        )
+        connection.open()
+        pool[key] = connection
+    connection = pool[key]
+    set_return_path(connection, return_path)
+    return connection
+
+
+def set_return_path(connection, return_path):
+    init_kwargs = getattr(connection, 'init_kwargs', None)
+    if init_kwargs is not None:
+        # Celery email backend passes its kwargs to the sending task
+        init_kwargs['return_path'] = return_path
+        if return_path is None:
+            init_kwargs.pop('return_path')
+    else:
+        connection.return_path = return_path
+
+
+def is_pooled():
+    return getattr(_local, 'connection_pool', None) is not None
+
+
+@contextmanager
+def pooled_mail_connections():
+    """
+    Mails sent in this block reuse one open connection
+    per backend configuration, they are closed at the end
+    """
+    if is_pooled():
+        # Already pooled by an outer block
+        yield
+        return
+    _local.connection_pool = {}
+    try:
+        yield
+    finally:
+        pool = _local.connection_pool
+        _local.connection_pool = None
+        for connection in pool.values():
+            try:
+                connection.close()
+            except Exception as e:
+                logger.exception(e)
 
 
 def send_template_email(
@@ -332,4 +390,12 @@ def send_mail(subject, body, email_address,
         for name, data, mime_type in attachments:
             email.attach(name, data, mime_type)
 
-    return email.send(fail_silently=fail_silently)
+    try:
+        return email.send(fail_silently=fail_silently)
+    except smtplib.SMTPServerDisconnected:
+        if not is_pooled():
+            raise
+        # Server dropped the pooled connection, reconnect once
+        connection.close()
+        connection.open()
+        return email.send(fail_silently=fail_silently)
@@ -11,9 +11,13 @@ import contextlib
 from io import BytesIO
 import base64
 import re
-from email.parser import BytesParser as Parser
+from email.parser import BytesParser as Parser, BytesFeedParser
 import imaplib
-from typing import Iterator, Tuple, Optional, Union
+import itertools
+import select
+import ssl
+import time
+from typing import Iterator, List, Tuple, Optional, Union
 
 from django.conf import settings
 from django.utils import timezone
@@ -57,6 +61,8 @@ MAILBOX_FULL = DsnStatus(5, 2, 2)
 # Restrict to max 3 consecutive newlines in email body
 MULTI_NL_RE = re.compile('((?:\r?\n){,3})(?:\r?\n)*')
 UID_RE = re.compile(r'UID\s+(?P<uid>\d+)')
+# Tags of IDLE commands, distinct from imaplib's own tags
+IDLE_TAGS = itertools.count(1)
 
 
 def get_imap_message_uid(flag_bytes):
@@ -80,17 +86,146 @@ def get_mail_client(host, port, user, password, ssl=True):
     con.logout()
 
 
+def make_uid_set(uids) -> str:
+    """
+    Compress a list of IMAP UIDs into an IMAP sequence set
+    e.g. [1, 2, 3, 5] -> '1:3,5'
+    """
+    uids = sorted(set(int(uid) for uid in uids))
+    ranges = []
+    for uid in uids:
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(
+        str(start) if start == end else '%d:%d' % (start, end)
+        for start, end in ranges
+    )
+
+
+def parse_imap_fetch_response(data) -> List[Tuple[Optional[str], bytes]]:
+    """
+    Turns the response of a multi message FETCH into (uid, bytes) tuples.
+    The UID item may come before or after the literal body.
+    """
+    messages = []
+    for item in data:
+        if isinstance(item, tuple):
+            messages.append([get_imap_message_uid(item[0]), item[1]])
+        elif messages and messages[-1][0] is None and item:
+            messages[-1][0] = get_imap_message_uid(item)
+    return [(uid, body) for uid, body in messages]
+
+
+class MailFetchStats(object):
+    def __init__(self):
+        self.start = time.monotonic()
+        self.batches = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def add_batch(self, batch):
+        self.batches += 1
+        self.messages += len(batch)
+        self.bytes += sum(len(mail_bytes) for _uid, mail_bytes in batch)
+
+    def as_dict(self):
+        duration = time.monotonic() - self.start
+        return {
+            'batches': self.batches,
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'duration': duration,
+            'messages_per_second': (
+                self.messages / duration if duration > 0 else 0.0
+            )
+        }
+
+
+def get_unread_mail_batches(
+        mailbox: Union[imaplib.IMAP4_SSL, imaplib.IMAP4],
+        flag=False, batch_size=50
+        ) -> Iterator[List[Tuple[Optional[str], bytes]]]:
+    """
+    Fetches unread mails in chunks of UID ranges: one FETCH and
+    (optionally) one STORE round trip per chunk instead of per message.
+    """
+    status, count = mailbox.select('Inbox')
+    typ, data = mailbox.uid('SEARCH', None, 'UNSEEN')
+    uids = data[0].split()
+    for i in range(0, len(uids), batch_size):
+        uid_set = make_uid_set(uids[i:i + batch_size])
+        typ, data = mailbox.uid('FETCH', uid_set, '(UID BODY[])')
+        batch = parse_imap_fetch_response(data)
+        flag_uids = [uid for uid, _mail_bytes in batch if uid is not None]
+        if flag and flag_uids:
+            mailbox.uid(
+                'STORE', make_uid_set(flag_uids), '+FLAGS', '\\Flagged'
+            )
+        yield batch
+
+
 def get_unread_mails(
         mailbox: Union[imaplib.IMAP4_SSL, imaplib.IMAP4],
         flag=False) -> Iterator[Tuple[Optional[str], bytes]]:
-    status, count = mailbox.select('Inbox')
-    typ, data = mailbox.search(None, 'UNSEEN')
-    for num in data[0].split():
-        status, data = mailbox.fetch(num, '(BODY[] UID)')
-        uid = get_imap_message_uid(data[0][0])
-        if flag:
-            mailbox.store(num, '+FLAGS', '\\Flagged')
-        yield uid, data[0][1]
+    for batch in get_unread_mail_batches(mailbox, flag=flag):
+        yield from batch
+
+
+def has_received_data(mailbox) -> bool:
+    """
+    Checks without blocking for received data that select doesn't see,
+    because imaplib's file object or SSL already buffered it
+    """
+    sock = mailbox.sock
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        return bool(mailbox.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def imap_idle(mailbox: Union[imaplib.IMAP4_SSL, imaplib.IMAP4],
+              timeout=29 * 60) -> bool:
+    """
+    Waits in IMAP IDLE (RFC 2177) on the selected mailbox until the server
+    announces new mail or the timeout passes.
+    Returns True if new mail was announced.
+    """
+    tag = b'IDLE%d' % next(IDLE_TAGS)
+    mailbox.send(tag + b' IDLE\r\n')
+    line = mailbox.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error('IDLE not supported: %r' % line)
+
+    sock = mailbox.sock
+    deadline = time.monotonic() + timeout
+    new_mail = False
+    while not new_mail:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not has_received_data(mailbox):
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+        line = mailbox.readline()
+        if not line:
+            raise imaplib.IMAP4.abort('Connection closed during IDLE')
+        new_mail = line.startswith(b'*') and b'EXISTS' in line
+
+    mailbox.send(b'DONE\r\n')
+    while True:
+        line = mailbox.readline()
+        if not line:
+            raise imaplib.IMAP4.abort('Connection closed during IDLE')
+        if line.startswith(tag):
+            break
+    return new_mail
 
 
 def unflag_mail(mailbox, uid):
@@ -217,12 +352,29 @@ def fix_email_body(body):
 
 
 class EmailParser(object):
+    STREAM_CHUNK_SIZE = 64 * 1024
 
     def parse(self, bytesfile):
         p = Parser()
         msgobj = p.parse(bytesfile)
-
-        body, html, attachments = parse_email_body(msgobj)
+        return self.parse_message(msgobj)
+
+    def parse_stream(self, bytesfile):
+        """
+        Feeds the mail incrementally and spools base64 attachment
+        payloads to temporary files, so neither the raw mail nor
+        decoded attachments need to be held in memory completely.
+        """
+        p = BytesFeedParser()
+        for chunk in iter(lambda: bytesfile.read(self.STREAM_CHUNK_SIZE), b''):
+            p.feed(chunk)
+        msgobj = p.close()
+        return self.parse_message(msgobj, spool_attachments=True)
+
+    def parse_message(self, msgobj, spool_attachments=False):
+        body, html, attachments = parse_email_body(
+            msgobj, spool_attachments=spool_attachments
+        )
         body = '\n'.join(body).strip()
         html = '\n'.join(html).strip()
 
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from filingcabinet.pdf_utils import convert_to_pdf
+
+from froide.helper.office_conversion import (
+    ConversionError, convert_with_service
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures office document conversion throughput "
+        "with a fresh process per document and with the conversion service"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('filenames', nargs='+', help='Documents to convert')
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='Convert every document this many times'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Number of parallel conversion requests'
+        )
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] * options['repeat']
+        self.benchmark('direct', self.convert_direct, filenames,
+                       options['concurrency'])
+        if settings.FOI_CONVERSION_SERVICE_ADDRESS:
+            self.benchmark('service', convert_with_service, filenames,
+                           options['concurrency'])
+        else:
+            self.stdout.write('service: FOI_CONVERSION_SERVICE_ADDRESS not set')
+
+    def convert_direct(self, filename):
+        return convert_to_pdf(
+            filename,
+            binary_name=settings.FROIDE_CONFIG.get('doc_conversion_binary'),
+            construct_call=settings.FROIDE_CONFIG.get('doc_conversion_call_func')
+        )
+
+    def benchmark(self, label, convert, filenames, concurrency):
+        start = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(convert, filenames))
+        except ConversionError as e:
+            self.stdout.write('%s: failed (%s)' % (label, e))
+            return
+        duration = time.monotonic() - start
+        failed = len([r for r in results if r is None])
+        self.stdout.write(
+            '%s: %d documents in %.2fs, %.1f docs/minute, %d failed' % (
+                label, len(results), duration,
+                len(results) / duration * 60, failed
+            )
+        )
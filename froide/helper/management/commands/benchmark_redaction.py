@@ -0,0 +1,70 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from PyPDF2 import PdfFileReader
+
+from froide.helper.redaction import redact_file
+
+BACKENDS = ('raster', 'vector')
+
+
+class Command(BaseCommand):
+    help = "Compares time and output size of the redaction backends on a PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='PDF file to redact')
+        parser.add_argument(
+            '--pages', type=int, default=None,
+            help='Only redact the first n pages'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of redaction processes'
+        )
+
+    def handle(self, *args, **options):
+        filename = options['filename']
+        instructions = self.get_instructions(filename, options['pages'])
+        original_size = os.path.getsize(filename)
+        self.stdout.write('Original: %d bytes, %d pages redacted' % (
+            original_size,
+            len([p for p in instructions['pages'] if p['rects']])
+        ))
+        for backend in BACKENDS:
+            start = time.monotonic()
+            with open(filename, 'rb') as f:
+                pdf_bytes = redact_file(
+                    f, instructions, workers=options['workers'],
+                    backend=backend
+                )
+            duration = time.monotonic() - start
+            if pdf_bytes is None:
+                self.stdout.write('%s: failed' % backend)
+                continue
+            self.stdout.write('%s: %.2fs, %d bytes (%.1f%% of original)' % (
+                backend, duration, len(pdf_bytes),
+                len(pdf_bytes) / original_size * 100
+            ))
+
+    def get_instructions(self, filename, max_pages=None):
+        """
+        Redact a band in the upper third of every page
+        """
+        with open(filename, 'rb') as f:
+            reader = PdfFileReader(f, strict=False)
+            pages = []
+            for page_idx in range(reader.getNumPages()):
+                box = reader.getPage(page_idx).mediaBox
+                width = float(box.getWidth())
+                height = float(box.getHeight())
+                rects = []
+                if max_pages is None or page_idx < max_pages:
+                    rects = [[width * 0.1, height * 0.3, width * 0.5, height * 0.05]]
+                pages.append({
+                    'width': width,
+                    'rects': rects,
+                    'texts': []
+                })
+        return {'pages': pages}
@@ -0,0 +1,51 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from froide.helper.office_conversion import ConversionError, ConversionService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Runs warm LibreOffice processes that convert office documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.FOI_CONVERSION_SERVICE_WORKERS,
+            help='Number of LibreOffice processes'
+        )
+        parser.add_argument(
+            '--address', default=settings.FOI_CONVERSION_SERVICE_ADDRESS,
+            help='Socket path to listen on'
+        )
+        parser.add_argument(
+            '--timeout', type=int, default=settings.FOI_CONVERSION_TIMEOUT,
+            help=(
+                'Seconds a conversion may wait for a worker '
+                'and seconds after which it is aborted'
+            )
+        )
+        parser.add_argument(
+            '--profile-root', default=None,
+            help='Directory for the LibreOffice user profiles'
+        )
+
+    def handle(self, *args, **options):
+        if not options['address']:
+            raise CommandError(
+                'Set FOI_CONVERSION_SERVICE_ADDRESS or pass --address'
+            )
+        try:
+            service = ConversionService(
+                options['address'], workers=options['workers'],
+                profile_root=options['profile_root'],
+                timeout=options['timeout']
+            )
+            service.run()
+        except ConversionError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            pass
@@ -1,61 +1,241 @@
-import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import time
 
-from elasticsearch.exceptions import ConnectionError
+from django.conf import settings
+from django.db import connections as db_connections
+from django.db.models import Max, Min
+from django.utils.module_loading import import_string
+
+from elasticsearch.helpers import parallel_bulk
+from elasticsearch_dsl.connections import connections
 
 from django_elasticsearch_dsl.registries import registry
 from django_elasticsearch_dsl.management.commands.search_index import Command as DESCommand
 
-# FIXME: DB chunk size only starting Django 2.0
-DB_CHUNK_SIZE = 2000
 CHUNK_SIZE = 128
+RANGE_SIZE = 10000
 
 
-def grouper(n, iterable):
-    it = iter(iterable)
-    while True:
-        chunk = tuple(itertools.islice(it, n))
-        if not chunk:
-            return
-        yield chunk
+def init_worker():
+    # Don't share database or Elasticsearch sockets with the parent
+    db_connections.close_all()
+    connections.create_connection(**settings.ELASTICSEARCH_DSL['default'])
+
+
+def index_range(job):
+    """
+    Indexes objects with start <= pk < end into index_name,
+    runs in a worker process
+    """
+    doc_path, index_name, start, end, chunk_size, thread_count = job
+    doc = import_string(doc_path)()
+    qs = doc.get_queryset().filter(pk__gte=start, pk__lt=end).order_by('pk')
+    actions = (
+        dict(doc._prepare_action(obj, 'index'), _index=index_name)
+        for obj in qs.iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    errors = []
+    try:
+        # queue_size bounds the prepared chunks waiting for Elasticsearch
+        for ok, info in parallel_bulk(
+                connections.get_connection(), actions,
+                thread_count=thread_count, chunk_size=chunk_size,
+                queue_size=thread_count, raise_on_error=False):
+            count += 1
+            if not ok:
+                errors.append(info)
+    except Exception as e:
+        return start, end, count, [str(e)]
+    return start, end, count, errors
+
+
+class Checkpoint(object):
+    """
+    Records completed pk ranges of one index build in a JSON file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_name = None
+        self.range_size = RANGE_SIZE
+        self.done = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        self.index_name = data['index']
+        self.range_size = data['range_size']
+        self.done = {tuple(r) for r in data['done']}
+        return True
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'index': self.index_name,
+                'range_size': self.range_size,
+                'done': sorted(self.done)
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class Command(DESCommand):
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of indexing processes'
+        )
+        parser.add_argument(
+            '--threads', type=int, default=2,
+            help='Bulk request threads per indexing process'
+        )
+        parser.add_argument(
+            '--range-size', type=int, default=RANGE_SIZE,
+            help='Number of primary keys per work unit'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Number of documents per bulk request'
+        )
+        parser.add_argument(
+            '--swap', action='store_true', default=False,
+            help='Populate a new index and swap the alias when done'
+        )
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip ranges completed by a previous interrupted run'
+        )
+        parser.add_argument(
+            '--checkpoint-dir', default=tempfile.gettempdir(),
+            help='Directory for checkpoint files'
+        )
+
     def _populate(self, models, options):
         for doc in registry.get_documents(models):
-            qs = doc().get_queryset()
-            count = qs.count()
-            self.stdout.write(
-                "Indexing {} '{}' objects "
-                "with custom chunk_size {}".format(
-                    count, doc.django.model.__name__, CHUNK_SIZE
+            self.populate_document(doc, options)
+
+    def populate_document(self, doc, options):
+        doc_instance = doc()
+        alias = doc._index._name
+        checkpoint = Checkpoint(os.path.join(
+            options['checkpoint_dir'], 'search_index_%s.json' % alias
+        ))
+        if not (options['resume'] and checkpoint.load()):
+            checkpoint.remove()
+            checkpoint.done = set()
+            checkpoint.index_name = alias
+            checkpoint.range_size = options['range_size']
+            if options['swap']:
+                checkpoint.index_name = '%s_%s' % (
+                    alias, time.strftime('%Y%m%d%H%M%S')
                 )
+                doc._index.clone(name=checkpoint.index_name).create()
+            checkpoint.save()
+        else:
+            self.stdout.write('Resuming {} with {} completed ranges'.format(
+                checkpoint.index_name, len(checkpoint.done)
+            ))
+
+        ranges = self.get_ranges(doc_instance.get_queryset(),
+                                 checkpoint.range_size)
+        todo = [r for r in ranges if r not in checkpoint.done]
+        self.stdout.write(
+            "Indexing '{}' into {}: {} of {} ranges with {} workers".format(
+                doc.django.model.__name__, checkpoint.index_name,
+                len(todo), len(ranges), options['workers']
             )
-            working_chunk_divider = None
-            obj_iterator = qs.iterator()
-            for i, obj_group in enumerate(grouper(CHUNK_SIZE, obj_iterator)):
-                percentage = round((i * CHUNK_SIZE) / count * 100, 2)
-                self.stdout.write('Indexing {}%'.format(
-                    percentage
-                ), ending='\r')
-                tries = 1
-                if working_chunk_divider is None:
-                    divider = 1
-                else:
-                    divider = working_chunk_divider
-                while True:
-                    sub_group_size = max(CHUNK_SIZE // (2 ** divider), 1)
-                    sub_groups = list(grouper(sub_group_size, obj_group))
-                    try:
-                        for sub_group in sub_groups:
-                            doc().update(sub_group, chunk_size=sub_group_size)
-                        working_chunk_divider = divider
-                        break
-                    except ConnectionError:
-                        self.stdout.write('Failed chunk {} ({}%) at size {} with group {} ({} tries)'.format(
-                            i, percentage, sub_group_size, [x.pk for x in sub_group], tries
-                        ))
-                        tries += 1
-                        divider = tries
-
-            self.stdout.write('Done')
+        )
+        doc_path = '%s.%s' % (doc.__module__, doc.__name__)
+        jobs = [
+            (doc_path, checkpoint.index_name, start, end,
+             options['chunk_size'], options['threads'])
+            for start, end in todo
+        ]
+
+        failed = 0
+        count = 0
+        start_time = time.monotonic()
+        for start, end, range_count, errors in self.run_jobs(
+                jobs, options['workers']):
+            count += range_count
+            if errors:
+                failed += 1
+                self.stderr.write('Failed range {}-{}: {}'.format(
+                    start, end, errors[:3]
+                ))
+                continue
+            checkpoint.done.add((start, end))
+            checkpoint.save()
+            self.stdout.write('Indexed {} objects, {}/{} ranges ({:.0f}/s)'.format(
+                count, len(checkpoint.done), len(ranges),
+                count / max(time.monotonic() - start_time, 0.001)
+            ), ending='\r')
+
+        self.stdout.write('')
+        if failed:
+            self.stderr.write(
+                '{} ranges failed, run again with --resume'.format(failed)
+            )
+            return
+
+        if options['swap']:
+            self.swap_alias(alias, checkpoint.index_name)
+        checkpoint.remove()
+        self.stdout.write('Done')
+
+    def get_ranges(self, qs, range_size):
+        bounds = qs.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+        if bounds['min_pk'] is None:
+            return []
+        # Align ranges so they stay the same between runs
+        first = bounds['min_pk'] // range_size * range_size
+        return [
+            (start, start + range_size)
+            for start in range(first, bounds['max_pk'] + 1, range_size)
+        ]
+
+    def run_jobs(self, jobs, workers):
+        if workers <= 1:
+            for job in jobs:
+                yield index_range(job)
+            return
+        # Close connections so forked workers don't inherit them
+        db_connections.close_all()
+        with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+            yield from pool.imap_unordered(index_range, jobs)
+
+    def swap_alias(self, alias, index_name):
+        """
+        Points alias to index_name in one atomic request,
+        old indices are only deleted afterwards
+        """
+        es = connections.get_connection()
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        old_indices = []
+        if es.indices.exists_alias(name=alias):
+            old_indices = list(es.indices.get_alias(name=alias).keys())
+            actions = [
+                {'remove': {'index': name, 'alias': alias}}
+                for name in old_indices
+            ] + actions
+        elif es.indices.exists(index=alias):
+            # A concrete index still has the alias name,
+            # it is removed in the same request that creates the alias
+            self.stdout.write('Replacing index {} with alias'.format(alias))
+            actions.append({'remove_index': {'index': alias}})
+        es.indices.update_aliases(body={'actions': actions})
+        for name in old_indices:
+            if name != index_name:
+                es.indices.delete(index=name, ignore=404)
+        self.stdout.write('Alias {} now points to {}'.format(alias, index_name))
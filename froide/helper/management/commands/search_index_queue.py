@@ -0,0 +1,46 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from froide.helper.search.cache import get_search_cache_stats
+from froide.helper.search.instrumentation import BROKEN_KEY
+from froide.helper.search.index_queue import (
+    get_index_queue_metrics, get_related_progress
+)
+
+
+class Command(BaseCommand):
+    help = "Shows search index update queue and search cache statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--related', nargs=3,
+            metavar=('MODEL', 'PK', 'RELATED_MODEL'),
+            help='Show progress of a related fan-out, '
+                 'e.g. publicbody.publicbody 1 foirequest.foirequest'
+        )
+
+    def handle(self, *args, **options):
+        if options['related']:
+            progress = get_related_progress(*options['related'])
+            if progress is None:
+                self.stdout.write('No related update found')
+            else:
+                self.stdout.write(
+                    '%(done)d/%(total)d scheduled, '
+                    'finished: %(finished)s' % progress
+                )
+            return
+        self.stdout.write(
+            'depth: %(depth)d, lag: %(lag).1fs, '
+            'processed: %(processed)d' % get_index_queue_metrics()
+        )
+        self.stdout.write(
+            'broken queries: %d' % (cache.get(BROKEN_KEY) or 0)
+        )
+        for name, stats in get_search_cache_stats().items():
+            self.stdout.write(
+                '%s cache: %d hits, %d misses (%.1f%%)' % (
+                    name, stats['hits'], stats['misses'],
+                    stats['hit_rate'] * 100
+                )
+            )
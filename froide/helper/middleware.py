@@ -1,3 +1,8 @@
+from froide.helper.search.instrumentation import (
+    start_timings, stop_timings
+)
+
+
 class XForwardedForMiddleware(object):
     """
     Middleware that sets REMOTE_ADDR to a proxy fwd IP address
@@ -12,3 +17,23 @@ class XForwardedForMiddleware(object):
 
         response = self.get_response(request)
         return response
+
+
+class SearchTimingMiddleware(object):
+    """
+    Middleware that adds timings of search queries
+    as Server-Timing header
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_timings()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = stop_timings()
+        server_timing = timings.get_server_timing()
+        if server_timing:
+            response['Server-Timing'] = server_timing
+        return response
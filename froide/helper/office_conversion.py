@@ -0,0 +1,379 @@
+"""
+Conversion service that keeps headless LibreOffice processes running
+so that conversions don't pay for LibreOffice startup every time.
+
+The service is started with the ``run_conversion_service`` management
+command and listens on ``FOI_CONVERSION_SERVICE_ADDRESS``. Every office
+process has its own user profile, jobs are distributed over a local
+queue to whichever process is idle.
+"""
+from multiprocessing.connection import Client, Listener
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from filingcabinet.pdf_utils import convert_to_pdf
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    UNO_AVAILABLE = True
+except ImportError:
+    UNO_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+BASE_PORT = 2002
+CONNECT_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 30
+# Seconds for sending the job and the result between client and service
+TRANSFER_TIMEOUT = 5
+# Error sent for jobs that timed out, clients fall back to a local process
+TIMEOUT_ERROR = 'timeout'
+
+EXPORT_FILTERS = (
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+    ('com.sun.star.text.GenericTextDocument', 'writer_pdf_Export'),
+)
+DEFAULT_EXPORT_FILTER = 'writer_pdf_Export'
+
+
+class ConversionError(Exception):
+    pass
+
+
+def make_properties(**kwargs):
+    props = []
+    for key, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = key
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+def get_export_filter(doc):
+    for service, filter_name in EXPORT_FILTERS:
+        if doc.supportsService(service):
+            return filter_name
+    return DEFAULT_EXPORT_FILTER
+
+
+def get_service_authkey():
+    return settings.SECRET_KEY.encode('utf-8')
+
+
+def get_client_timeout():
+    """
+    Seconds a client waits for the service, jobs wait at most one
+    conversion timeout for a worker and one for their conversion
+    """
+    return 2 * settings.FOI_CONVERSION_TIMEOUT + TRANSFER_TIMEOUT
+
+
+def get_task_time_limit():
+    """
+    Time limit of conversion tasks, covers waiting for the service
+    and the fallback conversion in a fresh process
+    """
+    return get_client_timeout() + settings.FOI_CONVERSION_TIMEOUT + 10
+
+
+class OfficeProcess(object):
+    """
+    One headless soffice process with a private user profile
+    """
+    def __init__(self, index, binary_name, profile_root):
+        self.index = index
+        self.binary_name = binary_name
+        self.port = BASE_PORT + index
+        self.profile_path = os.path.join(profile_root, 'profile_%d' % index)
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+
+    def __str__(self):
+        return 'office process %d' % self.index
+
+    def get_arguments(self):
+        return [
+            self.binary_name, '--headless', '--invisible', '--nologo',
+            '--norestore', '--nodefault', '--nofirststartwizard',
+            '--nolockcheck',
+            '-env:UserInstallation=%s' % uno.systemPathToFileUrl(
+                self.profile_path
+            ),
+            '--accept=socket,host=127.0.0.1,port=%d;urp;' % self.port,
+        ]
+
+    def start(self):
+        os.makedirs(self.profile_path, exist_ok=True)
+        env = dict(os.environ)
+        env.update({'HOME': self.profile_path})
+        self.process = subprocess.Popen(
+            self.get_arguments(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env
+        )
+        self.desktop = self.connect()
+        logger.info('Started %s on port %d', self, self.port)
+
+    def connect(self):
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local
+        )
+        url = (
+            'uno:socket,host=127.0.0.1,port=%d;urp;'
+            'StarOffice.ComponentContext' % self.port
+        )
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise ConversionError('%s exited on startup' % self)
+            try:
+                ctx = resolver.resolve(url)
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise ConversionError('Could not connect to %s' % self)
+                time.sleep(0.25)
+        return ctx.ServiceManager.createInstanceWithContext(
+            'com.sun.star.frame.Desktop', ctx
+        )
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.desktop = None
+
+    def restart(self):
+        logger.warning('Restarting %s', self)
+        self.kill()
+        # A crashed process may leave a broken profile behind
+        shutil.rmtree(self.profile_path, ignore_errors=True)
+        self.start()
+
+    def is_healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getCurrentComponent()
+        except Exception:
+            return False
+        return True
+
+    def convert(self, filepath, output_path):
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(filepath), '_blank', 0,
+            make_properties(Hidden=True, ReadOnly=True)
+        )
+        if doc is None:
+            raise ConversionError('Could not load %s' % filepath)
+        try:
+            doc.storeToURL(
+                uno.systemPathToFileUrl(output_path),
+                make_properties(FilterName=get_export_filter(doc))
+            )
+        finally:
+            doc.close(True)
+        self.conversions += 1
+
+
+class ConversionJob(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.office = None
+        self.cancelled = False
+
+
+class ConversionService(object):
+    """
+    Runs a pool of office processes and serves conversion requests
+    """
+    def __init__(self, address, workers=2, binary_name=None,
+                 profile_root=None, timeout=None):
+        if not UNO_AVAILABLE:
+            raise ConversionError(
+                'Python UNO bindings are required for the conversion service'
+            )
+        self.address = address
+        if timeout is None:
+            timeout = settings.FOI_CONVERSION_TIMEOUT
+        # Jobs not picked up by a worker in this time
+        # are given back to the client
+        self.timeout = timeout
+        if binary_name is None:
+            binary_name = settings.FROIDE_CONFIG.get('doc_conversion_binary')
+        if profile_root is None:
+            profile_root = tempfile.mkdtemp(prefix='froide_office_')
+        self.offices = [
+            OfficeProcess(i, binary_name, profile_root)
+            for i in range(workers)
+        ]
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+
+    def run(self):
+        for office in self.offices:
+            office.start()
+            thread = threading.Thread(
+                target=self.work, args=(office,), daemon=True
+            )
+            thread.start()
+        threading.Thread(target=self.check_health, daemon=True).start()
+
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, authkey=get_service_authkey()) as listener:
+            logger.info(
+                'Conversion service listening on %s with %d workers',
+                self.address, len(self.offices)
+            )
+            try:
+                while True:
+                    conn = listener.accept()
+                    threading.Thread(
+                        target=self.handle, args=(conn,), daemon=True
+                    ).start()
+            finally:
+                for office in self.offices:
+                    office.kill()
+
+    def handle(self, conn):
+        with conn:
+            try:
+                filepath = conn.recv()
+            except EOFError:
+                return
+            job = ConversionJob(filepath)
+            self.jobs.put(job)
+            if not job.started.wait(self.timeout):
+                with job.lock:
+                    if not job.started.is_set():
+                        job.cancelled = True
+                if job.cancelled:
+                    logger.warning(
+                        'Conversion of %s was not started in time', filepath
+                    )
+                    conn.send((None, TIMEOUT_ERROR))
+                    return
+            # Conversion time only counts from pick up by a worker
+            if not job.done.wait(self.timeout):
+                job.cancelled = True
+                # Killing the process makes the pending UNO call fail,
+                # the worker thread restarts it
+                office = job.office
+                logger.warning(
+                    'Conversion of %s timed out on %s', filepath, office
+                )
+                with self.lock:
+                    office.kill()
+                conn.send((None, TIMEOUT_ERROR))
+                return
+            conn.send((job.result, job.error))
+
+    def work(self, office):
+        while True:
+            job = self.jobs.get()
+            with job.lock:
+                if job.cancelled:
+                    continue
+                job.office = office
+                job.started.set()
+            outpath = tempfile.mkdtemp()
+            try:
+                output_path = os.path.join(outpath, 'output.pdf')
+                office.convert(job.filepath, output_path)
+                with open(output_path, 'rb') as f:
+                    job.result = f.read()
+            except Exception as e:
+                logger.warning(
+                    'Conversion of %s failed on %s: %s', job.filepath, office, e
+                )
+                job.error = str(e)
+                with self.lock:
+                    if not office.is_healthy():
+                        office.restart()
+            finally:
+                shutil.rmtree(outpath)
+                job.done.set()
+
+    def check_health(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            for office in self.offices:
+                with self.lock:
+                    if not office.is_healthy():
+                        office.restart()
+
+
+def convert_with_service(filepath, address=None, timeout=None):
+    """
+    Sends a conversion job to the conversion service.
+    Raises ConversionError if the service is not reachable
+    or timed out, returns None if the conversion failed.
+    """
+    if timeout is None:
+        timeout = get_client_timeout()
+    if address is None:
+        address = settings.FOI_CONVERSION_SERVICE_ADDRESS
+    if not address:
+        raise ConversionError('No conversion service configured')
+    try:
+        conn = Client(address, authkey=get_service_authkey())
+    except OSError as e:
+        raise ConversionError(str(e))
+    with conn:
+        conn.send(os.path.abspath(filepath))
+        # Give up before the task time limit so the fallback can run
+        if not conn.poll(timeout):
+            raise ConversionError(
+                'No response from conversion service for %s' % filepath
+            )
+        try:
+            output_bytes, error = conn.recv()
+        except EOFError as e:
+            raise ConversionError(str(e))
+    if error == TIMEOUT_ERROR:
+        raise ConversionError('Conversion of %s timed out' % filepath)
+    if error is not None:
+        logger.warning('Conversion service error for %s: %s', filepath, error)
+        return None
+    return output_bytes
+
+
+def convert_office_file(filepath):
+    """
+    Converts with the conversion service if configured,
+    falls back to a fresh office process per call
+    """
+    if settings.FOI_CONVERSION_SERVICE_ADDRESS:
+        try:
+            return convert_with_service(filepath)
+        except ConversionError as e:
+            logger.warning(
+                'Conversion service unavailable, converting directly: %s', e
+            )
+    return convert_to_pdf(
+        filepath,
+        binary_name=settings.FROIDE_CONFIG.get('doc_conversion_binary'),
+        construct_call=settings.FROIDE_CONFIG.get('doc_conversion_call_func')
+    )
@@ -1,4 +1,5 @@
 import base64
+from collections import namedtuple
 import io
 import logging
 import os
@@ -6,6 +7,9 @@ import shutil
 import tempfile
 import zlib
 
+from billiard import Pool
+import pikepdf
+
 from PyPDF2 import PdfFileReader, PdfFileWriter
 from PyPDF2.utils import PdfReadError
 
@@ -23,9 +27,11 @@ from wand.exceptions import DelegateError, WandError
 from filingcabinet.pdf_utils import (
     decrypt_pdf_in_place, rewrite_pdf_in_place,
     rewrite_hard_pdf_in_place,
-    get_images_from_pdf_chunked
+    get_images_from_pdf_chunked, run_ocr
 )
 
+from .vector_redaction import redact_pdf_vector
+
 logger = logging.getLogger(__name__)
 
 
@@ -59,7 +65,25 @@ class PDFException(Exception):
         self.reason = reason
 
 
-def redact_file(pdf_file, instructions):
+RedactionResult = namedtuple('RedactionResult', 'pdf_bytes ocr_pages')
+
+# Errors of loading or rendering a page that a rewrite of the PDF may fix
+PAGE_ERRORS = (WandError, DelegateError, ValueError)
+
+
+def redact_file(pdf_file, instructions, **kwargs):
+    return redact_pdf(pdf_file, instructions, **kwargs).pdf_bytes
+
+
+def redact_pdf(pdf_file, instructions, workers=1, progress=None,
+               backend='raster'):
+    """
+    backend 'raster' rasterises every page with redactions,
+    'vector' removes content under redactions from the content stream
+    and only rasterises pages where that is not possible.
+    Returns RedactionResult with the indexes of pages that lost
+    their text layer and need OCR.
+    """
     try:
         # Limit to around a gigabyte for a 24 bit (3 bpp) image
         PILImage.MAX_IMAGE_PIXELS = int(1024 * 1024 * 1024 // 1 // 3)
@@ -68,14 +92,18 @@ def redact_file(pdf_file, instructions):
         with open(copied_filename, 'wb') as f:
             f.write(pdf_file.read())
         with open(copied_filename, 'rb') as f:
-            output_file = try_redacting_file(f, outpath, instructions)
+            output_file, ocr_pages = try_redacting_file(
+                f, outpath, instructions, workers=workers, progress=progress,
+                backend=backend
+            )
         with open(output_file, 'rb') as f:
-            return f.read()
+            return RedactionResult(f.read(), ocr_pages)
     finally:
         shutil.rmtree(outpath)
 
 
-def try_redacting_file(pdf_file, outpath, instructions):
+def try_redacting_file(pdf_file, outpath, instructions, workers=1,
+                       progress=None, backend='raster'):
     tries = 0
     while True:
         try:
@@ -83,7 +111,10 @@ def try_redacting_file(pdf_file, outpath, instructions):
             if rewritten_pdf_file is None:
                 # Possibly encrypted with password, let's just try it anyway
                 rewritten_pdf_file = pdf_file
-            return _redact_file(rewritten_pdf_file, outpath, instructions)
+            return _redact_file(
+                rewritten_pdf_file, outpath, instructions,
+                workers=workers, progress=progress, backend=backend
+            )
         except PDFException as e:
             tries += 1
             if tries > 2:
@@ -100,7 +131,8 @@ def try_redacting_file(pdf_file, outpath, instructions):
             pdf_file = next_pdf_file
 
 
-def _redact_file(pdf_file, outpath, instructions, tries=0):
+def _redact_file(pdf_file, outpath, instructions, tries=0,
+                 workers=1, progress=None, backend='raster'):
     dpi = 300
     load_invisible_font()
     output = PdfFileWriter()
@@ -124,45 +156,187 @@ def _redact_file(pdf_file, outpath, instructions, tries=0):
     page_instructions = instructions.get('pages', [])
     assert num_pages == len(page_instructions)
 
-    page_image_numbers = [
-        page_idx + 1 for page_idx, instr in enumerate(page_instructions)
+    redact_page_indexes = [
+        page_idx for page_idx, instr in enumerate(page_instructions)
         if instr['rects']
     ]
-    CHUNK_SIZE = 5
-    image_generator = get_images_from_pdf_chunked(
-        pdf_file.name, page_image_numbers, CHUNK_SIZE
+    if backend == 'vector':
+        vector_filename = os.path.join(outpath, 'vector.pdf')
+        try:
+            redact_page_indexes = redact_pdf_vector(
+                pdf_file.name, vector_filename, page_instructions,
+                password=instructions.get('password')
+            )
+        except pikepdf.PdfError as e:
+            raise PDFException(e, 'rewrite')
+        # Take all pages that don't need rasterisation from vector output
+        pdf_reader = PdfFileReader(vector_filename, strict=False)
+
+    redacted_pages = redact_pages(
+        pdf_file.name, page_instructions, redact_page_indexes, outpath,
+        dpi=dpi, workers=workers, progress=progress
     )
 
-    def get_page_iterator(page_instructions, image_generator):
-        for page_idx, instr in enumerate(page_instructions):
-            if instr['rects']:
-                image_filename = next(image_generator)[1]
-                yield page_idx, instr, image_filename
-            else:
-                yield page_idx, instr, None
+    # Rasterised pages only keep text that the client sent along
+    ocr_pages = [
+        page_idx for page_idx in sorted(redacted_pages)
+        if not any(t['text'] for t in page_instructions[page_idx]['texts'])
+    ]
 
-    page_iterator = get_page_iterator(page_instructions, image_generator)
-    for page_idx, instr, image_filename in page_iterator:
-        instr['width'] = float(instr['width'])
+    for page_idx, instr in enumerate(page_instructions):
         try:
-            if not image_filename:
-                page = pdf_reader.getPage(page_idx)
+            if page_idx in redacted_pages:
+                page_reader = PdfFileReader(redacted_pages[page_idx])
+                page = page_reader.getPage(0)
             else:
-                page = get_redacted_page(
-                    image_filename, instr, dpi
-                )
-        except (WandError, DelegateError, ValueError) as e:
+                page = pdf_reader.getPage(page_idx)
+        except ValueError as e:
             raise PDFException(e, 'rewrite')
-
         output.addPage(page)
 
     output_filename = os.path.join(outpath, 'final.pdf')
     with open(output_filename, 'wb') as f:
         output.write(f)
-    return output_filename
+    return output_filename, ocr_pages
+
+
+def ocr_pdf_pages(pdf_bytes, page_indexes, language=None, timeout=None):
+    """
+    Runs OCR only on the given pages and merges them back
+    into the document. Returns None if OCR failed.
+    """
+    outpath = tempfile.mkdtemp()
+    try:
+        reader = PdfFileReader(io.BytesIO(pdf_bytes), strict=False)
+        subset = PdfFileWriter()
+        for page_idx in page_indexes:
+            subset.addPage(reader.getPage(page_idx))
+        subset_filename = os.path.join(outpath, 'subset.pdf')
+        with open(subset_filename, 'wb') as f:
+            subset.write(f)
+
+        ocr_bytes = run_ocr(subset_filename, language=language, timeout=timeout)
+        if ocr_bytes is None:
+            return None
+
+        ocr_reader = PdfFileReader(io.BytesIO(ocr_bytes), strict=False)
+        ocr_page_map = {
+            page_idx: i for i, page_idx in enumerate(page_indexes)
+        }
+        output = PdfFileWriter()
+        for page_idx in range(reader.getNumPages()):
+            if page_idx in ocr_page_map:
+                page = ocr_reader.getPage(ocr_page_map[page_idx])
+            else:
+                page = reader.getPage(page_idx)
+            output.addPage(page)
+        writer = io.BytesIO()
+        output.write(writer)
+        return writer.getvalue()
+    finally:
+        shutil.rmtree(outpath)
+
+
+def redact_pages(pdf_filename, page_instructions, page_indexes, outpath,
+                 dpi=300, workers=1, progress=None):
+    """
+    Rasterises, redacts and encodes the given pages into single page PDFs
+    in outpath, spread over a process pool if workers > 1.
+    Returns dict of page index to filename.
+    """
+    jobs = []
+    for page_idx in page_indexes:
+        instr = page_instructions[page_idx]
+        instr['width'] = float(instr['width'])
+        jobs.append((pdf_filename, page_idx, instr, dpi, outpath))
+
+    total = len(jobs)
+    if progress is not None:
+        progress(0, total)
+
+    if workers > 1 and total > 1:
+        pool = Pool(processes=min(workers, total))
+        try:
+            results = pool.imap_unordered(redact_page_job, jobs)
+            redacted_pages = collect_redacted_pages(results, total, progress)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = redact_pages_sequentially(jobs)
+        redacted_pages = collect_redacted_pages(results, total, progress)
+    return redacted_pages
+
+
+def redact_pages_sequentially(jobs, chunk_size=5):
+    if not jobs:
+        return
+    pdf_filename = jobs[0][0]
+    image_generator = get_images_from_pdf_chunked(
+        pdf_filename, [job[1] + 1 for job in jobs], chunk_size
+    )
+    try:
+        for job in jobs:
+            try:
+                image_filename = next(image_generator)[1]
+            except PAGE_ERRORS as e:
+                yield job[1], None, str(e)
+                return
+            yield render_redacted_page_job(job, image_filename)
+    finally:
+        image_generator.close()
+
+
+def collect_redacted_pages(results, total, progress):
+    redacted_pages = {}
+    for page_idx, page_filename, error in results:
+        if error is not None:
+            raise PDFException(Exception(error), 'rewrite')
+        redacted_pages[page_idx] = page_filename
+        if progress is not None:
+            progress(len(redacted_pages), total)
+    return redacted_pages
+
+
+def redact_page_job(job):
+    """
+    Runs in a pool process, returns only picklable values
+    """
+    pdf_filename, page_idx, instr, dpi, outpath = job
+    load_invisible_font()
+    image_generator = get_images_from_pdf_chunked(
+        pdf_filename, [page_idx + 1], 1
+    )
+    try:
+        image_filename = next(image_generator)[1]
+    except PAGE_ERRORS as e:
+        return page_idx, None, str(e)
+    else:
+        return render_redacted_page_job(job, image_filename)
+    finally:
+        image_generator.close()
+
+
+def render_redacted_page_job(job, image_filename):
+    pdf_filename, page_idx, instr, dpi, outpath = job
+    try:
+        pdf_bytes = render_redacted_page(image_filename, instr, dpi)
+    except PAGE_ERRORS as e:
+        return page_idx, None, str(e)
+
+    page_filename = os.path.join(outpath, 'page_%05d.pdf' % page_idx)
+    with open(page_filename, 'wb') as f:
+        f.write(pdf_bytes)
+    return page_idx, page_filename, None
 
 
 def get_redacted_page(image_filename, instr, dpi):
+    pdf_bytes = render_redacted_page(image_filename, instr, dpi)
+    temp_reader = PdfFileReader(io.BytesIO(pdf_bytes))
+    return temp_reader.getPage(0)
+
+
+def render_redacted_page(image_filename, instr, dpi):
     logger.debug('Redacting page %s', image_filename)
     writer = io.BytesIO()
     pdf = canvas.Canvas(writer)
@@ -199,9 +373,7 @@ def get_redacted_page(image_filename, instr, dpi):
         pdf.showPage()
         pdf.save()
 
-    writer.seek(0)
-    temp_reader = PdfFileReader(writer)
-    return temp_reader.getPage(0)
+    return writer.getvalue()
 
 
 def add_text_on_pdf(pdf, text_obj, dpi, scale, height):
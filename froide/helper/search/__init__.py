@@ -4,7 +4,7 @@ from django.conf import settings
 
 from elasticsearch_dsl import analyzer, tokenizer
 
-from django_elasticsearch_dsl import Index
+from django_elasticsearch_dsl import Document, Index
 
 from .signal_processor import CelerySignalProcessor
 from .queryset import SearchQuerySetWrapper
@@ -12,9 +12,22 @@ from .registry import search_registry
 
 __all__ = [
     'CelerySignalProcessor', 'search_registry', 'SearchQuerySetWrapper',
+    'SearchDocument',
 ]
 
 
+class SearchDocument(Document):
+    """
+    Base of froide's search documents
+    """
+    def update_instances(self, instances):
+        """
+        Called by the index queue with changed instances,
+        override to skip unchanged instances
+        """
+        return self.update(instances)
+
+
 def get_index(name):
     index_name = '%s_%s' % (
         settings.ELASTICSEARCH_INDEX_PREFIX,
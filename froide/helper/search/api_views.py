@@ -4,8 +4,12 @@ from django_filters import rest_framework as filters
 
 from froide.team.models import Team
 
-from ..api_utils import ElasticLimitOffsetPagination
+from ..api_utils import (
+    ElasticLimitOffsetPagination, ElasticCursorPagination
+)
 from . import SearchQuerySetWrapper
+from .utils import use_source_results
+from .instrumentation import timed
 
 
 class ESQueryFilterBackend(filters.DjangoFilterBackend):
@@ -33,14 +37,21 @@ class ESQueryMixin:
             self.sqs.sqs = self.sqs.sqs.highlight('content')
             self.sqs.sqs = self.sqs.sqs.sort('_score')
 
-        paginator = ElasticLimitOffsetPagination()
+        if 'cursor' in request.GET:
+            paginator = ElasticCursorPagination()
+        else:
+            paginator = ElasticLimitOffsetPagination()
         paginator.paginate_queryset(self.sqs, self.request, view=self)
 
-        qs = self.optimize_query(self.sqs.to_queryset())
-        self.queryset = self.sqs.wrap_queryset(qs)
+        with timed('db'):
+            if self.sqs.source_loader is not None:
+                self.queryset = self.sqs.get_source_objects()
+            else:
+                qs = self.optimize_query(self.sqs.to_queryset())
+                self.queryset = self.sqs.wrap_queryset(qs)
 
-        serializer = self.get_serializer(self.queryset, many=True)
-        data = serializer.data
+            serializer = self.get_serializer(self.queryset, many=True)
+            data = serializer.data
 
         return paginator.get_paginated_response(data)
 
@@ -66,10 +77,10 @@ class ESQueryMixin:
         else:
             s = s.filter('term', public=True)
 
-        return SearchQuerySetWrapper(
+        return use_source_results(SearchQuerySetWrapper(
             s,
             self.search_model
-        )
+        ), self.search_document)
 
     def optimize_query(self, qs):
         return qs
@@ -0,0 +1,117 @@
+"""
+Caches for anonymous search result pages and facet label objects
+
+Result pages are keyed by the normalized Elasticsearch request and a
+generation per model that the index queue increments after indexing.
+Facet objects are keyed by a generation of their model that is
+incremented when instances are saved or deleted.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+
+from .index_queue import CACHE_PREFIX, incr_counter
+
+RESULT_PREFIX = '%s:results' % CACHE_PREFIX
+FACET_PREFIX = '%s:facets' % CACHE_PREFIX
+GENERATION_PREFIX = '%s:generation' % CACHE_PREFIX
+
+
+def get_generation_key(model_name):
+    return '%s:%s' % (GENERATION_PREFIX, model_name)
+
+
+def get_generation(model_name):
+    return cache.get(get_generation_key(model_name)) or 0
+
+
+def bump_generation(model_name):
+    incr_counter(get_generation_key(model_name))
+
+
+def get_result_cache_key(model_name, indices, query):
+    data = json.dumps({
+        'indices': sorted(indices),
+        'query': query,
+    }, sort_keys=True, default=str)
+    digest = hashlib.sha256(data.encode('utf-8')).hexdigest()
+    return '%s:%s:%s:%s' % (
+        RESULT_PREFIX, model_name, get_generation(model_name), digest
+    )
+
+
+def get_cached_result(key):
+    result = cache.get(key)
+    incr_counter('%s:%s' % (RESULT_PREFIX, 'hits' if result else 'misses'))
+    return result
+
+
+def set_cached_result(key, result):
+    cache.set(key, result, timeout=settings.SEARCH_RESULT_CACHE_TIMEOUT)
+
+
+def get_facet_cache_key(model_name, generation, pk):
+    return '%s:%s:%s:%s' % (FACET_PREFIX, model_name, generation, pk)
+
+
+def get_facet_objects(model, pks):
+    """
+    Returns {str(pk): obj} for facet labels,
+    only queries objects missing from the cache
+    """
+    model_name = model._meta.label_lower
+    generation = get_generation(model_name)
+    keys = {
+        get_facet_cache_key(model_name, generation, pk): str(pk)
+        for pk in pks
+    }
+    cached = cache.get_many(list(keys))
+    objs = {keys[k]: obj for k, obj in cached.items()}
+    missing = [pk for pk in map(str, pks) if pk not in objs]
+    incr_counter('%s:hits' % FACET_PREFIX, len(pks) - len(missing))
+    incr_counter('%s:misses' % FACET_PREFIX, len(missing))
+    if missing:
+        fetched = {
+            str(o.pk): o for o in model._default_manager.filter(pk__in=missing)
+        }
+        cache.set_many({
+            get_facet_cache_key(model_name, generation, pk): obj
+            for pk, obj in fetched.items()
+        }, timeout=settings.SEARCH_FACET_CACHE_TIMEOUT)
+        objs.update(fetched)
+    return objs
+
+
+def facet_object_changed(sender, instance, **kwargs):
+    bump_generation(sender._meta.label_lower)
+
+
+def connect_facet_model(model):
+    """
+    Invalidates cached facet objects of model when instances change,
+    call from AppConfig.ready of apps that show facets of model
+    """
+    uid = 'facet_cache_%s' % model._meta.label_lower
+    for signal in (post_save, post_delete):
+        signal.connect(facet_object_changed, sender=model, dispatch_uid=uid)
+
+
+def get_hit_rate(prefix):
+    hits = cache.get('%s:hits' % prefix) or 0
+    misses = cache.get('%s:misses' % prefix) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0
+    }
+
+
+def get_search_cache_stats():
+    return {
+        'results': get_hit_rate(RESULT_PREFIX),
+        'facets': get_hit_rate(FACET_PREFIX),
+    }
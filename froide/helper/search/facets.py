@@ -1,6 +1,8 @@
 from django.utils.http import urlencode
 from django.urls import reverse, NoReverseMatch
 
+from .cache import get_facet_objects
+
 
 def make_filter_url(url_name, data=None, get_active_filters=None):
     if data is None:
@@ -60,9 +62,7 @@ def resolve_facet(data, getter=None, label_getter=None,
         query_key = query_param or key
         if model is not None:
             pks = [item['key'] for item in info['buckets']]
-            objs = {
-                str(o.pk): o for o in model._default_manager.filter(pk__in=pks)
-            }
+            objs = get_facet_objects(model, pks)
             for item in info['buckets']:
                 item_key = str(item['key'])
                 if item_key in objs:
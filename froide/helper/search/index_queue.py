@@ -0,0 +1,228 @@
+"""
+Buffer for search index updates
+
+Saves only mark (model label, pk) as dirty. Duplicates are collapsed
+within a transaction and, via the cache, across processes until the
+scheduled flush has run. Flushing loads all dirty instances per model
+and sends them to Elasticsearch with the bulk API.
+"""
+from functools import lru_cache
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ..tasks import (
+    search_instances_update, search_related_update, get_related_documents
+)
+
+CACHE_PREFIX = 'search:index'
+DEPTH_KEY = '%s:depth' % CACHE_PREFIX
+LAG_KEY = '%s:lag' % CACHE_PREFIX
+PROCESSED_KEY = '%s:processed' % CACHE_PREFIX
+RELATED_PREFIX = '%s:related' % CACHE_PREFIX
+# Progress of finished fan-outs stays visible this long
+RELATED_PROGRESS_TIMEOUT = 60 * 60 * 24
+
+_local = threading.local()
+
+
+def get_pending_key(model_name, pk):
+    return '%s:pending:%s:%s' % (CACHE_PREFIX, model_name, pk)
+
+
+def get_local_buffer():
+    if not hasattr(_local, 'buffer'):
+        _local.buffer = set()
+    return _local.buffer
+
+
+def incr_counter(key, delta=1):
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Cache backend without shared state
+        return None
+
+
+def queue_index_update(model_name, pk):
+    """
+    Marks instance for reindexing once the current transaction commits
+    """
+    if pk is None:
+        return
+    get_local_buffer().add((model_name, pk))
+    # The first flush after commit sends the whole buffer,
+    # the following ones find it empty
+    transaction.on_commit(flush_local_buffer)
+
+
+def queue_instance_update(instance):
+    queue_index_update(instance._meta.label_lower, instance.pk)
+
+
+def queue_related_updates(instance):
+    """
+    Marks documents that contain data of instance for reindexing,
+    e.g. before instance is deleted and the relation is gone
+    """
+    buffer = get_local_buffer()
+    for doc in get_related_documents(instance.__class__):
+        related = doc().get_instances_from_related(instance)
+        if related is None:
+            continue
+        model_name = doc.django.model._meta.label_lower
+        buffer.update(
+            (model_name, pk) for pk in
+            related.values_list('pk', flat=True).iterator()
+        )
+    transaction.on_commit(flush_local_buffer)
+
+
+@lru_cache()
+def get_related_fields(model):
+    """
+    Returns names of fields of model that documents of other models
+    contain or None if every change needs to be fanned out
+    """
+    names = set()
+    for doc in get_related_documents(model):
+        related_fields = getattr(doc.django, 'related_fields', {})
+        if model not in related_fields:
+            return None
+        names.update(related_fields[model])
+    return names
+
+
+def get_related_values(instance, names):
+    # Deferred fields are not loaded
+    return {
+        name: instance.__dict__.get(instance._meta.get_field(name).attname)
+        for name in names
+    }
+
+
+def remember_related_values(instance):
+    names = get_related_fields(instance.__class__)
+    if names:
+        instance._search_related_values = get_related_values(instance, names)
+
+
+def related_values_changed(instance, update_fields=None):
+    names = get_related_fields(instance.__class__)
+    if names is None:
+        return True
+    if update_fields is not None and not names & set(update_fields):
+        return False
+    old_values = getattr(instance, '_search_related_values', None)
+    return old_values != get_related_values(instance, names)
+
+
+def queue_related_fan_out(instance, update_fields=None):
+    """
+    Schedules reindexing of documents that contain data of the saved
+    instance if a field they contain has changed since it was loaded
+    """
+    if not related_values_changed(instance, update_fields=update_fields):
+        return
+    remember_related_values(instance)
+    model_name = instance._meta.label_lower
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: search_related_update.delay(model_name, pk)
+    )
+
+
+def flush_local_buffer():
+    buffer = get_local_buffer()
+    if not buffer:
+        return
+    items = sorted(buffer, key=str)
+    buffer.clear()
+    schedule_index_updates(items)
+
+
+def schedule_index_updates(items):
+    now = time.time()
+    timeout = settings.SEARCH_INDEX_UPDATE_DEBOUNCE * 10 + 60
+    new_items = [
+        (model_name, pk) for model_name, pk in items
+        # Already pending items are picked up by the scheduled flush
+        if cache.add(get_pending_key(model_name, pk), now, timeout=timeout)
+    ]
+    if not new_items:
+        return
+    incr_counter(DEPTH_KEY, len(new_items))
+    batch_size = settings.SEARCH_INDEX_UPDATE_BATCH_SIZE
+    for i in range(0, len(new_items), batch_size):
+        search_instances_update.apply_async(
+            (new_items[i:i + batch_size],),
+            countdown=settings.SEARCH_INDEX_UPDATE_DEBOUNCE
+        )
+
+
+def start_index_updates(items):
+    """
+    Called by the flush task before loading instances,
+    changes committed after this are scheduled again
+    """
+    keys = [get_pending_key(model_name, pk) for model_name, pk in items]
+    queued = cache.get_many(keys)
+    cache.delete_many(keys)
+    now = time.time()
+    lag = max((now - t for t in queued.values()), default=0.0)
+    cache.set(LAG_KEY, lag, timeout=None)
+    incr_counter(DEPTH_KEY, -len(items))
+    incr_counter(PROCESSED_KEY, len(items))
+    return lag
+
+
+def get_index_queue_metrics():
+    depth = cache.get(DEPTH_KEY) or 0
+    return {
+        # counter can drift below zero when pending keys expire
+        'depth': max(depth, 0),
+        'lag': cache.get(LAG_KEY) or 0.0,
+        'processed': cache.get(PROCESSED_KEY) or 0,
+    }
+
+
+def get_related_progress_key(model_name, pk, related_model_name, token):
+    return '%s:%s:%s:%s:%s' % (
+        RELATED_PREFIX, model_name, pk, related_model_name, token
+    )
+
+
+def get_related_latest_key(model_name, pk, related_model_name):
+    return '%s:%s:%s:%s:latest' % (
+        RELATED_PREFIX, model_name, pk, related_model_name
+    )
+
+
+def get_related_progress(model_name, pk, related_model_name, token=None):
+    """
+    Returns {'done', 'total', 'last_pk', 'finished'} of the fan-out
+    for the change token or of the latest one, None if there is none
+    """
+    if token is None:
+        token = cache.get(
+            get_related_latest_key(model_name, pk, related_model_name)
+        )
+        if token is None:
+            return None
+    return cache.get(
+        get_related_progress_key(model_name, pk, related_model_name, token)
+    )
+
+
+def set_related_progress(model_name, pk, related_model_name, token,
+                         progress):
+    cache.set_many({
+        get_related_progress_key(
+            model_name, pk, related_model_name, token
+        ): progress,
+        get_related_latest_key(model_name, pk, related_model_name): token,
+    }, timeout=RELATED_PROGRESS_TIMEOUT)
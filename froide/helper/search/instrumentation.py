@@ -0,0 +1,99 @@
+"""
+Timing of search requests
+
+Search query sets record Elasticsearch round trip and took times,
+views record the time spent loading hits from the database and
+resolving facets. SearchTimingMiddleware collects the timings of a
+request and sends them as Server-Timing header.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .index_queue import incr_counter
+
+logger = logging.getLogger(__name__)
+
+BROKEN_KEY = 'search:broken'
+
+_local = threading.local()
+
+
+class SearchTimings(object):
+    def __init__(self):
+        self.queries = 0
+        self.aggregations = 0
+        self.durations = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def get_server_timing(self):
+        if not self.queries:
+            return ''
+        descriptions = {
+            'es': '%d queries, %d aggs' % (self.queries, self.aggregations),
+            'es-took': 'Elasticsearch took',
+            'db': 'load hits',
+            'facets': 'resolve facets',
+        }
+        return ', '.join(
+            '%s;dur=%.1f;desc="%s"' % (name, duration * 1000,
+                                       descriptions.get(name, name))
+            for name, duration in self.durations.items()
+        )
+
+
+def start_timings():
+    _local.timings = SearchTimings()
+    return _local.timings
+
+
+def stop_timings():
+    return _local.__dict__.pop('timings', None)
+
+
+def get_timings():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = get_timings()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start)
+
+
+def record_query(query, roundtrip, took=None, aggregations=0):
+    """
+    Records an executed search with round trip time in seconds
+    and took in milliseconds as reported by Elasticsearch
+    """
+    timings = get_timings()
+    if timings is not None:
+        timings.queries += 1
+        timings.aggregations += aggregations
+        timings.add('es', roundtrip)
+        if took is not None:
+            timings.add('es-took', took / 1000)
+    threshold = settings.SEARCH_SLOW_QUERY_MS
+    if threshold and roundtrip * 1000 >= threshold:
+        logger.warning(
+            'Slow search query (%.0fms, took %sms): %s',
+            roundtrip * 1000, took,
+            json.dumps(query, default=str)
+        )
+
+
+def record_broken_query(query):
+    incr_counter(BROKEN_KEY)
+    logger.warning('Broken search query: %s', json.dumps(query, default=str),
+                   exc_info=True)
@@ -1,7 +1,13 @@
+import time
+
 from django.utils.safestring import mark_safe
 
 from elasticsearch_dsl import A
 from elasticsearch_dsl.query import Q
+from elasticsearch_dsl.response import Response
+
+from .cache import get_result_cache_key, get_cached_result, set_cached_result
+from .instrumentation import record_query, record_broken_query
 
 
 def _make_values_lists(kwargs):
@@ -11,6 +17,12 @@ def _make_values_lists(kwargs):
     }
 
 
+def get_highlight(hit):
+    if hasattr(hit.meta, 'highlight'):
+        for key in hit.meta.highlight:
+            yield from hit.meta.highlight[key]
+
+
 class EmtpyResponse(list):
     class hits:
         total = 0
@@ -28,6 +40,9 @@ class SearchQuerySetWrapper(object):
         self.query = None
         self.aggs = []
         self.broken_query = False
+        self.use_cache = False
+        self.source_field = None
+        self.source_loader = None
 
     def count(self):
         total = self.response.hits.total
@@ -62,14 +77,107 @@ class SearchQuerySetWrapper(object):
 
     def get_response(self):
         if not hasattr(self.sqs, '_response'):
-            self.sqs = self.sqs.source(excludes=['*'])
+            if self.source_field is not None:
+                self.sqs = self.sqs.source(includes=[self.source_field])
+            else:
+                self.sqs = self.sqs.source(excludes=['*'])
         else:
             return self.sqs._response
+        if self.use_cache:
+            cache_key = get_result_cache_key(
+                self.model._meta.label_lower, self.sqs._index or [],
+                self.sqs.to_dict()
+            )
+            result = get_cached_result(cache_key)
+            if result is not None:
+                self.sqs._response = Response(self.sqs, result)
+                return self.sqs._response
+        query = self.sqs.to_dict()
+        start = time.perf_counter()
         try:
-            return self.sqs.execute()
+            response = self.sqs.execute()
         except Exception:
             self.broken_query = True
+            record_broken_query(query)
             return EmtpyResponse()
+        record_query(
+            query, time.perf_counter() - start,
+            took=getattr(response, 'took', None),
+            aggregations=len(query.get('aggs', {}))
+        )
+        if self.use_cache:
+            set_cached_result(cache_key, response.to_dict())
+        return response
+
+    def enable_cache(self):
+        """
+        Reuse responses of identical queries until the index
+        of the model changes or the cache times out
+        """
+        self.use_cache = True
+        return self
+
+    def use_source(self, field, loader):
+        """
+        Fetch the stored document field and build objects with
+        loader(data) instead of querying the database for the hits
+        """
+        self.source_field = field
+        self.source_loader = loader
+        return self
+
+    def get_source_objects(self):
+        """
+        Returns objects of the current page in hit order.
+        Hits indexed without the source field are loaded from the database.
+        """
+        if self.broken_query:
+            return []
+        hits = list(self.response)
+        objs = {}
+        missing = []
+        for hit in hits:
+            data = hit.to_dict().get(self.source_field)
+            if data:
+                objs[hit.meta.id] = self.source_loader(data)
+            else:
+                missing.append(hit.meta.id)
+        if missing:
+            objs.update({
+                str(o.pk): o for o in
+                self.model._default_manager.filter(pk__in=missing)
+            })
+        result = []
+        for hit in hits:
+            obj = objs.get(hit.meta.id)
+            if obj is None:
+                continue
+            obj.query_highlight = mark_safe(' '.join(get_highlight(hit)))
+            result.append(obj)
+        return result
+
+    def set_cursor(self, search_after=None):
+        """
+        Pages with search_after so that every page has the same cost.
+        Hits are sorted by the current sort and the document id
+        so that ties have a stable order.
+        """
+        sort = list(self.sqs._sort) or ['_score']
+        self.sqs = self.sqs.sort(*sort, '_id')
+        if search_after:
+            self.sqs = self.sqs.extra(search_after=search_after)
+        return self
+
+    def get_cursor(self):
+        """
+        Returns search_after values to continue after the current page
+        or None if this was the last page
+        """
+        hits = list(self.response)
+        size = self.sqs.to_dict().get('size', 10)
+        if self.broken_query or not hits or len(hits) < size:
+            return None
+        return list(hits[-1].meta.sort)
 
     def add_aggregation(self, aggs):
         for field in aggs:
@@ -144,10 +252,5 @@ class ESQuerySetWrapper(object):
             hit = self._es_map[obj.pk]
             # mark_safe should work because highlight_options
             # has been set with encoder="html"
-            obj.query_highlight = mark_safe(' '.join(self._get_highlight(hit)))
+            obj.query_highlight = mark_safe(' '.join(get_highlight(hit)))
             yield obj
-
-    def _get_highlight(self, hit):
-        if hasattr(hit.meta, 'highlight'):
-            for key in hit.meta.highlight:
-                yield from hit.meta.highlight[key]
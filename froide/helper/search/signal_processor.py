@@ -2,13 +2,18 @@ from contextlib import contextmanager
 
 from django.db import models
 from django.db import transaction
+from django.utils.functional import cached_property
 
 from elasticsearch_dsl.connections import connections
 
 from django_elasticsearch_dsl.registries import registry
 from django_elasticsearch_dsl.signals import RealTimeSignalProcessor
 
-from ..tasks import search_instance_save, search_instance_delete
+from ..tasks import search_instance_delete
+from .index_queue import (
+    queue_instance_update, queue_related_updates, queue_related_fan_out,
+    remember_related_values
+)
 
 
 def run_commit_hooks(testcase):
@@ -44,6 +49,13 @@ class CelerySignalProcessor(RealTimeSignalProcessor):
 
             models.signals.m2m_changed.connect(self.handle_m2m_changed, sender=model)
             models.signals.pre_delete.connect(self.handle_pre_delete, sender=model)
+            for related_model in getattr(doc.django, 'related_models', ()):
+                models.signals.post_init.connect(
+                    self.handle_related_init, sender=related_model
+                )
+                models.signals.post_save.connect(
+                    self.handle_save, sender=related_model
+                )
 
     def teardown(self):
         # Listen to all model saves.
@@ -55,21 +67,51 @@ class CelerySignalProcessor(RealTimeSignalProcessor):
             models.signals.post_delete.disconnect(self.handle_delete, sender=model)
             models.signals.m2m_changed.disconnect(self.handle_m2m_changed, sender=model)
             models.signals.pre_delete.disconnect(self.handle_pre_delete, sender=model)
+            for related_model in getattr(doc.django, 'related_models', ()):
+                models.signals.post_init.disconnect(
+                    self.handle_related_init, sender=related_model
+                )
+                models.signals.post_save.disconnect(
+                    self.handle_save, sender=related_model
+                )
 
     def handle_save(self, sender, instance, **kwargs):
         """Handle save.
 
         Given an individual model instance, update the object in the index.
         Update the related objects either.
+        Updates are collapsed and sent in bulk by the index queue.
+        Documents of other models are only updated when fields
+        they contain have changed.
         """
-        transaction.on_commit(lambda: search_instance_save.delay(instance._meta.label_lower, instance.pk))
+        if sender in self.document_models:
+            queue_instance_update(instance)
+        if sender in self.related_models and not kwargs.get('created'):
+            queue_related_fan_out(
+                instance, update_fields=kwargs.get('update_fields')
+            )
+
+    def handle_related_init(self, sender, instance, **kwargs):
+        remember_related_values(instance)
+
+    @cached_property
+    def document_models(self):
+        return {doc.django.model for doc in registry.get_documents()}
+
+    @cached_property
+    def related_models(self):
+        return {
+            related_model for doc in registry.get_documents()
+            for related_model in getattr(doc.django, 'related_models', ())
+        }
 
     def handle_pre_delete(self, sender, instance, **kwargs):
         """Handle removing of instance object from related models instance.
         We need to do this before the real delete otherwise the relation
         doesn't exists anymore and we can't get the related models instance.
+        Ids of related documents are queued for reindexing after commit.
         """
-        registry.delete_related(instance)
+        queue_related_updates(instance)
 
     def handle_delete(self, sender, instance, **kwargs):
         """Handle delete.
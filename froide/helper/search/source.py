@@ -0,0 +1,44 @@
+"""
+Store model field values in document source so that list views
+can be rendered from search hits without loading rows from the database
+"""
+
+
+def dump_instance(obj, fields):
+    """
+    Returns JSON serializable values of concrete fields of obj,
+    foreign keys are stored by their attname
+    """
+    if obj is None:
+        return None
+    data = {}
+    for field in obj._meta.concrete_fields:
+        if field.name not in fields:
+            continue
+        value = field.value_from_object(obj)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        data[field.attname] = value
+    return data
+
+
+def load_instance(model, data):
+    """
+    Builds an unsaved-looking but persisted instance of model
+    from values stored by dump_instance, unknown keys are ignored
+    """
+    if data is None:
+        return None
+    fields = {f.attname: f for f in model._meta.concrete_fields}
+    values = {}
+    for attname, value in data.items():
+        field = fields.get(attname)
+        if field is None:
+            continue
+        if value is not None:
+            value = field.to_python(value)
+        values[attname] = value
+    obj = model(**values)
+    obj._state.adding = False
+    obj._state.db = model._default_manager.db
+    return obj
@@ -1,7 +1,7 @@
+from django.conf import settings
 from django.utils.http import urlencode
-from django.db import transaction
 
-from ..tasks import search_instance_save
+from .index_queue import queue_index_update, queue_instance_update
 
 
 def get_pagination_vars(data):
@@ -11,12 +11,24 @@ def get_pagination_vars(data):
 
 
 def trigger_search_index_update(instance):
-    transaction.on_commit(
-        lambda: search_instance_save.delay(
-            instance._meta.label_lower, instance.pk)
-    )
+    queue_instance_update(instance)
 
 
 def trigger_search_index_update_qs(queryset):
-    for instance in queryset:
-        trigger_search_index_update(instance)
+    model_name = queryset.model._meta.label_lower
+    for pk in queryset.values_list('pk', flat=True):
+        queue_index_update(model_name, pk)
+
+
+def use_source_results(sqs, document):
+    """
+    Serve hits from stored document source if enabled
+    and supported by the document
+    """
+    if not settings.SEARCH_SOURCE_RESULTS:
+        return sqs
+    if not hasattr(document, 'get_object_from_source'):
+        return sqs
+    return sqs.use_source(
+        document.source_field, document.get_object_from_source
+    )
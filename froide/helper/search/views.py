@@ -4,7 +4,8 @@ from django.utils.functional import cached_property
 
 from .queryset import SearchQuerySetWrapper
 from .facets import resolve_facet, make_filter_url
-from .utils import get_pagination_vars
+from .utils import get_pagination_vars, use_source_results
+from .instrumentation import timed
 from .paginator import ElasticsearchPaginator
 from .filters import BaseSearchFilterSet
 
@@ -82,6 +83,10 @@ class BaseSearchView(ListView):
             self.filtered_objs = {k: v for k, v in filtered_objs.items() if v}
 
         sqs = self.add_facets(sqs)
+        sqs = use_source_results(sqs, self.document)
+
+        if not self.request.user.is_authenticated:
+            sqs = sqs.enable_cache()
 
         return sqs
 
@@ -125,14 +130,19 @@ class BaseSearchView(ListView):
         paginator, page, sqs, is_paginated = super().paginate_queryset(sqs, page_size)
 
         self.count = sqs.count()
-        qs = sqs.to_queryset()
-        if self.select_related:
-            qs = qs.select_related(*self.select_related)
-
-        queryset = sqs.wrap_queryset(qs)
-
-        if queryset:
-            self.facets = self.resolve_facets(sqs)
+        with timed('db'):
+            if sqs.source_loader is not None:
+                queryset = sqs.get_source_objects()
+            else:
+                qs = sqs.to_queryset()
+                if self.select_related:
+                    qs = qs.select_related(*self.select_related)
+                queryset = sqs.wrap_queryset(qs)
+            has_results = bool(queryset)
+
+        if has_results:
+            with timed('facets'):
+                self.facets = self.resolve_facets(sqs)
         else:
             # Empty facets
             self.facets = {
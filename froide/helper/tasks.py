@@ -1,7 +1,10 @@
+from collections import defaultdict
 import logging
+import uuid
 
 from django_elasticsearch_dsl.registries import registry
 from django.apps import apps
+from django.conf import settings
 
 from froide.celery import app as celery_app
 
@@ -23,9 +26,124 @@ def search_instance_save(model_name, pk):
         return
     try:
         registry.update(instance)
-        registry.update_related(instance)
     except Exception as e:
         logger.exception(e)
+    if get_related_documents(instance.__class__):
+        search_related_update.delay(model_name, pk)
+
+
+@celery_app.task
+def search_instances_update(items):
+    """
+    Reindexes (model label, pk) pairs collected by the index queue,
+    one bulk request per document type
+    """
+    from .search.index_queue import start_index_updates
+    from .search.cache import bump_generation
+
+    lag = start_index_updates(items)
+    logger.debug('Index update of %d items, lag %.1fs', len(items), lag)
+
+    pks_by_model = defaultdict(list)
+    for model_name, pk in items:
+        pks_by_model[model_name].append(pk)
+
+    for model_name, pks in pks_by_model.items():
+        model = apps.get_model(model_name)
+        try:
+            update_instances(model, pks)
+        except Exception as e:
+            logger.exception(e)
+        bump_generation(model_name)
+
+
+def update_instances(model, pks):
+    from .search import SearchDocument
+
+    for doc in registry.get_documents([model]):
+        if doc.django.ignore_signals:
+            continue
+        doc_instance = doc()
+        instances = list(doc_instance.get_queryset().filter(pk__in=pks))
+        if not instances:
+            continue
+        if isinstance(doc_instance, SearchDocument):
+            doc_instance.update_instances(instances)
+        else:
+            # Documents registered by other apps
+            doc_instance.update(instances)
+
+
+def get_related_documents(model):
+    return [
+        doc for doc in registry.get_documents()
+        if model in getattr(doc.django, 'related_models', ())
+    ]
+
+
+@celery_app.task(bind=True, acks_late=True)
+def search_related_update(self, model_name, pk):
+    """
+    Streams ids of documents that contain data of the instance
+    into the index queue which reindexes them in bulk batches.
+
+    Progress is kept per change, identified by the task id, and
+    related document type. A redelivered task resumes after the last
+    scheduled id, a task for a new change starts from the beginning.
+    Already pending ids are not scheduled twice.
+    """
+    from .search.index_queue import (
+        schedule_index_updates, get_related_progress, set_related_progress
+    )
+
+    instance = get_instance(model_name, pk)
+    if instance is None:
+        return
+    token = self.request.id or uuid.uuid4().hex
+    chunk_size = settings.SEARCH_INDEX_UPDATE_BATCH_SIZE
+    for doc in get_related_documents(instance.__class__):
+        related = doc().get_instances_from_related(instance)
+        if related is None:
+            continue
+        related_model_name = doc.django.model._meta.label_lower
+        pks = related.order_by('pk').values_list('pk', flat=True)
+
+        progress = get_related_progress(
+            model_name, pk, related_model_name, token=token
+        )
+        if progress is not None and progress['finished']:
+            continue
+        if progress is None:
+            progress = {
+                'done': 0, 'total': pks.count(),
+                'last_pk': None, 'finished': False
+            }
+        elif progress['last_pk'] is not None:
+            pks = pks.filter(pk__gt=progress['last_pk'])
+
+        chunk = []
+        for related_pk in pks.iterator(chunk_size=chunk_size):
+            chunk.append((related_model_name, related_pk))
+            if len(chunk) < chunk_size:
+                continue
+            schedule_index_updates(chunk)
+            progress['done'] += len(chunk)
+            progress['last_pk'] = related_pk
+            set_related_progress(
+                model_name, pk, related_model_name, token, progress
+            )
+            logger.info('Related index update of %s %s: %d/%d %s',
+                        model_name, pk, progress['done'], progress['total'],
+                        related_model_name)
+            chunk = []
+        if chunk:
+            schedule_index_updates(chunk)
+            progress['done'] += len(chunk)
+            progress['last_pk'] = chunk[-1][1]
+        progress['finished'] = True
+        set_related_progress(
+            model_name, pk, related_model_name, token, progress
+        )
 
 
 @celery_app.task
@@ -41,6 +159,8 @@ def search_instance_pre_delete(model_name, pk):
 
 @celery_app.task
 def search_instance_delete(model_name, pk):
+    from .search.cache import bump_generation
+
     if pk is None:
         return
     model = apps.get_model(model_name)
@@ -48,3 +168,11 @@ def search_instance_delete(model_name, pk):
     instance.pk = pk
     instance.id = pk
     registry.delete(instance, raise_on_error=False)
+    bump_generation(model_name)
+
+
+@celery_app.task
+def prune_conversion_cache_task():
+    from .conversion_cache import prune_conversion_cache
+
+    prune_conversion_cache()
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import os
 import re
 
 from django.test import TestCase
@@ -7,7 +8,12 @@ from django.test.utils import override_settings
 from .text_utils import replace_email_name, remove_closing
 from .text_diff import mark_differences
 from .date_utils import calc_easter, calculate_month_range_de
-from .email_sending import mail_registry
+from .email_sending import (
+    mail_registry, get_mail_connection, pooled_mail_connections
+)
+from .email_utils import (
+    make_uid_set, parse_imap_fetch_response, get_unread_mail_batches
+)
 
 
 def rec(x):
@@ -147,3 +153,993 @@ class TestMailIntent(TestCase):
             except Exception:
                 print('intent_key', intent_key)
                 raise
+
+
+class TestMailConnectionPool(TestCase):
+    def test_one_connection_per_queue(self):
+        with pooled_mail_connections():
+            connection = get_mail_connection(return_path='a@example.org')
+            self.assertEqual(connection.return_path, 'a@example.org')
+            other = get_mail_connection(return_path='b@example.org')
+            self.assertIs(other, connection)
+            self.assertEqual(connection.return_path, 'b@example.org')
+            self.assertIsNone(get_mail_connection().return_path)
+            bulk = get_mail_connection(queue='emailbulk')
+            self.assertIsNot(bulk, connection)
+
+
+class FakeMailbox(object):
+    def __init__(self, mails):
+        self.mails = mails
+        self.commands = []
+
+    def select(self, name):
+        return 'OK', [str(len(self.mails)).encode()]
+
+    def uid(self, command, *args):
+        self.commands.append((command,) + args)
+        if command == 'SEARCH':
+            return 'OK', [b' '.join(str(uid).encode() for uid in self.mails)]
+        if command == 'FETCH':
+            data = []
+            for part in args[0].split(','):
+                start, _, end = part.partition(':')
+                for uid in range(int(start), int(end or start) + 1):
+                    header = '%d (UID %d BODY[] {%d}' % (
+                        uid, uid, len(self.mails[uid])
+                    )
+                    data.append((header.encode(), self.mails[uid]))
+                    data.append(b')')
+            return 'OK', data
+        return 'OK', [None]
+
+
+class FakeSocket(object):
+    def gettimeout(self):
+        return None
+
+    def settimeout(self, timeout):
+        pass
+
+
+class FakeFile(object):
+    def peek(self, size):
+        # Lines are always ready, select is not needed
+        return b'\r\n'
+
+
+class FakeIdleMailbox(FakeMailbox):
+    """
+    Replies with lines, None stands for the tagged
+    completion of the last command
+    """
+    def __init__(self, mails, lines):
+        super().__init__(mails)
+        self.lines = list(lines)
+        self.sent = []
+        self.sock = FakeSocket()
+        self.file = FakeFile()
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def readline(self):
+        if not self.lines:
+            return b''
+        line = self.lines.pop(0)
+        if line is None:
+            tag = self.sent[0].split(b' ')[0]
+            return tag + b' OK IDLE terminated\r\n'
+        return line
+
+
+class TestImapBatching(TestCase):
+    def test_make_uid_set(self):
+        self.assertEqual(make_uid_set([b'5', b'1', b'2', b'3', b'7', b'8']), '1:3,5,7:8')
+        self.assertEqual(make_uid_set([4]), '4')
+
+    def test_parse_fetch_response_trailing_uid(self):
+        data = [
+            (b'1 (BODY[] {3}', b'abc'), b' UID 10)',
+            (b'2 (UID 11 BODY[] {3}', b'def'), b')',
+        ]
+        self.assertEqual(
+            parse_imap_fetch_response(data),
+            [('10', b'abc'), ('11', b'def')]
+        )
+
+    def test_batches(self):
+        mails = {uid: b'mail %d' % uid for uid in (1, 2, 3, 5, 6)}
+        mailbox = FakeMailbox(mails)
+        batches = list(get_unread_mail_batches(mailbox, flag=True, batch_size=3))
+        self.assertEqual([len(b) for b in batches], [3, 2])
+        self.assertEqual(batches[1], [('5', b'mail 5'), ('6', b'mail 6')])
+        commands = [c[0] for c in mailbox.commands]
+        self.assertEqual(commands, ['SEARCH', 'FETCH', 'STORE', 'FETCH', 'STORE'])
+        self.assertEqual(mailbox.commands[2][1], '1:3')
+
+    def test_idle_new_mail(self):
+        import imaplib
+        from .email_utils import imap_idle
+
+        mailbox = FakeIdleMailbox({}, [
+            b'+ idling\r\n', b'* 1 RECENT\r\n', b'* 4 EXISTS\r\n', None
+        ])
+        self.assertTrue(imap_idle(mailbox, timeout=10))
+        self.assertTrue(mailbox.sent[0].endswith(b' IDLE\r\n'))
+        self.assertEqual(mailbox.sent[1], b'DONE\r\n')
+        self.assertEqual(mailbox.lines, [])
+
+        # Tags don't repeat on the same connection
+        other = FakeIdleMailbox({}, [b'+ idling\r\n', None])
+        self.assertFalse(imap_idle(other, timeout=0))
+        self.assertNotEqual(other.sent[0], mailbox.sent[0])
+
+        mailbox = FakeIdleMailbox({}, [b'+ idling\r\n'])
+        with self.assertRaises(imaplib.IMAP4.abort):
+            imap_idle(mailbox, timeout=10)
+
+        mailbox = FakeIdleMailbox({}, [b'IDLE1 BAD unknown command\r\n'])
+        with self.assertRaises(imaplib.IMAP4.error):
+            imap_idle(mailbox, timeout=10)
+
+    def test_idle_buffered_lines(self):
+        import socket
+        import threading
+        import time
+        from .email_utils import imap_idle
+
+        client, server = socket.socketpair()
+
+        class SocketMailbox(object):
+            sock = client
+            file = client.makefile('rb')
+
+            def send(self, data):
+                client.sendall(data)
+
+            def readline(self):
+                return self.file.readline()
+
+        def serve():
+            with server.makefile('rb') as f:
+                tag = f.readline().split(b' ')[0]
+                # Continuation and new mail arrive in one segment
+                server.sendall(b'+ idling\r\n* 4 EXISTS\r\n')
+                f.readline()
+                server.sendall(tag + b' OK IDLE terminated\r\n')
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        start = time.monotonic()
+        try:
+            self.assertTrue(imap_idle(SocketMailbox(), timeout=10))
+        finally:
+            thread.join()
+            client.close()
+            server.close()
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class TestRedactionPages(TestCase):
+    def test_collect_redacted_pages(self):
+        from .redaction import collect_redacted_pages, PDFException
+
+        progress = []
+        results = [(3, 'page_3.pdf', None), (1, 'page_1.pdf', None)]
+        pages = collect_redacted_pages(
+            iter(results), 2, lambda done, total: progress.append((done, total))
+        )
+        self.assertEqual(pages, {1: 'page_1.pdf', 3: 'page_3.pdf'})
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+
+        with self.assertRaises(PDFException):
+            collect_redacted_pages(iter([(0, None, 'broken')]), 1, None)
+
+    def test_malformed_pdf_is_rewritten(self):
+        import io
+        import tempfile
+        from unittest import mock
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+        from .redaction import try_redacting_file, redact_page_job
+
+        writer = PdfFileWriter()
+        writer.addBlankPage(width=100, height=100)
+        instructions = {'pages': [{'rects': [], 'texts': [], 'width': 100}]}
+        get_page = PdfFileReader.getPage
+        failed = []
+
+        def broken_get_page(reader, page_idx):
+            if not failed:
+                failed.append(page_idx)
+                raise ValueError('Malformed page')
+            return get_page(reader, page_idx)
+
+        with tempfile.TemporaryDirectory() as outpath:
+            with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf_file:
+                writer.write(pdf_file)
+                pdf_file.flush()
+                pdf_file.seek(0)
+                with mock.patch('froide.helper.redaction.rewrite_pdf',
+                                return_value=pdf_file) as rewrite, \
+                        mock.patch('froide.helper.redaction.load_invisible_font'), \
+                        mock.patch.object(PdfFileReader, 'getPage',
+                                          broken_get_page):
+                    output_file, ocr_pages = try_redacting_file(
+                        pdf_file, outpath, instructions
+                    )
+                self.assertEqual(failed, [0])
+                # Before each of the two tries and once after the error
+                self.assertEqual(rewrite.call_count, 3)
+                with open(output_file, 'rb') as f:
+                    reader = PdfFileReader(io.BytesIO(f.read()))
+                    self.assertEqual(reader.getNumPages(), 1)
+
+                def broken_images(*args):
+                    raise ValueError('Broken image')
+                    yield
+
+                job = (pdf_file.name, 0, instructions['pages'][0], 300, outpath)
+                with mock.patch('froide.helper.redaction.'
+                                'get_images_from_pdf_chunked',
+                                broken_images), \
+                        mock.patch('froide.helper.redaction.load_invisible_font'):
+                    self.assertEqual(
+                        redact_page_job(job), (0, None, 'Broken image')
+                    )
+
+    def test_ocr_only_given_pages(self):
+        import io
+        from unittest import mock
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+        from .redaction import ocr_pdf_pages
+
+        writer = PdfFileWriter()
+        for width in (100, 200, 300):
+            writer.addBlankPage(width=width, height=100)
+        pdf = io.BytesIO()
+        writer.write(pdf)
+
+        ocr_sizes = []
+
+        def fake_ocr(filename, **kwargs):
+            with open(filename, 'rb') as f:
+                pdf_bytes = f.read()
+            reader = PdfFileReader(io.BytesIO(pdf_bytes))
+            ocr_sizes.extend(
+                float(reader.getPage(i).mediaBox.getWidth())
+                for i in range(reader.getNumPages())
+            )
+            return pdf_bytes
+
+        with mock.patch('froide.helper.redaction.run_ocr', fake_ocr):
+            result = ocr_pdf_pages(pdf.getvalue(), [2])
+        self.assertEqual(ocr_sizes, [300])
+        reader = PdfFileReader(io.BytesIO(result))
+        self.assertEqual(
+            [float(reader.getPage(i).mediaBox.getWidth()) for i in range(3)],
+            [100, 200, 300]
+        )
+
+
+class TestConversionCache(TestCase):
+    def test_cached_conversion(self):
+        import tempfile
+        from .conversion_cache import cached_conversion
+
+        calls = []
+
+        def convert():
+            calls.append(1)
+            return b'%PDF-1.4'
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with override_settings(FOI_CONVERSION_CACHE=True,
+                                   FOI_CONVERSION_CACHE_ROOT=tmpdir):
+                for _ in range(2):
+                    output = cached_conversion('ocr', ['abc'], convert,
+                                               params={'language': 'de'})
+                    self.assertEqual(output, b'%PDF-1.4')
+                self.assertEqual(len(calls), 1)
+                cached_conversion('ocr', ['abc'], convert,
+                                  params={'language': 'en'})
+                self.assertEqual(len(calls), 2)
+                self.assertIsNone(
+                    cached_conversion('ocr', ['def'], lambda: None)
+                )
+
+    def test_conversion_cache_purge_and_prune(self):
+        import os
+        import tempfile
+        from .conversion_cache import (
+            cached_conversion, get_conversion_key, get_conversion_name,
+            purge_cached_conversions, prune_conversion_cache
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with override_settings(FOI_CONVERSION_CACHE=True,
+                                   FOI_CONVERSION_CACHE_ROOT=tmpdir):
+                def get_path(kind, sources):
+                    key = get_conversion_key(kind, sources)
+                    return os.path.join(tmpdir, get_conversion_name(key))
+
+                cached_conversion('ocr', ['abc'], lambda: b'a' * 10)
+                cached_conversion('images', ['abc', 'def'],
+                                  lambda: b'b' * 10)
+                cached_conversion('ocr', ['def'], lambda: b'c' * 10)
+                purge_cached_conversions('abc')
+                self.assertFalse(os.path.exists(get_path('ocr', ['abc'])))
+                self.assertFalse(
+                    os.path.exists(get_path('images', ['abc', 'def']))
+                )
+                self.assertTrue(os.path.exists(get_path('ocr', ['def'])))
+
+                cached_conversion('ocr', ['ghi'], lambda: b'd' * 10)
+                os.utime(get_path('ocr', ['def']), (0, 0))
+                self.assertEqual(prune_conversion_cache(max_size=15), 1)
+                self.assertFalse(os.path.exists(get_path('ocr', ['def'])))
+                self.assertTrue(os.path.exists(get_path('ocr', ['ghi'])))
+
+    def test_conversion_timeout_starts_at_pick_up(self):
+        from multiprocessing import Pipe
+        import queue
+        import threading
+        import time
+        from .office_conversion import ConversionService
+
+        class FakeOffice(object):
+            def convert(self, filepath, output_path):
+                time.sleep(0.5)
+                with open(output_path, 'wb') as f:
+                    f.write(b'%PDF-1.4')
+
+        service = ConversionService.__new__(ConversionService)
+        service.timeout = 1
+        service.jobs = queue.Queue()
+        service.lock = threading.Lock()
+        client, server = Pipe()
+        client.send('test.docx')
+        handler = threading.Thread(target=service.handle, args=(server,))
+        handler.start()
+        # Waiting and converting take longer than the timeout together
+        time.sleep(0.7)
+        threading.Thread(
+            target=service.work, args=(FakeOffice(),), daemon=True
+        ).start()
+        self.assertEqual(client.recv(), (b'%PDF-1.4', None))
+        handler.join()
+
+    def test_conversion_service_timeout_fallback(self):
+        from unittest import mock
+        from .office_conversion import convert_office_file, TIMEOUT_ERROR
+
+        with override_settings(
+                FOI_CONVERSION_SERVICE_ADDRESS='/run/conversion.sock'):
+            with mock.patch('froide.helper.office_conversion.Client') as client:
+                client.return_value.recv.return_value = (None, TIMEOUT_ERROR)
+                with mock.patch(
+                        'froide.helper.office_conversion.convert_to_pdf',
+                        return_value=b'%PDF-1.4') as convert:
+                    self.assertEqual(
+                        convert_office_file('test.docx'), b'%PDF-1.4'
+                    )
+                    self.assertEqual(convert.call_count, 1)
+
+    def test_conversion_service_no_response(self):
+        from unittest import mock
+        from .office_conversion import (
+            convert_office_file, get_client_timeout, get_task_time_limit
+        )
+
+        with override_settings(
+                FOI_CONVERSION_SERVICE_ADDRESS='/run/conversion.sock',
+                FOI_CONVERSION_TIMEOUT=20):
+            self.assertLess(get_client_timeout() + 20, get_task_time_limit())
+            with mock.patch('froide.helper.office_conversion.Client') as client:
+                conn = client.return_value
+                conn.poll.return_value = False
+                with mock.patch(
+                        'froide.helper.office_conversion.convert_to_pdf',
+                        return_value=b'%PDF-1.4') as convert:
+                    self.assertEqual(
+                        convert_office_file('test.docx'), b'%PDF-1.4'
+                    )
+                conn.poll.assert_called_once_with(get_client_timeout())
+                conn.recv.assert_not_called()
+                self.assertEqual(convert.call_count, 1)
+
+    def test_conversion_service_fallback(self):
+        from unittest import mock
+        from .office_conversion import convert_office_file
+
+        with override_settings(
+                FOI_CONVERSION_SERVICE_ADDRESS='/nonexistent/conversion.sock'):
+            with mock.patch('froide.helper.office_conversion.convert_to_pdf',
+                            return_value=b'%PDF-1.4') as convert:
+                self.assertEqual(convert_office_file('test.docx'), b'%PDF-1.4')
+                self.assertEqual(convert.call_count, 1)
+
+
+class TestSearchIndexQueue(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_collapse_pending_updates(self):
+        from unittest import mock
+        from .search.index_queue import (
+            schedule_index_updates, start_index_updates,
+            get_index_queue_metrics
+        )
+
+        items = [('foirequest.foirequest', 1), ('foirequest.foirequest', 2)]
+        with mock.patch('froide.helper.search.index_queue.'
+                        'search_instances_update.apply_async') as task:
+            schedule_index_updates(items)
+            schedule_index_updates(items + [('filingcabinet.page', 3)])
+            self.assertEqual(task.call_count, 2)
+            self.assertEqual(task.call_args_list[0][0][0], (items,))
+            self.assertEqual(task.call_args_list[1][0][0],
+                             ([('filingcabinet.page', 3)],))
+            self.assertEqual(get_index_queue_metrics()['depth'], 3)
+
+            start_index_updates(items)
+            metrics = get_index_queue_metrics()
+            self.assertEqual(metrics['depth'], 1)
+            self.assertEqual(metrics['processed'], 2)
+
+            # Processed items can be scheduled again
+            schedule_index_updates(items)
+            self.assertEqual(task.call_count, 3)
+
+    @override_settings(SEARCH_INDEX_UPDATE_BATCH_SIZE=2)
+    def test_related_fan_out(self):
+        from unittest import mock
+        from froide.foirequest.tests import factories
+        from .search.index_queue import get_related_progress
+        from .tasks import search_related_update
+
+        pb = factories.PublicBodyFactory.create()
+        reqs = factories.FoiRequestFactory.create_batch(3, public_body=pb)
+        with mock.patch('froide.helper.search.index_queue.'
+                        'search_instances_update.apply_async') as task:
+            search_related_update('publicbody.publicbody', pb.pk)
+            self.assertEqual(task.call_count, 2)
+            scheduled = [
+                pk for call in task.call_args_list
+                for _model, pk in call[0][0][0]
+            ]
+            self.assertEqual(scheduled, sorted(r.pk for r in reqs))
+            progress = get_related_progress(
+                'publicbody.publicbody', pb.pk, 'foirequest.foirequest'
+            )
+            self.assertEqual(progress['done'], 3)
+            self.assertEqual(progress['total'], 3)
+            self.assertTrue(progress['finished'])
+
+            # Retrying does not schedule pending ids again
+            search_related_update('publicbody.publicbody', pb.pk)
+            self.assertEqual(task.call_count, 2)
+
+    def test_related_fan_out_per_change(self):
+        from unittest import mock
+        from froide.foirequest.tests import factories
+        from .search.index_queue import (
+            set_related_progress, start_index_updates
+        )
+        from .tasks import search_related_update
+
+        pb = factories.PublicBodyFactory.create()
+        reqs = factories.FoiRequestFactory.create_batch(3, public_body=pb)
+        pks = sorted(r.pk for r in reqs)
+        set_related_progress(
+            'publicbody.publicbody', pb.pk, 'foirequest.foirequest',
+            'change-1', {
+                'done': 1, 'total': 3, 'last_pk': pks[0], 'finished': False
+            }
+        )
+        with mock.patch('froide.helper.search.index_queue.'
+                        'search_instances_update.apply_async') as task:
+            # Redelivered task resumes
+            search_related_update.apply(
+                ('publicbody.publicbody', pb.pk), task_id='change-1'
+            )
+            items = task.call_args[0][0][0]
+            self.assertEqual([pk for _model, pk in items], pks[1:])
+            start_index_updates(items)
+
+            # Next change starts from the beginning
+            search_related_update.apply(
+                ('publicbody.publicbody', pb.pk), task_id='change-2'
+            )
+            items = task.call_args[0][0][0]
+            self.assertEqual([pk for _model, pk in items], pks)
+
+    def test_related_fan_out_changed_fields(self):
+        from froide.publicbody.models import PublicBody
+        from froide.foirequest.tests import factories
+        from .search.index_queue import related_values_changed
+        from .search.signal_processor import realtime_search
+
+        pb = factories.PublicBodyFactory.create()
+        with realtime_search(self, test=False):
+            # Loading remembers the values of related fields
+            pb = PublicBody.objects.get(pk=pb.pk)
+        pb.number_of_requests += 1
+        self.assertFalse(related_values_changed(pb))
+        self.assertFalse(related_values_changed(
+            pb, update_fields=['number_of_requests']
+        ))
+        pb.name = 'Renamed public body'
+        self.assertTrue(related_values_changed(pb))
+
+
+class TestSearchIndexCommand(TestCase):
+    def get_command(self):
+        from io import StringIO
+        from .management.commands.search_index import Command
+
+        return Command(stdout=StringIO(), stderr=StringIO())
+
+    def test_ranges(self):
+        from unittest import mock
+
+        command = self.get_command()
+        qs = mock.Mock()
+        qs.aggregate.return_value = {'min_pk': 12345, 'max_pk': 30000}
+        self.assertEqual(command.get_ranges(qs, 10000), [
+            (10000, 20000), (20000, 30000), (30000, 40000)
+        ])
+        qs.aggregate.return_value = {'min_pk': None, 'max_pk': None}
+        self.assertEqual(command.get_ranges(qs, 10000), [])
+
+    def test_checkpoint(self):
+        import os
+        import tempfile
+        from .management.commands.search_index import Checkpoint
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'checkpoint.json')
+            checkpoint = Checkpoint(path)
+            self.assertFalse(checkpoint.load())
+            checkpoint.index_name = 'index_1'
+            checkpoint.range_size = 10
+            checkpoint.done = {(0, 10), (20, 30)}
+            checkpoint.save()
+
+            loaded = Checkpoint(path)
+            self.assertTrue(loaded.load())
+            self.assertEqual(loaded.index_name, 'index_1')
+            self.assertEqual(loaded.range_size, 10)
+            self.assertEqual(loaded.done, {(0, 10), (20, 30)})
+            loaded.remove()
+            self.assertFalse(Checkpoint(path).load())
+
+    def test_resume_failed_ranges(self):
+        import os
+        import tempfile
+        from unittest import mock
+        from .management.commands.search_index import Checkpoint
+
+        doc = mock.MagicMock()
+        doc._index._name = 'froide_test_things'
+        doc.__name__ = 'ThingDocument'
+        doc.django.model.__name__ = 'Thing'
+        doc.__module__ = 'froide.helper.tests'
+        calls = []
+        failing = {(10, 20)}
+
+        def run_jobs(jobs, workers):
+            for job in jobs:
+                start, end = job[2], job[3]
+                calls.append((start, end))
+                errors = ['Bulk failed'] if (start, end) in failing else []
+                yield start, end, 10, errors
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            options = {
+                'checkpoint_dir': tmpdir, 'resume': False, 'swap': False,
+                'range_size': 10, 'workers': 1, 'chunk_size': 10,
+                'threads': 1
+            }
+            command = self.get_command()
+            command.get_ranges = lambda qs, size: [(0, 10), (10, 20), (20, 30)]
+            command.run_jobs = run_jobs
+            command.populate_document(doc, options)
+            self.assertEqual(calls, [(0, 10), (10, 20), (20, 30)])
+            path = os.path.join(tmpdir, 'search_index_froide_test_things.json')
+            checkpoint = Checkpoint(path)
+            self.assertTrue(checkpoint.load())
+            self.assertEqual(checkpoint.done, {(0, 10), (20, 30)})
+
+            calls.clear()
+            failing.clear()
+            options['resume'] = True
+            command.populate_document(doc, options)
+            self.assertEqual(calls, [(10, 20)])
+            self.assertFalse(os.path.exists(path))
+
+    def test_swap_alias_atomic(self):
+        from unittest import mock
+
+        command = self.get_command()
+        es = mock.MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {'things_1': {}}
+        with mock.patch('froide.helper.management.commands.search_index.'
+                        'connections.get_connection', return_value=es):
+            command.swap_alias('things', 'things_2')
+        self.assertEqual(es.indices.method_calls[-2:], [
+            mock.call.update_aliases(body={'actions': [
+                {'remove': {'index': 'things_1', 'alias': 'things'}},
+                {'add': {'index': 'things_2', 'alias': 'things'}},
+            ]}),
+            mock.call.delete(index='things_1', ignore=404),
+        ])
+
+        # A concrete index of the alias name goes in the same request
+        es = mock.MagicMock()
+        es.indices.exists_alias.return_value = False
+        es.indices.exists.return_value = True
+        with mock.patch('froide.helper.management.commands.search_index.'
+                        'connections.get_connection', return_value=es):
+            command.swap_alias('things', 'things_2')
+        es.indices.delete.assert_not_called()
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': 'things_2', 'alias': 'things'}},
+            {'remove_index': {'index': 'things'}},
+        ]})
+
+
+class TestSearchCache(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_result_cache_invalidation(self):
+        from .search.cache import (
+            get_result_cache_key, get_cached_result, set_cached_result,
+            bump_generation, get_search_cache_stats
+        )
+
+        query = {'query': {'match_all': {}}, 'size': 30}
+        key = get_result_cache_key('foirequest.foirequest', ['idx'], query)
+        self.assertIsNone(get_cached_result(key))
+        set_cached_result(key, {'hits': {'hits': []}})
+        self.assertEqual(
+            get_result_cache_key('foirequest.foirequest', ['idx'], dict(query)),
+            key
+        )
+        self.assertEqual(get_cached_result(key), {'hits': {'hits': []}})
+
+        bump_generation('foirequest.foirequest')
+        key = get_result_cache_key('foirequest.foirequest', ['idx'], query)
+        self.assertIsNone(get_cached_result(key))
+        self.assertEqual(get_search_cache_stats()['results']['hits'], 1)
+        self.assertEqual(get_search_cache_stats()['results']['misses'], 2)
+
+    def test_facet_objects(self):
+        from froide.publicbody.models import Jurisdiction
+        from froide.foirequest.tests import factories
+        from .search.cache import get_facet_objects
+
+        jurisdiction = factories.JurisdictionFactory.create()
+        objs = get_facet_objects(Jurisdiction, [jurisdiction.pk])
+        self.assertEqual(objs[str(jurisdiction.pk)], jurisdiction)
+        with self.assertNumQueries(0):
+            objs = get_facet_objects(Jurisdiction, [jurisdiction.pk])
+        self.assertEqual(objs[str(jurisdiction.pk)].name, jurisdiction.name)
+
+        jurisdiction.name = 'Renamed'
+        jurisdiction.save()
+        objs = get_facet_objects(Jurisdiction, [jurisdiction.pk])
+        self.assertEqual(objs[str(jurisdiction.pk)].name, 'Renamed')
+
+
+class TestSearchCursor(TestCase):
+    def test_cursor_roundtrip(self):
+        from rest_framework.exceptions import NotFound
+        from .api_utils import encode_search_cursor, decode_search_cursor
+
+        cursor = encode_search_cursor([1.5, '42'])
+        self.assertEqual(decode_search_cursor(cursor), [1.5, '42'])
+        with self.assertRaises(NotFound):
+            decode_search_cursor('not a cursor')
+        with self.assertRaises(NotFound):
+            decode_search_cursor(encode_search_cursor('42'))
+
+    def test_cursor_sort(self):
+        from elasticsearch_dsl import Search
+        from froide.foirequest.models import FoiRequest
+        from .search import SearchQuerySetWrapper
+
+        sqs = SearchQuerySetWrapper(Search().sort('_score'), FoiRequest)
+        sqs.set_cursor(search_after=[1.5, '42'])
+        query = sqs.sqs.to_dict()
+        self.assertEqual(query['sort'], ['_score', '_id'])
+        self.assertEqual(query['search_after'], [1.5, '42'])
+
+
+class TestSearchInstrumentation(TestCase):
+    @override_settings(SEARCH_SLOW_QUERY_MS=100)
+    def test_timings(self):
+        from .search.instrumentation import (
+            start_timings, stop_timings, record_query, timed
+        )
+
+        timings = start_timings()
+        with self.assertLogs('froide.helper.search.instrumentation',
+                             level='WARNING') as logs:
+            record_query({'query': {'match_all': {}}}, 0.2, took=150,
+                         aggregations=2)
+        self.assertIn('match_all', logs.output[0])
+        with timed('db'):
+            pass
+        self.assertIs(stop_timings(), timings)
+        header = timings.get_server_timing()
+        self.assertIn('es;dur=200.0;desc="1 queries, 2 aggs"', header)
+        self.assertIn('es-took;dur=150.0', header)
+        self.assertIn('db;dur=', header)
+
+
+class TestSearchSource(TestCase):
+    def test_request_from_source(self):
+        import json
+        from froide.foirequest.documents import FoiRequestDocument
+        from froide.foirequest.tests import factories
+
+        project = factories.FoiProjectFactory.create()
+        req = factories.FoiRequestFactory.create(
+            project=project,
+            same_as=factories.FoiRequestFactory.create(same_as_count=1)
+        )
+        data = json.loads(json.dumps(
+            FoiRequestDocument().prepare_list_data(req)
+        ))
+        self.assertNotIn('secret_address', data['request'])
+        with self.assertNumQueries(0):
+            obj = FoiRequestDocument.get_object_from_source(data)
+            self.assertEqual(obj, req)
+            self.assertEqual(obj.get_absolute_url(), req.get_absolute_url())
+            self.assertEqual(obj.last_message, req.last_message)
+            self.assertEqual(obj.public_body.name, req.public_body.name)
+            self.assertEqual(obj.jurisdiction.name, req.jurisdiction.name)
+            self.assertEqual(obj.user.pk, req.user.pk)
+            self.assertEqual(obj.law.name, req.law.name)
+            self.assertEqual(obj.identical_count(), 1)
+            self.assertEqual(
+                obj.project.get_absolute_url(), project.get_absolute_url()
+            )
+            self.assertIsNone(obj.campaign)
+
+        # Documents indexed before law was stored load it lazily
+        del data['law']
+        obj = FoiRequestDocument.get_object_from_source(data)
+        self.assertEqual(obj.law_id, req.law_id)
+
+    def test_user_private_reindexes_requests(self):
+        from froide.account.models import User
+        from froide.foirequest.documents import FoiRequestDocument
+        from froide.foirequest.tests import factories
+        from .search.index_queue import related_values_changed
+        from .search.signal_processor import realtime_search
+
+        req = factories.FoiRequestFactory.create()
+        self.assertIn(
+            req, FoiRequestDocument().get_instances_from_related(req.user)
+        )
+        with realtime_search(self, test=False):
+            user = User.objects.get(id=req.user_id)
+            user.first_name = 'Changed'
+            self.assertFalse(related_values_changed(user))
+            user.private = not user.private
+            self.assertTrue(related_values_changed(user))
+
+
+class TestVectorRedaction(TestCase):
+    def make_pdf(self, filename, extra_content=b'', cropbox=None):
+        import pikepdf
+
+        pdf = pikepdf.new()
+        font = pikepdf.Dictionary({
+            '/Type': pikepdf.Name.Font,
+            '/Subtype': pikepdf.Name.Type1,
+            '/BaseFont': pikepdf.Name.Helvetica,
+            '/FirstChar': 32,
+            '/LastChar': 126,
+            '/Widths': pikepdf.Array([500] * 95)
+        })
+        content = b'BT /F1 10 Tf 100 700 Td (Name: Secret) Tj ET'
+        content += extra_content
+        page = pdf.add_blank_page(page_size=(600, 800))
+        page = getattr(page, 'obj', page)
+        if cropbox is not None:
+            page.CropBox = cropbox
+        page.Resources = pikepdf.Dictionary({
+            '/Font': pikepdf.Dictionary({'/F1': font})
+        })
+        page.Contents = pdf.make_indirect(pikepdf.Stream(pdf, content))
+        pdf.save(filename)
+
+    def test_remove_text_under_rect(self):
+        import pikepdf
+        import tempfile
+        from .vector_redaction import redact_pdf_vector
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            in_filename = os.path.join(tmpdir, 'in.pdf')
+            out_filename = os.path.join(tmpdir, 'out.pdf')
+            self.make_pdf(in_filename)
+            # Each glyph is 5pt wide, "Secret" starts at x=130
+            instructions = [{
+                'width': 600, 'rects': [[133, 90, 26, 8]], 'texts': []
+            }]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [])
+            with pikepdf.open(out_filename) as pdf:
+                page = pdf.pages[0]
+                ops = pikepdf.parse_content_stream(page)
+                text_ops = [
+                    operands for operands, operator in ops
+                    if str(operator) == 'TJ'
+                ]
+            self.assertEqual(len(text_ops), 1)
+            kept = b''.join(
+                bytes(item) for item in text_ops[0][0]
+                if isinstance(item, pikepdf.String)
+            )
+            self.assertEqual(kept, b'Name: ')
+
+    def test_path_under_rect(self):
+        import tempfile
+        from .vector_redaction import redact_pdf_vector
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            in_filename = os.path.join(tmpdir, 'in.pdf')
+            out_filename = os.path.join(tmpdir, 'out.pdf')
+            # A filled signature shape below the text
+            self.make_pdf(
+                in_filename,
+                extra_content=b' q 2 0 0 2 0 0 cm 100 300 m 120 310 l '
+                              b'140 300 l h f Q'
+            )
+            instructions = [{
+                'width': 600, 'rects': [[210, 180, 60, 30]], 'texts': []
+            }]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [0])
+            # Paths outside the rects don't matter
+            instructions = [{
+                'width': 600, 'rects': [[133, 90, 26, 8]], 'texts': []
+            }]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [])
+
+    def test_rects_relative_to_cropbox(self):
+        import pikepdf
+        import tempfile
+        from .vector_redaction import redact_pdf_vector
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            in_filename = os.path.join(tmpdir, 'in.pdf')
+            out_filename = os.path.join(tmpdir, 'out.pdf')
+            self.make_pdf(in_filename, cropbox=[50, 50, 350, 750])
+            # Visible page is 300pt wide, rendered at 600px
+            instructions = [{
+                'width': 600, 'rects': [[166, 96, 52, 16]], 'texts': []
+            }]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [])
+            with pikepdf.open(out_filename) as pdf:
+                text_ops = [
+                    operands for operands, operator
+                    in pikepdf.parse_content_stream(pdf.pages[0])
+                    if str(operator) == 'TJ'
+                ]
+            kept = b''.join(
+                bytes(item) for item in text_ops[0][0]
+                if isinstance(item, pikepdf.String)
+            )
+            self.assertEqual(kept, b'Name: ')
+
+    def make_image_pdf(self, filename, form=False):
+        import io
+        import pikepdf
+        from PIL import Image
+
+        pdf = pikepdf.new()
+        out = io.BytesIO()
+        Image.new('RGB', (100, 100), (255, 0, 0)).save(out, format='JPEG')
+        image = pikepdf.Stream(pdf, out.getvalue())
+        image.Type = pikepdf.Name.XObject
+        image.Subtype = pikepdf.Name.Image
+        image.Width = 100
+        image.Height = 100
+        image.BitsPerComponent = 8
+        image.ColorSpace = pikepdf.Name.DeviceRGB
+        image.Filter = pikepdf.Name.DCTDecode
+        mask = pikepdf.Stream(pdf, bytes(range(100)) * 100)
+        mask.Type = pikepdf.Name.XObject
+        mask.Subtype = pikepdf.Name.Image
+        mask.Width = 100
+        mask.Height = 100
+        mask.BitsPerComponent = 8
+        mask.ColorSpace = pikepdf.Name.DeviceGray
+        image.SMask = pdf.make_indirect(mask)
+        xobjects = {'/Im1': pdf.make_indirect(image)}
+        content = b'q 200 0 0 200 100 500 cm /Im1 Do Q'
+        if form:
+            # Placed by its matrix, not by the current transformation
+            xobject = pikepdf.Stream(pdf, b'0 0 50 50 re f')
+            xobject.Type = pikepdf.Name.XObject
+            xobject.Subtype = pikepdf.Name.Form
+            xobject.BBox = [0, 0, 50, 50]
+            xobject.Matrix = [1, 0, 0, 1, 100, 500]
+            xobjects = {'/Fm1': pdf.make_indirect(xobject)}
+            content = b'/Fm1 Do'
+        # Second page shares the resources without painting the image
+        resources = pdf.make_indirect(pikepdf.Dictionary({
+            '/XObject': pikepdf.Dictionary(xobjects)
+        }))
+        for page_content in (content, b''):
+            page = pdf.add_blank_page(page_size=(600, 800))
+            page = getattr(page, 'obj', page)
+            page.Resources = resources
+            page.Contents = pdf.make_indirect(
+                pikepdf.Stream(pdf, page_content)
+            )
+        pdf.save(filename)
+
+    def test_replace_image_under_rect(self):
+        import pikepdf
+        import tempfile
+        from .vector_redaction import redact_pdf_vector
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            in_filename = os.path.join(tmpdir, 'in.pdf')
+            out_filename = os.path.join(tmpdir, 'out.pdf')
+            self.make_image_pdf(in_filename)
+            instructions = [
+                {'width': 600, 'rects': [[110, 110, 50, 50]], 'texts': []},
+                {'width': 600, 'rects': [], 'texts': []}
+            ]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [])
+            with pikepdf.open(out_filename) as pdf:
+                images = [
+                    obj for obj in pdf.objects
+                    if isinstance(obj, pikepdf.Stream) and
+                    obj.get('/Subtype') == '/Image'
+                ]
+                # Only the redacted image and its mask are left in the file
+                self.assertEqual(len(images), 2)
+                image = pdf.pages[0].Resources.XObject.Im1
+                pil_image = pikepdf.PdfImage(image).as_pil_image()
+                self.assertEqual(pil_image.getpixel((20, 20))[:3], (0, 0, 0))
+                # The mask is opaque under the rect
+                mask = pikepdf.PdfImage(image.SMask).as_pil_image()
+                self.assertEqual(mask.getpixel((20, 20)), 255)
+                self.assertEqual(mask.getpixel((80, 20)), 80)
+                self.assertNotIn('/Im1', pdf.pages[1].Resources.XObject)
+
+    def test_form_xobject_under_rect(self):
+        import tempfile
+        from .vector_redaction import redact_pdf_vector
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            in_filename = os.path.join(tmpdir, 'in.pdf')
+            out_filename = os.path.join(tmpdir, 'out.pdf')
+            self.make_image_pdf(in_filename, form=True)
+            no_rects = {'width': 600, 'rects': [], 'texts': []}
+            instructions = [
+                {'width': 600, 'rects': [[110, 260, 20, 20]], 'texts': []},
+                no_rects
+            ]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [0])
+            instructions = [
+                {'width': 600, 'rects': [[400, 20, 20, 20]], 'texts': []},
+                no_rects
+            ]
+            failed = redact_pdf_vector(in_filename, out_filename, instructions)
+            self.assertEqual(failed, [])
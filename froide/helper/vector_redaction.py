@@ -0,0 +1,604 @@
+"""
+Redaction on the PDF content stream level.
+
+Text shown under redaction rects is removed glyph by glyph (keeping the
+position of the remaining text), images under rects get their pixels
+blacked out and black boxes are drawn as vectors on top.
+Painted paths and shadings under rects (e.g. signatures or text drawn
+as outlines) are not edited, their pages are rasterised instead.
+Pages that use constructs that can't be handled safely raise
+VectorRedactionError so callers can fall back to rasterisation.
+
+"""
+from collections import defaultdict
+import io
+import logging
+import zlib
+
+import pikepdf
+from pikepdf import Name, Operator
+import PIL.Image as PILImage
+from PIL import ImageDraw
+
+logger = logging.getLogger(__name__)
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+PATH_POINT_OPERATORS = {'m': 1, 'l': 1, 'c': 3, 'v': 2, 'y': 2}
+PATH_PAINT_OPERATORS = {'S', 's', 'f', 'F', 'f*', 'B', 'B*', 'b', 'b*'}
+# Approximate vertical glyph extent relative to font size
+GLYPH_DESCENT = -0.25
+GLYPH_ASCENT = 1.0
+RECT_PADDING = 2
+
+
+class VectorRedactionError(Exception):
+    pass
+
+
+def mult(m1, m2):
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2
+    )
+
+
+def translate(tx, ty):
+    return (1, 0, 0, 1, tx, ty)
+
+
+def transform_point(matrix, x, y):
+    a, b, c, d, e, f = matrix
+    return x * a + y * c + e, x * b + y * d + f
+
+
+def get_points_bbox(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def transform_bbox(matrix, x0, y0, x1, y1):
+    return get_points_bbox([
+        transform_point(matrix, x, y)
+        for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))
+    ])
+
+
+def pad_bbox(bbox, padding):
+    return (
+        bbox[0] - padding, bbox[1] - padding,
+        bbox[2] + padding, bbox[3] + padding
+    )
+
+
+def intersect_bbox(bbox1, bbox2):
+    if bbox1 is None:
+        return bbox2
+    if bbox2 is None:
+        return bbox1
+    return (
+        max(bbox1[0], bbox2[0]), max(bbox1[1], bbox2[1]),
+        min(bbox1[2], bbox2[2]), min(bbox1[3], bbox2[3])
+    )
+
+
+def intersects(bbox, rects):
+    return any(
+        bbox[0] < r[2] and bbox[2] > r[0] and bbox[1] < r[3] and bbox[3] > r[1]
+        for r in rects
+    )
+
+
+def get_page_box(page):
+    """
+    Returns the visible box of the page, the crop box
+    clipped to the media box
+    """
+    mediabox = get_inherited(page, '/MediaBox')
+    box = transform_bbox(IDENTITY, *[float(v) for v in mediabox])
+    cropbox = get_inherited(page, '/CropBox')
+    if cropbox is not None:
+        box = intersect_bbox(
+            box, transform_bbox(IDENTITY, *[float(v) for v in cropbox])
+        )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        raise VectorRedactionError('Empty page box')
+    return box
+
+
+def get_pdf_rects(instr, page_box):
+    """
+    Convert rects from viewer coordinates (top left origin, visible
+    page rendered at instr['width']) to PDF user space boxes
+    (x0, y0, x1, y1)
+    """
+    x0, y0, x1, y1 = page_box
+    scale = (x1 - x0) / float(instr['width'])
+    p = RECT_PADDING
+    rects = []
+    for left, top, width, height in instr['rects']:
+        rects.append((
+            x0 + (left - p) * scale,
+            y1 - (top + height + p) * scale,
+            x0 + (left + width + p) * scale,
+            y1 - (top - p) * scale,
+        ))
+    return rects
+
+
+class FontWidths(object):
+    def __init__(self, font):
+        subtype = font.get('/Subtype')
+        self.default_width = 0
+        self.widths = {}
+        if subtype == '/Type0':
+            encoding = font.get('/Encoding')
+            if encoding != '/Identity-H':
+                raise VectorRedactionError('Unsupported CMap %s' % encoding)
+            self.code_length = 2
+            descendant = font['/DescendantFonts'][0]
+            self.default_width = float(descendant.get('/DW', 1000))
+            self.parse_cid_widths(descendant.get('/W', []))
+        elif subtype in ('/Type1', '/TrueType', '/MMType1'):
+            if '/Widths' not in font:
+                raise VectorRedactionError('Font without widths')
+            self.code_length = 1
+            first_char = int(font.get('/FirstChar', 0))
+            for i, width in enumerate(font['/Widths']):
+                self.widths[first_char + i] = float(width)
+            descriptor = font.get('/FontDescriptor')
+            if descriptor is not None:
+                self.default_width = float(descriptor.get('/MissingWidth', 0))
+        else:
+            raise VectorRedactionError('Unsupported font type %s' % subtype)
+
+    def parse_cid_widths(self, w_array):
+        items = list(w_array)
+        i = 0
+        while i < len(items):
+            first = int(items[i])
+            if isinstance(items[i + 1], pikepdf.Array):
+                for j, width in enumerate(items[i + 1]):
+                    self.widths[first + j] = float(width)
+                i += 2
+            else:
+                last = int(items[i + 1])
+                for code in range(first, last + 1):
+                    self.widths[code] = float(items[i + 2])
+                i += 3
+
+    def get_glyphs(self, data):
+        for i in range(0, len(data) - self.code_length + 1, self.code_length):
+            code_bytes = data[i:i + self.code_length]
+            code = int.from_bytes(code_bytes, 'big')
+            yield code_bytes, self.widths.get(code, self.default_width)
+
+
+class TextState(object):
+    def __init__(self):
+        self.font = None
+        self.font_size = 0
+        self.char_spacing = 0
+        self.word_spacing = 0
+        self.scale = 1
+        self.leading = 0
+        self.rise = 0
+
+    def copy(self):
+        state = TextState()
+        state.__dict__.update(self.__dict__)
+        return state
+
+
+class ContentRedactor(object):
+    def __init__(self, pdf, page, rects):
+        self.pdf = pdf
+        self.page = page
+        self.rects = rects
+        self.fonts = {}
+        self.redacted_images = {}
+        self.new_xobjects = {}
+        self.original_images = set()
+        self.placements = defaultdict(set)
+        resources = get_inherited(page, '/Resources', pikepdf.Dictionary())
+        self.resources = resources
+        self.font_resources = resources.get('/Font', pikepdf.Dictionary())
+        self.xobjects = resources.get('/XObject', pikepdf.Dictionary())
+
+    def get_font(self, name):
+        if name not in self.fonts:
+            if name not in self.font_resources:
+                raise VectorRedactionError('Missing font %s' % name)
+            self.fonts[name] = FontWidths(self.font_resources[name])
+        return self.fonts[name]
+
+    def redact(self):
+        ctm = IDENTITY
+        text = TextState()
+        stack = []
+        tm = tlm = IDENTITY
+        # Path points in device space, clip box of the graphics state
+        path = []
+        line_width = 1.0
+        clip = None
+        pending_clip = False
+        output = []
+        for operands, operator in pikepdf.parse_content_stream(self.page):
+            op = str(operator)
+            if op == 'q':
+                stack.append((ctm, text.copy(), line_width, clip))
+            elif op == 'Q':
+                if stack:
+                    ctm, text, line_width, clip = stack.pop()
+            elif op == 'cm':
+                ctm = mult(tuple(float(x) for x in operands), ctm)
+            elif op == 'w':
+                line_width = float(operands[0])
+            elif op in PATH_POINT_OPERATORS:
+                values = [float(x) for x in operands]
+                path.extend(
+                    transform_point(ctm, values[i], values[i + 1])
+                    for i in range(0, len(values), 2)
+                )
+            elif op == 're':
+                x, y, w, h = [float(x) for x in operands]
+                path.extend(
+                    transform_point(ctm, px, py)
+                    for px, py in ((x, y), (x + w, y), (x, y + h),
+                                   (x + w, y + h))
+                )
+            elif op in ('W', 'W*'):
+                pending_clip = True
+            elif op in PATH_PAINT_OPERATORS or op == 'n':
+                if path:
+                    bbox = get_points_bbox(path)
+                    if op != 'n':
+                        self.check_path(bbox, line_width, ctm)
+                    if pending_clip:
+                        clip = intersect_bbox(clip, bbox)
+                path = []
+                pending_clip = False
+            elif op == 'sh':
+                self.check_shading(operands[0], ctm, clip)
+            elif op == 'BT':
+                tm = tlm = IDENTITY
+            elif op == 'Tf':
+                text.font = str(operands[0])
+                text.font_size = float(operands[1])
+            elif op == 'Tc':
+                text.char_spacing = float(operands[0])
+            elif op == 'Tw':
+                text.word_spacing = float(operands[0])
+            elif op == 'Tz':
+                text.scale = float(operands[0]) / 100
+            elif op == 'TL':
+                text.leading = float(operands[0])
+            elif op == 'Ts':
+                text.rise = float(operands[0])
+            elif op in ('Td', 'TD'):
+                tx, ty = float(operands[0]), float(operands[1])
+                if op == 'TD':
+                    text.leading = -ty
+                tm = tlm = mult(translate(tx, ty), tlm)
+            elif op == 'Tm':
+                tm = tlm = tuple(float(x) for x in operands)
+            elif op == 'T*':
+                tm = tlm = mult(translate(0, -text.leading), tlm)
+            elif op in ('Tj', 'TJ', "'", '"'):
+                if op in ("'", '"'):
+                    if op == '"':
+                        text.word_spacing = float(operands[0])
+                        text.char_spacing = float(operands[1])
+                        output.append(([operands[0]], Operator('Tw')))
+                        output.append(([operands[1]], Operator('Tc')))
+                    tm = tlm = mult(translate(0, -text.leading), tlm)
+                    output.append(([], Operator('T*')))
+                    operands = [operands[-1]]
+                items = operands[0] if op == 'TJ' else [operands[0]]
+                tm, new_items = self.redact_text(items, text, tm, ctm)
+                if new_items is None:
+                    if op in ("'", '"'):
+                        output.append(([operands[0]], Operator('Tj')))
+                    else:
+                        output.append((operands, operator))
+                else:
+                    output.append(([pikepdf.Array(new_items)], Operator('TJ')))
+                continue
+            elif op == 'Do':
+                self.placements[str(operands[0])].add(ctm)
+                operand = self.redact_xobject(operands[0], ctm)
+                output.append(([operand], operator))
+                continue
+            elif op == 'INLINE IMAGE':
+                if intersects(transform_bbox(ctm, 0, 0, 1, 1), self.rects):
+                    raise VectorRedactionError('Inline image under redaction')
+            output.append((operands, operator))
+        for name in self.new_xobjects:
+            if len(self.placements[name]) > 1:
+                # The replaced image would be used for every placement
+                raise VectorRedactionError('Image placed more than once')
+        return output
+
+    def check_path(self, bbox, line_width, ctm):
+        # Strokes extend beyond the path by half the line width
+        a, b, c, d, e, f = ctm
+        scale = max(abs(a) + abs(c), abs(b) + abs(d))
+        bbox = pad_bbox(bbox, max(line_width, 1) / 2 * scale)
+        if intersects(bbox, self.rects):
+            raise VectorRedactionError('Path under redaction')
+
+    def check_shading(self, name, ctm, clip):
+        """
+        Shadings paint the current clip region,
+        limited by their bounding box
+        """
+        shadings = self.resources.get('/Shading', pikepdf.Dictionary())
+        shading = shadings.get(name)
+        if shading is None:
+            return
+        bbox = clip
+        if '/BBox' in shading:
+            bbox = intersect_bbox(
+                bbox,
+                transform_bbox(ctm, *[float(x) for x in shading.BBox])
+            )
+        if bbox is None or intersects(bbox, self.rects):
+            raise VectorRedactionError('Shading under redaction')
+
+    def redact_text(self, items, text, tm, ctm):
+        """
+        Returns new text matrix and new TJ items
+        or None if nothing needs to be removed.
+        """
+        font = self.get_font(text.font)
+        if text.font_size == 0:
+            raise VectorRedactionError('Zero font size')
+        new_items = []
+        changed = False
+        for item in items:
+            if not isinstance(item, pikepdf.String):
+                tx = -float(item) / 1000 * text.font_size * text.scale
+                tm = mult(translate(tx, 0), tm)
+                new_items.append(item)
+                continue
+            kept = b''
+            for code_bytes, width in font.get_glyphs(bytes(item)):
+                spacing = text.char_spacing
+                if font.code_length == 1 and code_bytes == b' ':
+                    spacing += text.word_spacing
+                advance = width / 1000 * text.font_size + spacing
+                trm = mult(
+                    (text.font_size * text.scale, 0, 0, text.font_size, 0,
+                     text.rise),
+                    mult(tm, ctm)
+                )
+                bbox = transform_bbox(
+                    trm, 0, GLYPH_DESCENT, width / 1000, GLYPH_ASCENT
+                )
+                tm = mult(translate(advance * text.scale, 0), tm)
+                if intersects(bbox, self.rects):
+                    changed = True
+                    if kept:
+                        new_items.append(pikepdf.String(kept))
+                        kept = b''
+                    new_items.append(-advance * 1000 / text.font_size)
+                else:
+                    kept += code_bytes
+            if kept:
+                new_items.append(pikepdf.String(kept))
+        if not changed:
+            return tm, None
+        return tm, new_items
+
+    def get_xobject_bbox(self, xobject, ctm):
+        if xobject.get('/Subtype') != '/Form':
+            # Images are painted into the unit square
+            return transform_bbox(ctm, 0, 0, 1, 1)
+        matrix = tuple(
+            float(x) for x in xobject.get('/Matrix', IDENTITY)
+        )
+        x0, y0, x1, y1 = [float(x) for x in xobject.BBox]
+        return transform_bbox(mult(matrix, ctm), x0, y0, x1, y1)
+
+    def redact_xobject(self, name, ctm):
+        xobject = self.xobjects.get(name)
+        if xobject is None:
+            return name
+        bbox = self.get_xobject_bbox(xobject, ctm)
+        if not intersects(bbox, self.rects):
+            return name
+        if xobject.get('/Subtype') != '/Image':
+            raise VectorRedactionError('Form XObject under redaction')
+        if xobject.get('/ImageMask', False) or '/Decode' in xobject:
+            raise VectorRedactionError('Unsupported image type')
+        a, b, c, d, e, f = ctm
+        if b != 0 or c != 0:
+            raise VectorRedactionError('Rotated or skewed image')
+        if str(name) in self.redacted_images:
+            return name
+        self.redacted_images[str(name)] = ctm
+        # Replaces the image under its name, the original
+        # must not stay referenced by the page
+        self.new_xobjects[str(name)] = self.redact_image(xobject, ctm)
+        self.original_images.add(xobject.objgen)
+        return name
+
+    def fill_rects(self, pil_image, ctm, fill):
+        a, b, c, d, e, f = ctm
+        width, height = pil_image.size
+        draw = ImageDraw.Draw(pil_image)
+        for rect in self.rects:
+            # Map user space rect to image pixels, image origin is top left
+            x0 = (rect[0] - e) / a * width
+            x1 = (rect[2] - e) / a * width
+            y0 = (1 - (rect[1] - f) / d) * height
+            y1 = (1 - (rect[3] - f) / d) * height
+            box = [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+            if box[2] < 0 or box[3] < 0 or box[0] > width or box[1] > height:
+                continue
+            draw.rectangle(box, fill=fill)
+
+    def decode_image(self, xobject):
+        try:
+            return pikepdf.PdfImage(xobject).as_pil_image()
+        except Exception as err:
+            raise VectorRedactionError('Image not decodable: %s' % err)
+
+    def redact_image(self, xobject, ctm):
+        pil_image = self.decode_image(xobject)
+        if pil_image.mode not in ('RGB', 'L'):
+            pil_image = pil_image.convert('RGB')
+        width, height = pil_image.size
+        self.fill_rects(pil_image, ctm, 0)
+
+        out = io.BytesIO()
+        pil_image.save(out, format='JPEG', quality=85)
+        image = pikepdf.Stream(self.pdf, out.getvalue())
+        image.Type = Name.XObject
+        image.Subtype = Name.Image
+        image.Width = width
+        image.Height = height
+        image.BitsPerComponent = 8
+        image.ColorSpace = (
+            Name.DeviceGray if pil_image.mode == 'L' else Name.DeviceRGB
+        )
+        image.Filter = Name.DCTDecode
+        if '/SMask' in xobject:
+            image.SMask = self.redact_soft_mask(xobject.SMask, ctm)
+        return image
+
+    def redact_soft_mask(self, smask, ctm):
+        """
+        Makes the mask opaque under the rects,
+        so the shape of the redacted content is not kept
+        """
+        if '/Matte' in smask or '/Decode' in smask:
+            raise VectorRedactionError('Unsupported soft mask')
+        mask = self.decode_image(smask).convert('L')
+        self.fill_rects(mask, ctm, 255)
+        width, height = mask.size
+        image = pikepdf.Stream(self.pdf, zlib.compress(mask.tobytes()))
+        image.Type = Name.XObject
+        image.Subtype = Name.Image
+        image.Width = width
+        image.Height = height
+        image.BitsPerComponent = 8
+        image.ColorSpace = Name.DeviceGray
+        image.Filter = Name.FlateDecode
+        return self.pdf.make_indirect(image)
+
+
+def get_rect_ops(rects):
+    ops = [([], Operator('q')), ([0], Operator('g'))]
+    for x0, y0, x1, y1 in rects:
+        ops.append(([x0, y0, x1 - x0, y1 - y0], Operator('re')))
+    ops.append(([], Operator('f')))
+    ops.append(([], Operator('Q')))
+    return ops
+
+
+def get_inherited(page, key, default=None):
+    node = page
+    while node is not None:
+        if key in node:
+            return node[key]
+        node = node.get('/Parent')
+    return default
+
+
+def redact_page(pdf, page, instr):
+    if int(get_inherited(page, '/Rotate', 0)) % 360 != 0:
+        raise VectorRedactionError('Rotated page')
+    rects = get_pdf_rects(instr, get_page_box(page))
+    redactor = ContentRedactor(pdf, page, rects)
+    ops = redactor.redact()
+
+    ops = [([], Operator('q'))] + ops + [([], Operator('Q'))]
+    ops += get_rect_ops(rects)
+    page.Contents = pdf.make_indirect(pikepdf.Stream(
+        pdf, pikepdf.unparse_content_stream(ops)
+    ))
+    if redactor.new_xobjects:
+        # Copy resources so other pages sharing them are not affected
+        resources = pikepdf.Dictionary(
+            get_inherited(page, '/Resources', pikepdf.Dictionary())
+        )
+        xobjects = pikepdf.Dictionary(
+            resources.get('/XObject', pikepdf.Dictionary())
+        )
+        for name, image in redactor.new_xobjects.items():
+            xobjects[name] = pdf.make_indirect(image)
+        resources.XObject = xobjects
+        page.Resources = resources
+    if '/Annots' in page:
+        del page['/Annots']
+    return redactor.original_images
+
+
+def remove_unused_images(pdf, objgens, skip_pages):
+    """
+    Drops resource entries of replaced original images from pages
+    that don't paint them, so the unredacted streams are not
+    written with pages that share resources with a redacted page.
+    """
+    for page_idx, page in enumerate(pdf.pages):
+        if page_idx in skip_pages:
+            continue
+        page = getattr(page, 'obj', page)
+        resources = get_inherited(page, '/Resources')
+        if resources is None or '/XObject' not in resources:
+            continue
+        names = [
+            name for name, xobject in resources.XObject.items()
+            if xobject.objgen in objgens
+        ]
+        if not names:
+            continue
+        painted = {
+            str(operands[0])
+            for operands, operator in pikepdf.parse_content_stream(page)
+            if str(operator) == 'Do'
+        }
+        unused = [name for name in names if name not in painted]
+        if not unused:
+            continue
+        resources = pikepdf.Dictionary(resources)
+        xobjects = pikepdf.Dictionary(resources.XObject)
+        for name in unused:
+            del xobjects[name]
+        resources.XObject = xobjects
+        page.Resources = resources
+
+
+def redact_pdf_vector(pdf_filename, output_filename, page_instructions,
+                      password=None):
+    """
+    Vector redacts all pages with rects and writes output_filename.
+    Returns the list of page indexes where vector redaction failed
+    and that still need to be redacted by rasterisation.
+    """
+    PILImage.MAX_IMAGE_PIXELS = int(1024 * 1024 * 1024 // 1 // 3)
+    failed = []
+    original_images = set()
+    with pikepdf.open(pdf_filename, password=password or '') as pdf:
+        for page_idx, instr in enumerate(page_instructions):
+            if not instr['rects']:
+                continue
+            page = pdf.pages[page_idx]
+            # pikepdf >= 2 wraps page dictionaries
+            page = getattr(page, 'obj', page)
+            try:
+                original_images |= redact_page(pdf, page, instr)
+            except (VectorRedactionError, pikepdf.PdfError,
+                    ValueError, KeyError, IndexError) as e:
+                logger.info(
+                    'Vector redaction failed on page %s: %s', page_idx + 1, e
+                )
+                failed.append(page_idx)
+        if original_images:
+            remove_unused_images(pdf, original_images, set(failed))
+        pdf.save(output_filename)
+    return failed
@@ -11,11 +11,14 @@ class PublicBodyConfig(AppConfig):
         from froide.account import account_merged
         from froide.account.export import registry
         from froide.helper.search import search_registry
+        from froide.helper.search.cache import connect_facet_model
+        from .models import Jurisdiction
         from .utils import export_user_data
 
         registry.register(export_user_data)
         account_merged.connect(merge_user)
         search_registry.register(add_search)
+        connect_facet_model(Jurisdiction)
 
 
 def add_search(request):
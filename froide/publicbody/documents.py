@@ -1,8 +1,8 @@
-from django_elasticsearch_dsl import Document, fields
+from django_elasticsearch_dsl import fields
 from django_elasticsearch_dsl.registries import registry
 
 from froide.helper.search import (
-    get_index, get_text_analyzer, get_ngram_analyzer
+    SearchDocument, get_index, get_text_analyzer, get_ngram_analyzer
 )
 
 from .models import PublicBody
@@ -16,7 +16,7 @@ ngram_analyzer = get_ngram_analyzer()
 
 @registry.register_document
 @index.document
-class PublicBodyDocument(Document):
+class PublicBodyDocument(SearchDocument):
     name = fields.TextField(
         fields={'raw': fields.KeywordField()},
         analyzer=analyzer,
@@ -68,13 +68,12 @@ class PublicBodyDocument(Document):
     def prepare_classification(self, obj):
         if obj.classification is None:
             return []
-        return [obj.classification.id] + [c.id for c in
-                obj.classification.get_ancestors()]
+        return [obj.classification.id] + obj.classification.ancestor_ids
 
     def prepare_categories(self, obj):
         cats = obj.categories.all()
         return [o.id for o in cats] + [
-                c.id for o in cats for c in o.get_ancestors()]
+                c for o in cats for c in o.ancestor_ids]
 
     def prepare_regions(self, obj):
         regs = obj.regions.all()
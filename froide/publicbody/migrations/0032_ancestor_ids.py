@@ -0,0 +1,39 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:00
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+def set_ancestor_ids(apps, schema_editor):
+    steplen = 4
+    for model_name in ('Category', 'Classification'):
+        model = apps.get_model('publicbody', model_name)
+        path_ids = dict(model.objects.values_list('path', 'id'))
+        for path, pk in path_ids.items():
+            ancestor_ids = [
+                path_ids[path[0:pos]]
+                for pos in range(steplen, len(path), steplen)
+                if path[0:pos] in path_ids
+            ]
+            model.objects.filter(pk=pk).update(ancestor_ids=ancestor_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publicbody', '0031_publicbody_change_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='ancestor_ids',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='classification',
+            name='ancestor_ids',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(set_ancestor_ids, migrations.RunPython.noop),
+    ]
@@ -233,6 +233,41 @@ class TaggedPublicBody(TaggedItemBase):
         verbose_name_plural = _('Tagged Public Bodies')
 
 
+class AncestorIdsMixin(object):
+    """
+    Keeps ids of all ancestors (root first) in ancestor_ids
+    so they don't need to be queried from the tree
+    """
+    def get_ancestor_paths(self):
+        return [
+            self.path[0:pos]
+            for pos in range(self.steplen, len(self.path), self.steplen)
+        ]
+
+    def compute_ancestor_ids(self):
+        paths = self.get_ancestor_paths()
+        if not paths:
+            return []
+        id_map = dict(
+            self.__class__.objects.filter(path__in=paths)
+            .values_list('path', 'id')
+        )
+        return [id_map[p] for p in paths if p in id_map]
+
+    def update_subtree_ancestor_ids(self):
+        klass = self.__class__
+        node = klass.objects.get(pk=self.pk)
+        for descendant in klass.get_tree(node):
+            klass.objects.filter(pk=descendant.pk).update(
+                ancestor_ids=descendant.compute_ancestor_ids()
+            )
+
+    def move(self, target, pos=None):
+        # Moves rewrite paths with queryset updates
+        super().move(target, pos=pos)
+        self.update_subtree_ancestor_ids()
+
+
 class CategoryManager(MP_NodeManager):
     def get_category_list(self):
         count = models.Count('categorized_publicbodies')
@@ -242,8 +277,9 @@ class CategoryManager(MP_NodeManager):
         )
 
 
-class Category(TagBase, MP_Node):
+class Category(AncestorIdsMixin, TagBase, MP_Node):
     is_topic = models.BooleanField(_('as topic'), default=False)
+    ancestor_ids = JSONField(default=list, blank=True, editable=False)
 
     node_order_by = ['name']
     objects = CategoryManager()
@@ -261,6 +297,7 @@ class Category(TagBase, MP_Node):
             )
             self.pk = obj.pk
         else:
+            self.ancestor_ids = self.compute_ancestor_ids()
             TagBase.save(self, *args, **kwargs)
 
 
@@ -274,9 +311,10 @@ class CategorizedPublicBody(TaggedItemBase):
         verbose_name_plural = _('Categorized Public Bodies')
 
 
-class Classification(MP_Node):
+class Classification(AncestorIdsMixin, MP_Node):
     name = models.CharField(_("name"), max_length=255)
     slug = models.SlugField(_("slug"), max_length=255)
+    ancestor_ids = JSONField(default=list, blank=True, editable=False)
 
     node_order_by = ['name']
 
@@ -287,6 +325,10 @@ class Classification(MP_Node):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.ancestor_ids = self.compute_ancestor_ids()
+        super().save(*args, **kwargs)
+
 
 class PublicBodyManager(CurrentSiteManager):
     def get_queryset(self):
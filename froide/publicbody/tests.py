@@ -8,7 +8,7 @@ from django.urls import reverse
 from froide.foirequest.tests import factories
 from froide.helper.csv_utils import export_csv_bytes
 
-from .models import PublicBody, FoiLaw, Jurisdiction
+from .models import PublicBody, FoiLaw, Jurisdiction, Classification
 from .csv_import import CSVImporter
 
 
@@ -192,3 +192,17 @@ class ApiTest(TestCase):
         self.assertEqual(response.status_code, 200)
         obj = json.loads(response.content.decode('utf-8'))
         self.assertEqual(obj['objects']['results'], [])
+
+
+class ClassificationTreeTest(TestCase):
+    def test_ancestor_ids(self):
+        root = Classification.add_root(name='Root', slug='root')
+        child = root.add_child(name='Child', slug='child')
+        grandchild = child.add_child(name='Grandchild', slug='grandchild')
+        self.assertEqual(root.ancestor_ids, [])
+        self.assertEqual(grandchild.ancestor_ids, [root.id, child.id])
+
+        other = Classification.add_root(name='Other', slug='other')
+        child.move(other, pos='sorted-child')
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.ancestor_ids, [other.id, child.id])
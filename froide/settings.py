@@ -1,6 +1,7 @@
 import os
 import sys
 import re
+import tempfile
 
 from django.utils.translation import gettext_lazy as _
 
@@ -406,6 +407,10 @@ class Base(Configuration):
         'upload-maintenance': {
             'task': 'froide.upload.tasks.remove_expired_uploads',
             'schedule': crontab(hour=3, minute=30)
+        },
+        'conversion-cache-maintenance': {
+            'task': 'froide.helper.tasks.prune_conversion_cache_task',
+            'schedule': crontab(hour=2, minute=30)
         }
     }
 
@@ -414,13 +419,19 @@ class Base(Configuration):
     CELERY_TASK_ROUTES = {
         'froide.foirequest.tasks.fetch_mail': {"queue": "emailfetch"},
         'froide.foirequest.tasks.process_mail': {"queue": "email"},
+        'froide.foirequest.tasks.process_spooled_mail': {"queue": "email"},
         'djcelery_email_send_multiple': {"queue": "emailsend"},
+        # Before the wildcard, runs where conversions are cached
+        'froide.helper.tasks.prune_conversion_cache_task': {"queue": "convert"},
         'froide.helper.tasks.*': {"queue": "searchindex"},
+        'froide.document.tasks.update_document_index': {"queue": "searchindex"},
         'froide.foirequest.tasks.redact_attachment_task': {"queue": "redact"},
         'froide.foirequest.tasks.ocr_pdf_task': {"queue": "ocr"},
         'filingcabinet.tasks.*': {"queue": "document"},
         'froide.foirequest.tasks.convert_images_to_pdf_task': {"queue": "convert"},
         'froide.foirequest.tasks.convert_attachment_task': {"queue": "convert_office"},
+        'froide.foirequestfollower.tasks.update_followers': {"queue": "followers"},
+        'froide.foirequestfollower.tasks.update_followers_chunk': {"queue": "followers"},
     }
     CELERY_TIMEZONE = 'UTC'
     # We need to serialize email data as binary
@@ -444,6 +455,18 @@ class Base(Configuration):
         },
     }
     ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'django_elasticsearch_dsl.signals.RealTimeSignalProcessor'
+    # Seconds index updates are collected before they are sent in bulk
+    SEARCH_INDEX_UPDATE_DEBOUNCE = values.IntegerValue(5)
+    SEARCH_INDEX_UPDATE_BATCH_SIZE = values.IntegerValue(500)
+    # Seconds anonymous search result pages are cached at most,
+    # they are also invalidated when the index changes
+    SEARCH_RESULT_CACHE_TIMEOUT = values.IntegerValue(60)
+    SEARCH_FACET_CACHE_TIMEOUT = values.IntegerValue(60 * 60)
+    # Render list results from document source instead of
+    # loading the hits from the database, needs a reindex
+    SEARCH_SOURCE_RESULTS = values.BooleanValue(False)
+    # Log search queries slower than this many milliseconds, 0 disables
+    SEARCH_SLOW_QUERY_MS = values.IntegerValue(1000)
 
     # ######### API #########
 
@@ -538,6 +561,33 @@ class Base(Configuration):
 
     TESSERACT_DATA_PATH = values.Value('/usr/local/share/tessdata')
 
+    # Number of processes that redact pages of one document in parallel
+    FOI_REDACTION_WORKERS = values.IntegerValue(1)
+    # 'raster' or 'vector' (falls back to raster per page)
+    FOI_REDACTION_BACKEND = values.Value('raster')
+
+    # Reuse output of document conversions and OCR for identical inputs
+    FOI_CONVERSION_CACHE = values.BooleanValue(True)
+    FOI_CONVERSION_CACHE_ROOT = values.Value(os.path.abspath(
+        os.path.join(PROJECT_ROOT, "..", "conversion-cache")))
+    # Least recently used outputs are removed daily above this size
+    FOI_CONVERSION_CACHE_MAX_SIZE = values.IntegerValue(10 * 1024 ** 3)
+    # Socket of the run_conversion_service command,
+    # empty to start a new office process per conversion
+    FOI_CONVERSION_SERVICE_ADDRESS = values.Value('')
+    FOI_CONVERSION_SERVICE_WORKERS = values.IntegerValue(2)
+    # Seconds one office conversion may take, timeouts of the conversion
+    # service and time limits of conversion tasks are derived from it
+    FOI_CONVERSION_TIMEOUT = values.IntegerValue(50)
+
+    # Cache rendered messages on the request page per viewer class
+    FOI_MESSAGE_FRAGMENT_CACHE = values.BooleanValue(False)
+    FOI_MESSAGE_FRAGMENT_CACHE_VIEWERS = values.ListValue(
+        ['anonymous', 'owner', 'moderator']
+    )
+    # Must stay below the two hours comment forms are valid
+    FOI_MESSAGE_FRAGMENT_CACHE_TIMEOUT = values.IntegerValue(60 * 60)
+
     # ###### Email ##############
 
     # Django settings
@@ -562,6 +612,18 @@ class Base(Configuration):
     FOI_EMAIL_ACCOUNT_NAME = values.Value("foi@example.com")
     FOI_EMAIL_ACCOUNT_PASSWORD = values.Value("")
     FOI_EMAIL_USE_SSL = values.BooleanValue(True)
+    # Number of mails fetched per IMAP round trip
+    FOI_EMAIL_FETCH_BATCH_SIZE = values.IntegerValue(50)
+    # Fetched mails are spooled here until processed,
+    # must be shared between fetching and processing workers
+    FOI_EMAIL_SPOOL_ROOT = values.Value(os.path.abspath(
+        os.path.join(PROJECT_ROOT, "..", "spool")))
+    # Store raw mail of undelivered messages in file storage
+    # instead of base64 encoded in the database
+    FOI_EMAIL_DEFERRED_STORE_FILES = values.BooleanValue(False)
+    # Not public, must be readable by web and mail workers
+    FOI_EMAIL_DEFERRED_ROOT = values.Value(os.path.abspath(
+        os.path.join(PROJECT_ROOT, "..", "deferred-mail")))
 
     # SMTP settings for sending FoI mail
     FOI_EMAIL_HOST_USER = values.Value(FOI_EMAIL_ACCOUNT_NAME)
@@ -657,6 +719,14 @@ class TestBase(Base):
     DEFAULT_FROM_EMAIL = 'info@example.com'
 
     FOI_EMAIL_DOMAIN = 'fragdenstaat.de'
+    FOI_EMAIL_SPOOL_ROOT = os.path.join(tempfile.gettempdir(), 'froide_test_spool')
+    FOI_EMAIL_DEFERRED_ROOT = os.path.join(
+        tempfile.gettempdir(), 'froide_test_deferred_mail'
+    )
+    FOI_CONVERSION_CACHE = False
+    FOI_CONVERSION_CACHE_ROOT = os.path.join(
+        tempfile.gettempdir(), 'froide_test_conversion_cache'
+    )
 
     CELERY_TASK_ALWAYS_EAGER = True
     CELERY_TASK_EAGER_PROPAGATES = True